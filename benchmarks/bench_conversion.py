@@ -0,0 +1,185 @@
+"""
+Benchmark of the conversion phases on synthetic metamodels of increasing size (see ecoregen.py).
+
+    $ python3 benchmarks/bench_conversion.py --sizes 100 1000 10000 50000 -o results.json
+    $ python3 benchmarks/bench_conversion.py --compare baseline.json results.json
+
+Each size runs in a fresh process. For every phase the harness records the wall time, the growth of the peak resident
+set size and, with --tracemalloc, the peak of the memory allocated by Python objects (lxml allocations are not
+traced). The results are saved as JSON so they can be compared between commits.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+sys.path.insert(0, here)
+
+import ecoregen  # noqa: E402
+from lxml import etree  # noqa: E402
+from ecore2yed import Converter, EcoreResource, Graph, LayeredLayout, ModelBuilder, parse_skeleton  # noqa: E402,E501
+
+default_sizes = [100, 1000, 10000, 50000]
+
+
+def max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@contextmanager
+def measure(phases, name, trace):
+    """
+    Record the time and memory of the enclosed phase in phases[name]
+    """
+    rss = max_rss_kb()
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    result = {'time': elapsed, 'rss_growth_kb': max_rss_kb() - rss}
+    if trace:
+        result['py_peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    phases[name] = result
+
+
+def run_size(directory, classes, options, trace):
+    """
+    Generate a metamodel with the given number of classes and measure its conversion. Runs in a worker process.
+    """
+    path = ecoregen.write_metamodel(directory, 'synthetic{}'.format(classes), classes, **options)
+    create_external = options.get('external', 0) > 0
+    phases = {}
+    with measure(phases, 'parse', trace):
+        tree = etree.parse(path)
+    with measure(phases, 'index', trace):
+        res = EcoreResource(tree)
+    builder = ModelBuilder(create_external, base_path=directory)
+    package = tree.getroot()
+    with measure(phases, 'add_eclasses', trace):
+        builder.add_eclasses(package)
+    with measure(phases, 'add_features', trace):
+        builder.add_features(package, res)
+    model = builder.release()
+    del builder, res, tree, package
+    with measure(phases, 'auto_layout', trace):
+        LayeredLayout(model).compute()
+    g = Graph()
+    with measure(phases, 'emit', trace):
+        g.add_model(model)
+    with measure(phases, 'serialize', trace):
+        etree.tostring(g.root, pretty_print=True)
+    nodes = len(g.root.findall('node'))
+    edges = len(g.root.findall('edge'))
+    del g, model
+    with measure(phases, 'parse_skeleton', trace):
+        tree = parse_skeleton(path)
+    del tree
+    output = os.path.join(directory, 'synthetic{}.graphml'.format(classes))
+    with measure(phases, 'convert_to_file', trace):
+        Converter(create_external).convert_to_file(path, output)
+    with measure(phases, 'convert_low_memory', trace):
+        Converter(create_external, low_memory=True).convert_to_file(path, output)
+    return {
+        'classes': classes,
+        'input_bytes': os.path.getsize(path),
+        'output_bytes': os.path.getsize(output),
+        'nodes': nodes,
+        'edges': edges,
+        'phases': phases,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=here, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, options, trace=False):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for classes in sizes:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(run_size, directory, classes, options, trace).result()
+            results.append(result)
+            print_result(result)
+    return {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'lxml': '.'.join(str(v) for v in etree.LXML_VERSION),
+        'options': options,
+        'results': results,
+    }
+
+
+def print_result(result):
+    print('{classes} classes ({nodes} nodes, {edges} edges, {input_bytes} input bytes)'.format(**result))
+    for name, phase in result['phases'].items():
+        extra = ''
+        if 'py_peak_kb' in phase:
+            extra = ', python peak {} KB'.format(phase['py_peak_kb'])
+        print('  {:<20} {:10.4f}s, rss +{} KB{}'.format(name, phase['time'], phase['rss_growth_kb'], extra))
+
+
+def compare(baseline, current):
+    """
+    Print the time ratio (current / baseline) of each phase for the sizes in both results
+    """
+    base = {r['classes']: r for r in baseline['results']}
+    print('Comparing {} against {}'.format(current.get('revision'), baseline.get('revision')))
+    for result in current['results']:
+        other = base.get(result['classes'])
+        if other is None:
+            continue
+        print('{} classes'.format(result['classes']))
+        for name, phase in result['phases'].items():
+            if name in other['phases']:
+                before = other['phases'][name]['time']
+                ratio = phase['time'] / before if before else float('inf')
+                print('  {:<20} {:10.4f}s -> {:10.4f}s ({:.2f}x)'.format(name, before, phase['time'], ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the conversion phases on synthetic metamodels.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes, help='the numbers of classes')
+    parser.add_argument('-o', type=str, dest='output', help='save the results to this JSON file')
+    parser.add_argument('--attributes', type=int, default=3, help='attributes per class')
+    parser.add_argument('--references', type=int, default=2, help='references per class')
+    parser.add_argument('--opposites', type=int, default=1, help='bidirectional references per class')
+    parser.add_argument('--supertypes', type=int, default=1, help='maximum super types per class')
+    parser.add_argument('--depth', type=int, default=0, help='nesting depth of eSubpackages')
+    parser.add_argument('--external', type=int, default=0, help='external references per class')
+    parser.add_argument('--annotations', type=int, default=0, help='eAnnotations details per class and feature')
+    parser.add_argument('--tracemalloc', action='store_true', help='trace the python memory of each phase (slower)')
+    parser.add_argument('--compare', type=str, nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='compare two saved results instead of running')
+    args = parser.parse_args()
+    if args.compare is not None:
+        with open(args.compare[0]) as f0, open(args.compare[1]) as f1:
+            compare(json.load(f0), json.load(f1))
+        return
+    options = {'attributes': args.attributes, 'references': args.references, 'opposites': args.opposites,
+               'supertypes': args.supertypes, 'depth': args.depth, 'external': args.external,
+               'annotations': args.annotations}
+    results = run(args.sizes, options, args.tracemalloc)
+    if args.output is not None:
+        with open(args.output, 'w') as fout:
+            json.dump(results, fout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Benchmark of the start-up cost of the script, which dominates the conversion of small metamodels.
+
+    $ python3 benchmarks/bench_startup.py --runs 20 -o startup.json
+    $ python3 benchmarks/bench_startup.py --compare baseline.json startup.json
+
+Every run is a fresh interpreter. The harness records the import time of the module (from python -X importtime, with
+the modules that take longest to import) and the wall time of end-to-end commands on a trivial metamodel. The module is
+byte-compiled first, so that the times do not include compiling it. The results are saved as JSON so they can be
+compared between commits.
+"""
+import argparse
+import json
+import os
+import platform
+import py_compile
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.join(here, '..')
+script = os.path.join(root, 'ecore2yed.py')
+
+TRIVIAL_ECORE = """<?xml version="1.0" encoding="UTF-8"?>
+<ecore:EPackage xmi:version="2.0" xmlns:xmi="http://www.omg.org/XMI" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xmlns:ecore="http://www.eclipse.org/emf/2002/Ecore" name="trivial" nsURI="http://example.org/trivial" nsPrefix="t">
+  <eClassifiers xsi:type="ecore:EClass" name="A">
+    <eStructuralFeatures xsi:type="ecore:EAttribute" name="name"
+        eType="ecore:EDataType http://www.eclipse.org/emf/2002/Ecore#//EString"/>
+    <eStructuralFeatures xsi:type="ecore:EReference" name="b" eType="#//B" containment="true"/>
+  </eClassifiers>
+  <eClassifiers xsi:type="ecore:EClass" name="B"/>
+</ecore:EPackage>
+"""
+
+CATALOG = """[Schema Location]
+http://example.org/other = other.ecore
+"""
+
+
+def parse_importtime(stderr):
+    """
+    :return: A dict of module names to their (self, cumulative) import times, in microseconds
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure_import(runs, top=10):
+    """
+    Measure the import time of the module
+    :return: The median import time (in seconds) and the modules with the largest median self time
+    """
+    totals = []
+    self_times = {}
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ecore2yed'], cwd=root,
+                                capture_output=True, text=True, check=True)
+        modules = parse_importtime(result.stderr)
+        totals.append(modules['ecore2yed'][1] / 1e6)
+        for name, (self_us, _) in modules.items():
+            self_times.setdefault(name, []).append(self_us / 1e6)
+    slowest = sorted(((statistics.median(t), name) for name, t in self_times.items()), reverse=True)[:top]
+    return {'time': statistics.median(totals), 'modules': {name: t for t, name in slowest}}
+
+
+def measure_command(args, runs, cwd):
+    """
+    Measure the wall time of running the interpreter with the given arguments
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       check=True)
+        times.append(time.perf_counter() - start)
+    return {'time': statistics.median(times), 'min': min(times)}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=here, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(runs):
+    py_compile.compile(script)
+    results = {'import': measure_import(runs)}
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'trivial.ecore'), 'w') as fout:
+            fout.write(TRIVIAL_ECORE)
+        with open(os.path.join(directory, 'catalog.ini'), 'w') as fout:
+            fout.write(CATALOG)
+        commands = {
+            'python': ['-c', 'pass'],   # The interpreter alone, the floor of all commands
+            'help': [script, '-h'],
+            'convert': [script, 'trivial.ecore'],
+            'convert_catalog': [script, 'trivial.ecore', '--catalog', 'catalog.ini'],
+        }
+        for name, args in commands.items():
+            results[name] = measure_command(args, runs, directory)
+    return {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'runs': runs,
+        'results': results,
+    }
+
+
+def print_results(results):
+    imported = results['results']['import']
+    print('import ecore2yed {:10.4f}s'.format(imported['time']))
+    for name, t in imported['modules'].items():
+        print('  {:<28} {:10.4f}s'.format(name, t))
+    for name, result in results['results'].items():
+        if name != 'import':
+            print('{:<16} {:10.4f}s (min {:.4f}s)'.format(name, result['time'], result['min']))
+
+
+def compare(baseline, current):
+    """
+    Print the time ratio (current / baseline) of each measure
+    """
+    print('Comparing {} against {}'.format(current.get('revision'), baseline.get('revision')))
+    for name, result in current['results'].items():
+        other = baseline['results'].get(name)
+        if other is not None:
+            before = other['time']
+            ratio = result['time'] / before if before else float('inf')
+            print('  {:<20} {:10.4f}s -> {:10.4f}s ({:.2f}x)'.format(name, before, result['time'], ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the start-up time of ecore2yed.')
+    parser.add_argument('--runs', type=int, default=10, help='the number of runs of each measure')
+    parser.add_argument('-o', type=str, dest='output', help='save the results to this JSON file')
+    parser.add_argument('--compare', type=str, nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='compare two saved results instead of running')
+    args = parser.parse_args()
+    if args.compare is not None:
+        with open(args.compare[0]) as f0, open(args.compare[1]) as f1:
+            compare(json.load(f0), json.load(f1))
+        return
+    results = run(args.runs)
+    print_results(results)
+    if args.output is not None:
+        with open(args.output, 'w') as fout:
+            json.dump(results, fout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Micro-benchmark of the construction of nodes and edges: building their elements from scratch versus cloning the
+per-style templates.
+
+    $ python3 benchmarks/bench_templates.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ecore2yed import EClassNode, EReferenceEdge  # noqa: E402
+
+
+def build_node(i):
+    node = EClassNode.build_template(False, False, 'd0', 'd2')
+    node.attrib['id'] = 'n{}'.format(i)
+    return node
+
+
+def clone_node(i):
+    return EClassNode('n{}'.format(i), False, 'd0', 'd2')
+
+
+def build_edge(i):
+    edge = EReferenceEdge.build_template(True, False, 'd1', 'd3')
+    edge.attrib.update({'id': 'e{}'.format(i), 'source': 'n0', 'target': 'n1'})
+    for position, placement, side in (('ttail', 'target', 'right'), ('thead', 'target', 'left')):
+        edge[0][0].append(EReferenceEdge.build_label(position, placement, side))
+    return edge
+
+
+def clone_edge(i):
+    e = EReferenceEdge('e{}'.format(i), 'n0', 'n1', 'd1', 'd3', containment=True)
+    e.create_labels('name', '0..1')
+    return e
+
+
+def per_call(function, number):
+    best = min(timeit.repeat(lambda: [function(i) for i in range(number)], number=1, repeat=5))
+    return best / number * 1e6
+
+
+def main(number=10000):
+    for name, build, clone in (('node', build_node, clone_node), ('edge', build_edge, clone_edge)):
+        built = per_call(build, number)
+        cloned = per_call(clone, number)
+        print('{}: build {:.2f} us, clone {:.2f} us ({:.1f}x)'.format(name, built, cloned, built / cloned))
+
+
+if __name__ == '__main__':
+    main()
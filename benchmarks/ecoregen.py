@@ -0,0 +1,180 @@
+"""
+Generator of synthetic Ecore metamodels, used to benchmark the conversion.
+
+    $ python3 benchmarks/ecoregen.py 1000 -o synthetic.ecore --depth 2 --external 1
+
+The classes are spread over a chain of nested eSubpackages. Each class gets the requested number of attributes,
+references, bidirectional references (eOpposite pairs), super types and references to an external metamodel, which is
+written next to the generated one. Classes and features can be documented with eAnnotations. The output is
+deterministic for a given seed.
+"""
+import argparse
+import os
+import random
+
+from lxml import etree
+
+XMI_NAMESPACE = 'http://www.omg.org/XMI'
+XSI_NAMESPACE = 'http://www.w3.org/2001/XMLSchema-instance'
+ECORE_NAMESPACE = 'http://www.eclipse.org/emf/2002/Ecore'
+
+xsi_type = '{{{0}}}type'.format(XSI_NAMESPACE)
+nsmap = {'xmi': XMI_NAMESPACE, 'xsi': XSI_NAMESPACE, 'ecore': ECORE_NAMESPACE}
+
+data_types = ['EString', 'EInt', 'EBoolean', 'EDouble', 'ELong']
+
+
+def new_package(name):
+    package = etree.Element('{{{0}}}EPackage'.format(ECORE_NAMESPACE), nsmap=nsmap)
+    package.attrib['{{{0}}}version'.format(XMI_NAMESPACE)] = '2.0'
+    package.attrib.update({'name': name, 'nsURI': 'http://example.org/{}'.format(name), 'nsPrefix': name})
+    return package
+
+
+def add_feature(clazz, kind, name, etype, **attrib):
+    sf = etree.SubElement(clazz, 'eStructuralFeatures')
+    sf.attrib[xsi_type] = kind
+    sf.attrib['name'] = name
+    sf.attrib.update(attrib)
+    sf.attrib['eType'] = etype
+    return sf
+
+
+def add_annotation(element, details):
+    annotation = etree.SubElement(element, 'eAnnotations', source='http://www.eclipse.org/emf/2002/GenModel')
+    for d in range(details):
+        etree.SubElement(annotation, 'details', key='documentation{}'.format(d),
+                         value='Synthetic documentation of {} '.format(element.attrib['name']) * 8)
+
+
+def generate(name, classes, attributes=3, references=2, opposites=1, supertypes=1, depth=0, external=0,
+             external_classes=100, external_file='external.ecore', annotations=0, seed=0):
+    """
+    Generate a synthetic metamodel
+    :param name: The name of the root package
+    :param classes: The number of classes
+    :param attributes: The number of attributes per class
+    :param references: The number of (unidirectional) references per class
+    :param opposites: The number of bidirectional references (eOpposite pairs) per class
+    :param supertypes: The maximum number of super types per class
+    :param depth: The nesting depth of eSubpackages. Classes are spread evenly over the depth + 1 packages.
+    :param external: The number of references to external classes per class
+    :param external_classes: The number of classes in the external metamodel
+    :param external_file: The location of the external metamodel, relative to the generated one
+    :param annotations: The number of eAnnotations details of each class and feature
+    :param seed: The random seed
+    :return: The root package element
+    """
+    rng = random.Random(seed)
+    root = new_package(name)
+    packages = [(root, '//')]
+    for level in range(1, depth + 1):
+        path = packages[-1][1]
+        sub_name = 'sub{}'.format(level)
+        sub = etree.Element('eSubpackages', name=sub_name, nsURI='http://example.org/{}/{}'.format(
+            name, '/'.join('sub{}'.format(l) for l in range(1, level + 1))), nsPrefix=sub_name)
+        packages.append((sub, path + sub_name + '/'))
+    eclasses = []
+    fragments = []
+    for i in range(classes):
+        package, path = packages[i * len(packages) // classes]
+        class_name = 'Class{}'.format(i)
+        clazz = etree.SubElement(package, 'eClassifiers')
+        clazz.attrib[xsi_type] = 'ecore:EClass'
+        clazz.attrib['name'] = class_name
+        if i % 7 == 0:
+            clazz.attrib['abstract'] = 'true'
+        eclasses.append(clazz)
+        fragments.append('#' + path + class_name)
+    # Subpackages follow the classifiers
+    for (parent, _), (sub, _) in zip(packages, packages[1:]):
+        parent.append(sub)
+    for i, clazz in enumerate(eclasses):
+        if i > 0 and supertypes > 0:
+            count = rng.randint(0, supertypes)
+            supers = sorted(set(rng.randrange(i) for _ in range(count)))
+            if supers:
+                clazz.attrib['eSuperTypes'] = ' '.join(fragments[s] for s in supers)
+        for a in range(attributes):
+            add_feature(clazz, 'ecore:EAttribute', 'attr{}'.format(a),
+                        'ecore:EDataType http://www.eclipse.org/emf/2002/Ecore#//' + rng.choice(data_types),
+                        lowerBound=str(rng.randint(0, 1)))
+        for r in range(references):
+            add_feature(clazz, 'ecore:EReference', 'ref{}'.format(r), fragments[rng.randrange(classes)],
+                        upperBound=rng.choice(['1', '-1']), containment=rng.choice(['true', 'false']))
+        for o in range(opposites):
+            t = rng.randrange(classes)
+            name_here = 'opp{}to{}'.format(o, t)
+            name_there = 'opp{}from{}'.format(o, i)
+            add_feature(clazz, 'ecore:EReference', name_here, fragments[t], upperBound='-1',
+                        eOpposite='{}/{}'.format(fragments[t], name_there))
+            add_feature(eclasses[t], 'ecore:EReference', name_there, fragments[i],
+                        eOpposite='{}/{}'.format(fragments[i], name_here))
+        for x in range(external):
+            add_feature(clazz, 'ecore:EReference', 'ext{}'.format(x),
+                        'ecore:EClass {}#//External{}'.format(external_file, rng.randrange(external_classes)))
+    if annotations > 0:
+        for clazz in eclasses:
+            for sf in clazz.iterchildren('eStructuralFeatures'):
+                add_annotation(sf, annotations)
+            add_annotation(clazz, annotations)
+    return root
+
+
+def generate_external(external_classes=100):
+    """
+    Generate the external metamodel referenced by the generated metamodels
+    :param external_classes: The number of classes
+    :return: The root package element
+    """
+    root = new_package('external')
+    for i in range(external_classes):
+        clazz = etree.SubElement(root, 'eClassifiers', name='External{}'.format(i))
+        clazz.attrib[xsi_type] = 'ecore:EClass'
+    return root
+
+
+def write(package, path):
+    etree.ElementTree(package).write(path, xml_declaration=True, encoding='UTF-8', pretty_print=True)
+
+
+def write_metamodel(directory, name, classes, external_classes=100, **options):
+    """
+    Generate a metamodel and its external metamodel in the directory
+    :param directory: The output directory
+    :param name: The name of the metamodel (and of the file)
+    :param classes: The number of classes
+    :param external_classes: The number of classes in the external metamodel
+    :param options: Other generate() options
+    :return: The location of the generated metamodel
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + '.ecore')
+    write(generate(name, classes, external_classes=external_classes, **options), path)
+    if options.get('external', 0) > 0:
+        write(generate_external(external_classes),
+              os.path.join(directory, options.get('external_file', 'external.ecore')))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Ecore metamodel.')
+    parser.add_argument('classes', type=int, help='the number of classes')
+    parser.add_argument('-o', type=str, dest='output', default='synthetic.ecore', help='the output ecore file')
+    parser.add_argument('--attributes', type=int, default=3, help='attributes per class')
+    parser.add_argument('--references', type=int, default=2, help='references per class')
+    parser.add_argument('--opposites', type=int, default=1, help='bidirectional references per class')
+    parser.add_argument('--supertypes', type=int, default=1, help='maximum super types per class')
+    parser.add_argument('--depth', type=int, default=0, help='nesting depth of eSubpackages')
+    parser.add_argument('--external', type=int, default=0, help='external references per class')
+    parser.add_argument('--annotations', type=int, default=0, help='eAnnotations details per class and feature')
+    parser.add_argument('--seed', type=int, default=0, help='the random seed')
+    args = parser.parse_args()
+    head, tail = os.path.split(args.output)
+    write_metamodel(head or '.', tail.split('.')[0], args.classes, attributes=args.attributes,
+                    references=args.references, opposites=args.opposites, supertypes=args.supertypes,
+                    depth=args.depth, external=args.external, annotations=args.annotations, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
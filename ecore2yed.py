@@ -1,25 +1,84 @@
-import argparse
-import configparser
+import copy
+import fnmatch
+import heapq
+import importlib
+import io
 import logging
+import math
 import os
+import sys
+import threading
+import time
 import warnings
 import re
+import select
+import struct
+from collections import Counter, OrderedDict, defaultdict, deque
+from contextlib import contextmanager, nullcontext
 
-from lxml import etree
+# Modules that only some commands need (argparse, configparser, gzip, http.server, json...) are imported where they
+# are used, so that the start-up of the script stays fast.
+
+
+class LazyModule:
+    """
+    A module that is imported when it is first used. The module global that holds it is then replaced by the module.
+    """
+
+    def __init__(self, name, global_name):
+        self.name = name
+        self.global_name = global_name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.name)
+        globals()[self.global_name] = module
+        return getattr(module, attr)
+
+
+etree = LazyModule('lxml.etree', 'etree')
 
 descmsg = 'Transform an Ecore metamodel to yed (graphml). For EReferences across metamodels, it assumes that the' \
           'referenced metamodel is accessible.'
 
-url_regex = re.compile(
+url_pattern = (
         r'^(?:http|ftp)s?://' # http:// or https://
         r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|' #domain...
         r'localhost|' #localhost...
         r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})' # ...or ip
         r'(?::\d+)?' # optional port
-        r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+        r'(?:/?|[/?]\S+)$')
+url_schemes = ('http://', 'https://', 'ftp://', 'ftps://')
+url_regex = None    # Compiled on first use, see is_url
+
+
+def is_url(ref):
+    """
+    Check if a metamodel reference is a URL (to look up in the catalog) rather than a file location
+    """
+    global url_regex
+    if not ref.lower().startswith(url_schemes):
+        return False    # Most references are relative locations, which do not need the regex
+    if url_regex is None:
+        url_regex = re.compile(url_pattern, re.IGNORECASE)
+    return url_regex.match(ref) is not None
+
+
+# Compression level of .graphmlz outputs when none is given
+default_compresslevel = 6
+
+# Threads that load the external metamodels of the input (the --prefetch default)
+default_prefetch = 4
+
+# The umask of the process, for the permissions of the files written through temporary files (see create_temp_file).
+# It can only be read by setting it, so it is read once, on import.
+file_umask = os.umask(0o022)
+os.umask(file_umask)
 
+# Node sizes, in pixels: the name label, each attribute line and the width of a label character
 base_height = 30
 attribute_height = 18
+char_width = 7
+min_width = 80
 
 
 class EcoreReferenceError(Exception):
@@ -71,39 +130,641 @@ y_ns = '{{{0}}}'.format(YWORKS_NAMESPACE)
 xmi_ns = '{{{0}}}'.format(XMI_NAMESPACE)
 ecore_ns = '{{{0}}}'.format(ECORE_NAMESPACE)
 
-element_to_node = dict()
-node_to_element = dict()
-xmi_id_to_element = dict()  # Map xmi IDs to yed ids
+# Nodes and edges declare the yworks prefix so they can be serialized on their own (see GraphMLWriter)
+y_nsmap = {'y': YWORKS_NAMESPACE}
 
-# Ecore location
+# The GraphML attribute that holds the stable key of nodes and edges (see Layout)
+stable_key_name = 'ecore.key'
+stable_id_regex = re.compile(r'[^A-Za-z0-9/-]')
 
-head = ""
-tail = ""
 
+def get_stable_id(prefix, key):
+    """
+    Derive a GraphML id from a stable key, so the ids do not change between conversions. Slashes become dots and the
+    characters that are not letters, digits or '-' are escaped as '_<hex code>_'.
+    :param prefix: The id prefix, e.g. 'n-' for nodes
+    :param key: The stable key, e.g. '//sub/Name'
+    :return: The id, e.g. 'n-sub.Name'
+    """
+    return prefix + stable_id_regex.sub(lambda m: '_{:x}_'.format(ord(m.group())), key.lstrip('/')).replace('/', '.')
 
-def get_element_for_node(node):
-    return node_to_element[node]
+
+def add_ecore_class_to_graph():
+    """
+    For metamodels that have EReferences and/or ESuperTypes to ECore classes, we can add this known EClasses to the
+    graph
+    :return:
+    """
+    pass
 
 
-def get_node_for_element(element):
-    try:
-        return element_to_node[element]
-    except KeyError:
-        return None
+def iter_epackage_paths(package):
+    """
+    Yield the package and all its nested eSubpackages (depth first), together with the list of subpackage names that
+    lead to them. Each package is visited exactly once.
+    :param package: The root EPackage element
+    :return:
+    """
+    stack = [(package, [])]
+    while stack:
+        p, path = stack.pop()
+        yield p, path
+        for sp in reversed(p.findall('eSubpackages')):
+            stack.append((sp, path + [sp.attrib.get('name', '')]))
 
 
-def set_node_for_element(element, node):
-    element_to_node[element] = node
-    node_to_element[node] = element
+def iter_epackages(package):
+    """
+    Yield the package and all its nested eSubpackages (depth first). Each package is visited exactly once.
+    :param package: The root EPackage element
+    :return:
+    """
+    for p, _ in iter_epackage_paths(package):
+        yield p
 
 
-def add_ecore_class_to_graph():
+def iter_eclassifiers(package):
     """
-    For metamodels that have EReferences and/or ESuperTypes to ECore classes, we can add this known EClasses to the
-    graph
+    Yield all the eClassifiers of the package and its nested eSubpackages. Each classifier is visited exactly once.
+    :param package: The root EPackage element
     :return:
     """
-    pass
+    for p in iter_epackages(package):
+        yield from p.iterchildren(tag='eClassifiers')
+
+
+# Elements that do not take part in the graph, dropped by parse_skeleton as soon as they are parsed
+skeleton_skipped_tags = ('eAnnotations', 'eOperations', 'eLiterals', 'eTypeParameters')
+
+
+def parse_skeleton(fin):
+    """
+    Parse an Ecore file in low-memory mode. The file is read with iterparse and the annotations (and their details),
+    operations, enumeration literals and type parameters are cleared and removed as soon as they are complete. Only
+    the skeleton the conversion needs remains: the packages, classifiers, structural features and their generic types.
+    References are resolved afterwards, from the EcoreResource of the skeleton.
+    :param fin: The input ecore file (file object or path)
+    :return: The tree of the skeleton
+    """
+    context = etree.iterparse(fin, events=('end',), tag=skeleton_skipped_tags, remove_blank_text=True,
+                              remove_comments=True)
+    for _, element in context:
+        element.clear()
+        parent = element.getparent()
+        if parent is not None:
+            parent.remove(element)
+    return etree.ElementTree(context.root)
+
+
+# The attributes that hold type references ('ecore:EClass other.ecore#//Name', space separated for eSuperTypes)
+type_ref_attributes = ('eType', 'eSuperTypes', 'eClassifier')
+
+
+def iter_metamodel_refs(package):
+    """
+    Scan the package for the external metamodels its type references point to
+    :param package: The package
+    :return: An iterator over the distinct metamodel references (URIs or relative locations), in document order. The
+        Ecore metamodel is not included.
+    """
+    refs = dict()
+    for element in package.iter(tag=etree.Element):
+        for name in type_ref_attributes:
+            value = element.get(name)
+            if value is None:
+                continue
+            for token in value.split():
+                mm_ref, _, _ = token.partition('#')
+                if mm_ref and mm_ref != ECORE_NAMESPACE and '#' in token:
+                    refs[mm_ref] = None
+    return iter(refs)
+
+
+def get_package_name(resource, fragment):
+    """
+    Get the name of the package that contains the classifier identified by the URI fragment, without looking the
+    classifier up
+    :param resource: The EcoreResource or IndexedResource
+    :param fragment: The fragment, e.g. '//Name', '//sub/Name' or '/1/Name'
+    :return: The name of the root package or of the innermost eSubpackage
+    """
+    segments = fragment.split('/')     # '//sub/Name' -> ['', '', 'sub', 'Name']
+    root = int(segments[1]) if len(segments) > 2 and segments[1].isdigit() else 0
+    if len(segments) > 3:
+        return segments[-2]
+    try:
+        return resource.packages[root].attrib['name']
+    except IndexError:
+        return resource.packages[0].attrib['name']
+
+
+class EcoreResource:
+    """
+    A parsed Ecore file. The resource indexes its EClassifiers by URI fragment (e.g. '//Name', '//sub/Name' or
+    '/1/Name' for multi-root resources) and its elements by xmi:id, so references can be resolved without querying
+    the tree.
+    """
+
+    def __init__(self, tree):
+        """
+        Create a new resource and build its indexes
+        :param tree: The parsed Ecore file
+        """
+        self.tree = tree
+        self.fragments = dict()
+        self.eclasses = dict()      # EClasses by name
+        self.features = dict()      # Structural features by (classifier, name)
+        self.ids = dict()
+        root = tree.getroot()
+        if root.tag == ecore_ns + 'EPackage':
+            self.packages = [root]
+        else:  # xmi:XMI with several root packages
+            self.packages = [p for p in root.iterchildren(ecore_ns + 'EPackage')]
+        for idx, package in enumerate(self.packages):
+            prefixes = ['/{}/'.format(idx)]
+            if idx == 0:
+                prefixes.append('//')
+            self._index_package(package, prefixes)
+
+    def _index_package(self, package, prefixes):
+        for p, path in iter_epackage_paths(package):
+            for c in p.iterchildren(tag='eClassifiers'):
+                segments = path + [c.attrib.get('name', '')]
+                for prefix in prefixes:
+                    self.fragments[prefix + '/'.join(segments)] = c
+                if c.attrib.get(xsi_ns + 'type') == 'ecore:EClass':
+                    self.eclasses.setdefault(c.attrib.get('name'), c)
+                    for sf in c.iterchildren(tag='eStructuralFeatures'):
+                        self.features[(c, sf.attrib.get('name'))] = sf
+        for element in package.iter():
+            xmi_id = element.attrib.get(xmi_ns + 'id', None)
+            if xmi_id is not None:
+                self.ids[xmi_id] = element
+
+    def get_classifier(self, fragment):
+        """
+        Find the EClassifier identified by the URI fragment
+        :param fragment: The fragment, without the leading '#'
+        :return: The element
+        :raises EcoreReferenceError: If there is no classifier for the fragment
+        """
+        try:
+            return self.fragments[fragment]
+        except KeyError:
+            raise EcoreReferenceError("Type not found {}. Make sure the source metamodel is valid.".format(fragment))
+
+    def get_eclass(self, fragment):
+        """
+        Find the EClass identified by the URI fragment. If the fragment does not identify an EClass, fall back to the
+        first EClass with the same name as the last segment of the fragment.
+        :param fragment: The fragment, without the leading '#'
+        :return: The element, or None if not found
+        """
+        element = self.fragments.get(fragment)
+        if element is not None and element.attrib.get(xsi_ns + 'type') == 'ecore:EClass':
+            return element
+        return self.eclasses.get(fragment.split('/')[-1])
+
+    def get_feature(self, classifier, name):
+        """
+        Find the structural feature of the classifier
+        :param classifier: The EClass
+        :param name: The name of the feature
+        :return: The feature, or None if the classifier is not in this resource or has no such feature
+        """
+        return self.features.get((classifier, name))
+
+    def get_element_by_id(self, xmi_id):
+        """
+        Find the element with the given xmi:id
+        :param xmi_id:
+        :return: The element
+        :raises EcoreReferenceError: If there is no element with the id
+        """
+        try:
+            return self.ids[xmi_id]
+        except KeyError:
+            raise EcoreReferenceError("No element with xmi:id {}.".format(xmi_id))
+
+
+class IndexedResource:
+    """
+    An external metamodel answered from a CatalogIndex entry, without parsing the Ecore file. Packages and EClasses
+    are represented by detached elements that only carry the attributes of the original ones.
+    """
+
+    def __init__(self, entry):
+        self.packages = [etree.Element(ecore_ns + 'EPackage', attrib) for attrib in entry['packages']]
+        self.fragments = entry['eclasses']
+        self.names = entry['names']
+        self.elements = dict()
+
+    def get_eclass(self, fragment):
+        """
+        Find the EClass identified by the URI fragment, or by the last segment of the fragment.
+        :param fragment: The fragment, without the leading '#'
+        :return: The element, or None if not found
+        """
+        if fragment not in self.fragments:
+            fragment = self.names.get(fragment.split('/')[-1])
+            if fragment is None:
+                return None
+        try:
+            return self.elements[fragment]
+        except KeyError:
+            element = etree.Element('eClassifiers', self.fragments[fragment])
+            self.elements[fragment] = element
+            return element
+
+
+def create_temp_file(path):
+    """
+    Create a temporary file with a unique name in the folder of the path, to be moved over it once complete. Unlike
+    tempfile.mkstemp, the file gets the permissions of a newly created file.
+    :return: A (file descriptor, location) tuple
+    """
+    import tempfile
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + '.',
+                               suffix='.tmp')
+    os.chmod(tmp, 0o666 & ~file_umask)
+    return fd, tmp
+
+
+def write_json(path, data):
+    """
+    Write the data to a JSON file atomically, through a temporary file with a unique name in the same folder
+    """
+    import json
+    fd, tmp = create_temp_file(path)
+    try:
+        with open(fd, 'w', encoding='utf-8') as fout:
+            json.dump(data, fout)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class CatalogIndex:
+    """
+    Persistent index of external metamodels, stored as a JSON file. For each metamodel file the index keeps its
+    packages and the attributes of its EClasses by fragment. Entries are keyed on the file path and are validated
+    against the file modification time and content hash, so changed files are re-indexed automatically.
+    """
+
+    version = 1
+
+    def __init__(self, path):
+        """
+        Load the index
+        :param path: The location of the index file. It is created on save if it does not exist.
+        """
+        self.path = path
+        self.entries = self.load_entries()
+        self.changed = set()    # The paths of the entries to write on save
+        self.lock = threading.Lock()
+
+    def load_entries(self):
+        """
+        :return: The entries of the index file, empty if it does not exist or has another version
+        """
+        import json
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fin:
+                data = json.load(fin)
+        except (OSError, ValueError):
+            return dict()
+        if data.get('version') != self.version:
+            return dict()
+        return data.get('entries', {})
+
+    def get_resource(self, path):
+        """
+        Get the resource for the Ecore file. If the index is up to date the file is not parsed.
+        :param path: The absolute location of the Ecore file
+        :return: An IndexedResource or, if the file had to be (re)indexed, the parsed EcoreResource. None if the file
+            could not be loaded.
+        """
+        import hashlib
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        entry = self.entries.get(path)
+        if entry is not None and entry['mtime'] == st.st_mtime_ns and entry['size'] == st.st_size:
+            return IndexedResource(entry)
+        try:
+            with open(path, 'rb') as fin:
+                content = fin.read()
+        except OSError:
+            return None
+        digest = hashlib.sha256(content).hexdigest()
+        if entry is not None and entry['sha256'] == digest:
+            with self.lock:
+                entry['mtime'] = st.st_mtime_ns
+                entry['size'] = st.st_size
+                self.changed.add(path)
+            return IndexedResource(entry)
+        resource = EcoreResource(etree.fromstring(content).getroottree())
+        entry = self.make_entry(resource, st, digest)
+        with self.lock:
+            self.entries[path] = entry
+            self.changed.add(path)
+        return resource
+
+    @staticmethod
+    def make_entry(resource, st, digest):
+        eclasses = dict()
+        for fragment, c in resource.fragments.items():
+            if c.attrib.get(xsi_ns + 'type') == 'ecore:EClass':
+                eclasses[fragment] = dict(c.attrib)
+        fragment_of = {c: fragment for fragment, c in resource.fragments.items()}
+        return {
+            'mtime': st.st_mtime_ns,
+            'size': st.st_size,
+            'sha256': digest,
+            'packages': [{k: v for k, v in p.attrib.items() if k in ('name', 'nsURI', 'nsPrefix')}
+                         for p in resource.packages],
+            'eclasses': eclasses,
+            'names': {name: fragment_of[c] for name, c in resource.eclasses.items()},
+        }
+
+    def save(self):
+        """
+        Write the index if it changed. The changed entries are merged into the current content of the file, so that
+        processes sharing the index (e.g. batch workers) do not drop each other's entries.
+        """
+        with self.lock:
+            if not self.changed:
+                return
+            entries = self.load_entries()
+            entries.update((path, self.entries[path]) for path in self.changed)
+            write_json(self.path, {'version': self.version, 'entries': entries})
+            self.entries.update(entries)
+            self.changed.clear()
+
+
+class Manifest:
+    """
+    Persistent record of the generated outputs, stored as a JSON file. For each output the manifest keeps the options
+    it was generated with and the fingerprint (modification time, size and content hash) of its input and of the
+    external metamodels the conversion loaded. An output is up to date while none of these changed.
+    """
+
+    version = 1
+
+    def __init__(self, path):
+        """
+        Load the manifest
+        :param path: The location of the manifest file. It is created on save if it does not exist.
+        """
+        import json
+        self.path = path
+        self.entries = dict()
+        self.dirty = False
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as fin:
+                data = json.load(fin)
+        except (OSError, ValueError):
+            pass
+        else:
+            if data.get('version') == self.version:
+                self.entries = data.get('entries', {})
+
+    def is_up_to_date(self, input, output, options):
+        """
+        Check if the output was generated from the current input and dependencies, with the same options
+        :param input: The input ecore file
+        :param output: The output graphml file
+        :param options: The options that affect the output (see Converter.get_options)
+        :return: True if the conversion can be skipped
+        """
+        entry = self.entries.get(os.path.abspath(output))
+        if entry is None or entry['input'] != os.path.abspath(input) or entry['options'] != options:
+            return False
+        if not os.path.exists(output):
+            return False
+        return all(self.is_current(path, fingerprint) for path, fingerprint in entry['files'].items())
+
+    def is_current(self, path, fingerprint):
+        """
+        Check the file against its recorded fingerprint. The content is hashed only if the modification time or size
+        changed.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return fingerprint is None
+        if fingerprint is None:
+            return False
+        if fingerprint['mtime'] == st.st_mtime_ns and fingerprint['size'] == st.st_size:
+            return True
+        current = self.fingerprint(path)
+        if current is None or current['sha256'] != fingerprint['sha256']:
+            return False
+        with self.lock:
+            fingerprint.update(current)
+            self.dirty = True
+        return True
+
+    @staticmethod
+    def fingerprint(path):
+        """
+        :return: The modification time, size and content hash of the file, or None if it does not exist
+        """
+        import hashlib
+        try:
+            st = os.stat(path)
+            with open(path, 'rb') as fin:
+                digest = hashlib.sha256(fin.read()).hexdigest()
+        except OSError:
+            return None
+        return {'mtime': st.st_mtime_ns, 'size': st.st_size, 'sha256': digest}
+
+    def get_dependencies(self, output):
+        """
+        :return: The external metamodels recorded for the output
+        """
+        entry = self.entries.get(os.path.abspath(output))
+        if entry is None:
+            return set()
+        return set(entry['files']) - {entry['input']}
+
+    def record(self, input, output, options, dependencies):
+        """
+        Record a generated output
+        :param input: The input ecore file
+        :param output: The output graphml file
+        :param options: The options that affect the output (see Converter.get_options)
+        :param dependencies: The locations of the external metamodels the conversion loaded
+        """
+        files = {path: self.fingerprint(path) for path in [os.path.abspath(input)] + sorted(dependencies)}
+        with self.lock:
+            self.entries[os.path.abspath(output)] = {'input': os.path.abspath(input), 'options': options,
+                                                     'files': files}
+            self.dirty = True
+
+    def save(self):
+        """
+        Write the manifest if it changed
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+            write_json(self.path, {'version': self.version, 'entries': self.entries})
+            self.dirty = False
+
+
+class Profile:
+    """
+    Wall time and number of calls of each conversion phase, and counters of the conversion events. Phases can be
+    nested (e.g. external resolution happens while adding the features), so their times are inclusive.
+    """
+
+    def __init__(self):
+        self.times = defaultdict(float)
+        self.calls = Counter()
+        self.counters = Counter()
+
+    @contextmanager
+    def phase(self, name):
+        self.times[name] += 0.0     # Report the phases in the order they start
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] += time.perf_counter() - start
+            self.calls[name] += 1
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def to_dict(self):
+        return {
+            'phases': {name: {'time': t, 'calls': self.calls[name]} for name, t in self.times.items()},
+            'counters': dict(self.counters),
+        }
+
+    def report(self):
+        """
+        A human readable summary
+        """
+        lines = ['Phase                      Time (s)      Calls']
+        for name, t in self.times.items():
+            lines.append('{:<24} {:10.4f} {:10d}'.format(name, t, self.calls[name]))
+        if self.counters:
+            lines.append('Counter                       Count')
+            for name, n in sorted(self.counters.items()):
+                lines.append('{:<24} {:10d}'.format(name, n))
+        return '\n'.join(lines)
+
+
+class ResourceSet:
+    """
+    The external metamodels referenced by a graph. Each metamodel file is parsed and indexed only once.
+    """
+
+    def __init__(self, index=None, max_size=None, validate=False):
+        """
+        Create a new resource set
+        :param index: An optional CatalogIndex to answer from instead of parsing the metamodels
+        :param max_size: The maximum number of resources to keep. The least recently used resources are dropped
+            first. Unbounded if None.
+        :param validate: Check the modification time and size of the file on every request and load it again if it
+            changed, for resource sets that outlive the files (e.g. in a server)
+        """
+        self.resources = OrderedDict()  # Resources by absolute path, None if the file could not be loaded
+        self.stamps = dict()            # The (mtime, size) of the loaded files, if validated
+        self.index = index
+        self.max_size = max_size
+        self.validate = validate
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.loading = dict()       # Locks of the files being loaded
+
+    def get_cached(self, path, stamp):
+        """
+        Get a loaded resource, if it is current. Must be called with the lock held.
+        :return: A (found, resource) tuple
+        """
+        if path in self.resources and self.stamps.get(path) == stamp:
+            self.hits += 1
+            self.resources.move_to_end(path)
+            return True, self.resources[path]
+        return False, None
+
+    def get_loaded(self, path):
+        """
+        Get a resource if it is already loaded and current, without loading it or counting a request
+        :param path: The location of the Ecore file
+        :return: A (found, resource) tuple. The resource is None if the file could not be loaded.
+        """
+        path = os.path.abspath(path)
+        stamp = self.get_stamp(path) if self.validate else None
+        with self.lock:
+            if path in self.resources and self.stamps.get(path) == stamp:
+                return True, self.resources[path]
+        return False, None
+
+    @staticmethod
+    def get_stamp(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def get_resource(self, path, profile=None):
+        """
+        Get the resource for the Ecore file, parsing it the first time it is requested
+        :param path: The location of the Ecore file
+        :param profile: An optional Profile to record the loading in
+        :return: The resource, or None if the file could not be loaded
+        """
+        path = os.path.abspath(path)
+        stamp = self.get_stamp(path) if self.validate else None
+        with self.lock:
+            found, resource = self.get_cached(path, stamp)
+            if found:
+                return resource
+            load_lock = self.loading.setdefault(path, threading.Lock())
+        with load_lock:     # Other files can be loaded concurrently
+            try:
+                with self.lock:
+                    found, resource = self.get_cached(path, stamp)  # Loaded by another thread while waiting
+                    if found:
+                        return resource
+                    self.misses += 1
+                with nullcontext() if profile is None else profile.phase('external_load'):
+                    if self.index is not None:
+                        resource = self.index.get_resource(path)
+                    else:
+                        try:
+                            with open(path, 'rb') as fin:
+                                content = fin.read()
+                        except OSError:
+                            resource = None
+                        else:   # Parsing from memory releases the GIL, so other files can be parsed concurrently
+                            resource = EcoreResource(etree.fromstring(content).getroottree())
+                if profile is not None and isinstance(resource, EcoreResource):
+                    profile.count('external_parses')
+                with self.lock:
+                    self.resources[path] = resource
+                    self.resources.move_to_end(path)
+                    self.stamps[path] = stamp
+                    while self.max_size is not None and len(self.resources) > self.max_size:
+                        evicted, _ = self.resources.popitem(last=False)
+                        del self.stamps[evicted]
+                        self.evictions += 1
+            finally:
+                # Also when the load fails, so the path is not taken for a load in progress
+                with self.lock:
+                    if self.loading.get(path) is load_lock:
+                        del self.loading[path]
+        return resource
 
 
 def bounds_to_string(lower, upper):
@@ -120,11 +781,32 @@ def bounds_to_string(lower, upper):
 
 
 class Element:
+    """
+    Nodes and edges are cloned from per-style templates, which is much cheaper than building their elements
+    """
 
-    def __init__(self, shape_id, desc_id):
+    templates = dict()
 
-        self.graphics = etree.Element('data', key=shape_id)
-        self.desc = etree.Element('data', key=desc_id)
+    def __init__(self, template):
+        """
+        :param template: The node or edge element to clone
+        """
+        self.element = copy.deepcopy(template)
+        self.graphics, self.desc = self.element[:2]
+
+    @classmethod
+    def get_template(cls, build, *style):
+        """
+        Get the template for the style, building it the first time
+        :param build: The function that builds the template for the style
+        :param style: The style arguments
+        :return:
+        """
+        key = (build,) + style
+        try:
+            return cls.templates[key]
+        except KeyError:
+            return cls.templates.setdefault(key, build(*style))
 
 
 class EClassNode(Element):
@@ -140,47 +822,56 @@ class EClassNode(Element):
         :param args: Additional format arguments
         :param external: If the EClass is external (i.e. referenced metamodel)
         """
-        super().__init__(*args)
-        self.node = etree.Element('node', id=id)
+        super().__init__(self.get_template(self.build_template, abstract, external, *args))
+        self.node = self.element
+        self.node.attrib['id'] = id
         self.id = id
-        self.generic_node = etree.Element(y_ns + 'GenericNode',
-                                          configuration='com.yworks.entityRelationship.big_entity')
-        etree.SubElement(self.generic_node, y_ns + 'Fill', hasColor="false", transparent="false")
+        self.generic_node = self.graphics[0]
+        self.node_label = self.generic_node[-3]
+        self.attr_label = self.generic_node[-2]
+
+    @staticmethod
+    def build_template(abstract, external, shape_id, desc_id):
+        """
+        Build the node elements for the given style
+        :param abstract: If the class is abstract
+        :param external: If the EClass is external (i.e. referenced metamodel)
+        :param shape_id: The id of the graphics key
+        :param desc_id: The id of the description key
+        :return: The node element
+        """
+        node = etree.Element('node', nsmap=y_nsmap)
+        graphics = etree.SubElement(node, 'data', key=shape_id)
+        etree.SubElement(node, 'data', key=desc_id)
+        generic_node = etree.SubElement(graphics, y_ns + 'GenericNode',
+                                        configuration='com.yworks.entityRelationship.big_entity')
+        etree.SubElement(generic_node, y_ns + 'Fill', hasColor="false", transparent="false")
         if external:
-            etree.SubElement(self.generic_node, y_ns + 'BorderStyle', color="#000000", type="dashed", width="1.0")
+            etree.SubElement(generic_node, y_ns + 'BorderStyle', color="#000000", type="dashed", width="1.0")
         fontStyle = 'plain'
-        if abstract == 'true':
+        if abstract:
             fontStyle = 'italic'
-        self.node_label = etree.Element(y_ns + 'NodeLabel',
-                                        configuration='com.yworks.entityRelationship.label.name',
-                                        autoSizePolicy='content',
-                                        modelName='internal',
-                                        modelPosition='t',
-                                        backgroundColor='#FFFFFF',
-                                        fontStyle=fontStyle)
-        self.generic_node.append(self.node_label)
-
-        self.attr_label = etree.Element(y_ns + 'NodeLabel',
-                                        configuration='com.yworks.entityRelationship.label.attributes',
-                                        autoSizePolicy='content',
-                                        alignment="left",
-                                        modelName='custom')
-        label_model = etree.Element(y_ns + 'LabelModel')
+        etree.SubElement(generic_node, y_ns + 'NodeLabel',
+                         configuration='com.yworks.entityRelationship.label.name',
+                         autoSizePolicy='content',
+                         modelName='internal',
+                         modelPosition='t',
+                         backgroundColor='#FFFFFF',
+                         fontStyle=fontStyle)
+        attr_label = etree.SubElement(generic_node, y_ns + 'NodeLabel',
+                                      configuration='com.yworks.entityRelationship.label.attributes',
+                                      autoSizePolicy='content',
+                                      alignment="left",
+                                      modelName='custom')
+        label_model = etree.SubElement(attr_label, y_ns + 'LabelModel')
         etree.SubElement(label_model, y_ns + 'ErdAttributesNodeLabelModel')
-        self.attr_label.append(label_model)
-        model_parameter = etree.Element(y_ns + 'ModelParameter')
+        model_parameter = etree.SubElement(attr_label, y_ns + 'ModelParameter')
         etree.SubElement(model_parameter, y_ns + 'ErdAttributesNodeLabelModelParameter')
-        self.attr_label.append(model_parameter)
-        self.generic_node.append(self.attr_label)
-        style = etree.Element(y_ns + 'StyleProperties')
-        property = etree.Element(y_ns + 'Property', name='y.view.ShadowNodePainter.SHADOW_PAINTING', value='true')
+        style = etree.SubElement(generic_node, y_ns + 'StyleProperties')
+        property = etree.SubElement(style, y_ns + 'Property', name='y.view.ShadowNodePainter.SHADOW_PAINTING',
+                                    value='true')
         property.attrib['class'] = 'java.lang.Boolean'
-        style.append(property)
-        self.generic_node.append(style)
-
-        self.graphics.append(self.generic_node)
-        self.node.append(self.graphics)
-        self.node.append(self.desc)
+        return node
 
     def set_label_text(self, label):
         """
@@ -190,25 +881,85 @@ class EClassNode(Element):
         """
         self.node_label.text = label
 
-    def add_eattribute(self, name, attrtype, lower, upper, hide_mult, external=False):
+    def add_eattributes(self, attributes, hide_mult):
         """
-        Add an EAttribute to the node. Attributes are appended to the node's attribute label
-        :param name: The name of the attribute
-        :param attrtype: The type of the attribute
-        :param lower: The lower bound of the attribute
-        :param upper: The upper bound of the attribute
-        :return:
+        Set the node's attribute label, one line per attribute
+        :param attributes: The EAttributeInfo of the class
+        :param hide_mult: Hide the multiplicities
         """
+        if attributes:
+            self.attr_label.text = "\n".join(self.get_attribute_lines(attributes, hide_mult))
+
+    @staticmethod
+    def get_attribute_lines(attributes, hide_mult):
         frmt_attr = "{0} : {1} {2}"
         if hide_mult:
             frmt_attr = "{0} : {1}"
-        bounds = '[{}]'.format(bounds_to_string(lower, upper))
-        if external:
-            attrtype = f"({attrtype})"
-        if self.attr_label.text is None:
-            self.attr_label.text = frmt_attr.format(name, attrtype, bounds)
-        else:
-            self.attr_label.text += "\n" + frmt_attr.format(name, attrtype, bounds)
+        lines = []
+        for a in attributes:
+            attrtype = a.type_name
+            if a.external:
+                attrtype = f"({attrtype})"
+            lines.append(frmt_attr.format(a.name, attrtype, '[{}]'.format(bounds_to_string(a.lower, a.upper))))
+        return lines
+
+    @classmethod
+    def get_size(cls, eclass, hide_mult):
+        """
+        Estimate the size of the node of the class from its labels
+        :param eclass: The EClassInfo
+        :param hide_mult: Hide the multiplicities
+        :return: A (width, height) tuple
+        """
+        lines = cls.get_attribute_lines(eclass.attributes, hide_mult)
+        chars = max([len(eclass.name)] + [len(line) for line in lines])
+        return max(min_width, (chars + 2) * char_width), base_height + attribute_height * len(lines)
+
+
+class EPackageNode(Element):
+    """
+    Group nodes to represent EPackages. The nodes of the package contents are added to the group's graph.
+    """
+
+    def __init__(self, id, name, *args):
+        """
+        Create a new EPackage node
+        :param id: the node id
+        :param name: the package name
+        :param args: Additional format arguments
+        """
+        super().__init__(self.get_template(self.build_template, *args))
+        self.node = self.element
+        self.node.attrib['id'] = id
+        self.id = id
+        self.graph = self.element[2]
+        self.graph.attrib['id'] = id + ':'
+        self.group_node = self.graphics[0][0][0]
+        self.group_node[2].text = name
+
+    @staticmethod
+    def build_template(shape_id, desc_id):
+        """
+        Build the group node elements
+        :param shape_id: The id of the graphics key
+        :param desc_id: The id of the description key
+        :return: The node element
+        """
+        node = etree.Element('node', nsmap=y_nsmap)
+        node.attrib['yfiles.foldertype'] = 'group'
+        graphics = etree.SubElement(node, 'data', key=shape_id)
+        etree.SubElement(node, 'data', key=desc_id)
+        etree.SubElement(node, 'graph', edgedefault='directed')
+        proxy = etree.SubElement(graphics, y_ns + 'ProxyAutoBoundsNode')
+        realizers = etree.SubElement(proxy, y_ns + 'Realizers', active='0')
+        group_node = etree.SubElement(realizers, y_ns + 'GroupNode')
+        etree.SubElement(group_node, y_ns + 'Fill', color='#F5F5F5', transparent='false')
+        etree.SubElement(group_node, y_ns + 'BorderStyle', color='#000000', type='dashed', width='1.0')
+        etree.SubElement(group_node, y_ns + 'NodeLabel', alignment='right', autoSizePolicy='node_width',
+                         backgroundColor='#EBEBEB', modelName='internal', modelPosition='t')
+        etree.SubElement(group_node, y_ns + 'Shape', type='roundrectangle')
+        etree.SubElement(group_node, y_ns + 'State', closed='false')
+        return node
 
 
 class EReferenceEdge(Element):
@@ -226,25 +977,58 @@ class EReferenceEdge(Element):
         :param containment: If the reference is containment
         :param inheritance: If the reference is inheritance
         """
-
-        super().__init__(*args)
-        self.edge = etree.Element('edge', id=id, source=source, target=target)
+        super().__init__(self.get_template(self.build_template, containment, inheritance, *args))
+        self.edge = self.element
+        self.edge.attrib.update({'id': id, 'source': source, 'target': target})
         self.id = id
-        self.polyline_edge = etree.Element(y_ns + 'PolyLineEdge')
-        self.graphics.append(self.polyline_edge)
-        self.edge.append(self.graphics)
-        self.edge.append(self.desc)
-        self.arrows = etree.Element(y_ns + 'Arrows')
+        self.polyline_edge = self.graphics[0]
+        self.arrows = self.polyline_edge[0]
+
+    @staticmethod
+    def build_template(containment, inheritance, shape_id, desc_id):
+        """
+        Build the edge elements for the given style
+        :param containment: If the reference is containment
+        :param inheritance: If the reference is inheritance
+        :param shape_id: The id of the graphics key
+        :param desc_id: The id of the description key
+        :return: The edge element
+        """
+        edge = etree.Element('edge', nsmap=y_nsmap)
+        graphics = etree.SubElement(edge, 'data', key=shape_id)
+        etree.SubElement(edge, 'data', key=desc_id)
+        polyline_edge = etree.SubElement(graphics, y_ns + 'PolyLineEdge')
+        arrows = etree.SubElement(polyline_edge, y_ns + 'Arrows')
         if containment:
-            self.arrows.attrib['source'] = 'diamond'
-            self.arrows.attrib['target'] = 'none'
+            arrows.attrib['source'] = 'diamond'
+            arrows.attrib['target'] = 'none'
         elif inheritance:
-            self.arrows.attrib['source'] = 'white_delta'
-            self.arrows.attrib['target'] = 'none'
+            arrows.attrib['source'] = 'white_delta'
+            arrows.attrib['target'] = 'none'
         else:
-            self.arrows.attrib['source'] = 'none'
-            self.arrows.attrib['target'] = 'plain'
-        self.polyline_edge.append(self.arrows)
+            arrows.attrib['source'] = 'none'
+            arrows.attrib['target'] = 'plain'
+        return edge
+
+    @staticmethod
+    def build_label(model_position, placement, side):
+        """
+        Build an edge label
+        :param model_position: The position in the six_pos label model
+        :param placement: The preferred placement, source or target
+        :param side: The preferred side, left or right
+        :return: The label element
+        """
+        label = etree.Element(y_ns + 'EdgeLabel', modelName='six_pos', modelPosition=model_position,
+                              preferredPlacement='{}_{}'.format(placement, side))
+        etree.SubElement(label, y_ns + 'PreferredPlacementDescriptor', placement=placement, side=side,
+                         sideReference='relative_to_edge_flow')
+        return label
+
+    def add_label(self, text, model_position, placement, side):
+        label = copy.deepcopy(self.get_template(self.build_label, model_position, placement, side))
+        label.text = text
+        self.polyline_edge.append(label)
 
     def create_labels(self, target_name, target_mult):
         """
@@ -254,21 +1038,9 @@ class EReferenceEdge(Element):
         :return:
         """
         # Name
-        target_label = etree.Element(y_ns + 'EdgeLabel', modelName='six_pos', modelPosition='ttail',
-                                          preferredPlacement='target_right')
-        target_label.text = target_name
-        placement = etree.Element(y_ns + 'PreferredPlacementDescriptor', placement='target', side='right',
-                                  sideReference='relative_to_edge_flow')
-        target_label.append(placement)
-        self.polyline_edge.append(target_label)
+        self.add_label(target_name, 'ttail', 'target', 'right')
         # Multiplicity
-        target_mult_label = etree.Element(y_ns + 'EdgeLabel', modelName='six_pos', modelPosition='thead',
-                                          preferredPlacement='target_left')
-        target_mult_label.text = target_mult
-        placement = etree.Element(y_ns + 'PreferredPlacementDescriptor', placement='target', side='left',
-                                  sideReference='relative_to_edge_flow')
-        target_mult_label.append(placement)
-        self.polyline_edge.append(target_mult_label)
+        self.add_label(target_mult, 'thead', 'target', 'left')
 
     def add_labels(self, containment, source_name=None, source_mult=None):
         """
@@ -282,108 +1054,232 @@ class EReferenceEdge(Element):
             self.arrows.attrib['target'] = 'diamond'
             self.arrows.attrib['source'] = 'none'
         # Opposite Name
-        source_label = etree.Element(y_ns + 'EdgeLabel', modelName='six_pos', modelPosition='shead',
-                                     preferredPlacement='source_left')
-        source_label.text = source_name
-        placement = etree.Element(y_ns + 'PreferredPlacementDescriptor', placement='source', side='left',
-                                  sideReference='relative_to_edge_flow')
-        source_label.append(placement)
-        self.polyline_edge.append(source_label)
+        self.add_label(source_name, 'shead', 'source', 'left')
         # Multiplicity
-        source_mult_label = etree.Element(y_ns + 'EdgeLabel', modelName='six_pos', modelPosition='stail',
-                                    preferredPlacement='source_right')
-        source_mult_label.text = source_mult
-        placement = etree.Element(y_ns + 'PreferredPlacementDescriptor', placement='source', side='right',
-                                  sideReference='relative_to_edge_flow')
-        source_mult_label.append(placement)
-        self.polyline_edge.append(source_mult_label)
+        self.add_label(source_mult, 'stail', 'source', 'right')
 
 
-class Graph:
+class EClassInfo:
+    """
+    An EClass of the intermediate model
+    """
 
-    def __init__(self, edgedefault='directed'):
-        self.logger = logging.getLogger(__name__)
-        nsmap = {None: GRAPHML_NAMESPACE, 'xsi': XSI_NAMESPACE, 'y': YWORKS_NAMESPACE}  # the default namespace (no prefix)
-        self.root = etree.Element('graphml', id='G', edgedefault=edgedefault, nsmap=nsmap)
-        self.root.attrib[xsi_ns+'schemaLocation'] = 'http://graphml.graphdrawing.org/xmlns ' \
-                                                         'http://www.yworks.com/xml/schema/graphml/1.0/ygraphml.xsd'
-        # Yed uses at least node/edge graphics and description
-        key_id = get_key_id()
-        self.node_graph_key = self.new_key(next(key_id), 'node')
-        self.node_graph_key.attrib['yfiles.type'] = 'nodegraphics'
-        self.edge_graph_key = self.new_key(next(key_id), 'edge')
-        self.edge_graph_key.attrib['yfiles.type'] = 'edgegraphics'
-        self.node_desc_key = self.new_key(next(key_id), 'node')
-        self.node_desc_key.attrib['attr.name'] = 'description'
-        self.node_desc_key.attrib['attr.type'] = 'string'
-        self.edge_desc_key = self.new_key(next(key_id), 'edge')
-        self.edge_desc_key.attrib['attr.name'] = 'description'
-        self.edge_desc_key.attrib['attr.type'] = 'string'
-        self.node_id = get_node_id()
-        self.edge_id = get_edge_id()
-        # Id references
-        self.xmi_id_to_id = dict()      # Map xmi IDs to yed ids
-        # EReferences
-        self.sf_to_edge = dict()
+    __slots__ = ('name', 'abstract', 'external', 'key', 'attributes')
+
+    def __init__(self, name, abstract=False, external=False, key=None):
+        """
+        :param name: The name of the class
+        :param abstract: True if the class is abstract
+        :param external: If the EClass is from a referenced metamodel
+        :param key: The stable key of the class, its URI fragment (e.g. '//sub/Name') or, for external classes, the
+            reference to it (e.g. 'other.ecore#//Name')
+        """
+        self.name = name
+        self.abstract = abstract
+        self.external = external
+        self.key = key
+        self.attributes = []    # EAttributeInfo, in declaration order
+
+
+class EAttributeInfo:
+    """
+    A structural feature shown as an attribute of its class, i.e. an EAttribute or a reference to an external type
+    that has no node
+    """
+
+    __slots__ = ('name', 'type_name', 'lower', 'upper', 'external')
+
+    def __init__(self, name, type_name, lower, upper, external=False):
+        self.name = name
+        self.type_name = type_name
+        self.lower = lower
+        self.upper = upper
+        self.external = external
 
-    def new_key(self, id, target):
-        key = etree.Element('key', id=id)
-        key.attrib['for'] = target
-        self.root.append(key)
-        return key
 
-    def add_eclass_node(self, element, external=False):
+class EReferenceInfo:
+    """
+    An EReference between two classes of the intermediate model. Both ends of a bidirectional reference point to each
+    other through opposite, but only the first end is an edge of the model.
+    """
+
+    __slots__ = ('source', 'target', 'name', 'lower', 'upper', 'containment', 'opposite')
+
+    def __init__(self, source, target, name, lower, upper, containment=False):
         """
-        Add a new node to represent the
-        :param element:
-        :param external:
-        :return:
+        :param source: The EClassInfo that holds the reference
+        :param target: The EClassInfo of the reference type
         """
-        xmi_id = element.attrib.get(xmi_ns + 'id', None)
-        if xmi_id is not None:
-            xmi_id_to_element[xmi_id] = element
-        label = element.attrib['name']
-        y_id = next(self.node_id)
-        n = EClassNode(y_id, element.attrib.get('abstract', "false"), self.node_graph_key.attrib['id'],
-                       self.node_desc_key.attrib['id'], external=external)
-        if xmi_id is not None:
-            self.xmi_id_to_id[xmi_id] = y_id
-        n.set_label_text(label)
-        self.root.append(n.node)
-        set_node_for_element(element, n)
-
-    def add_edge(self, source, target, containment=False, inheritance=False):
-        """
-        :param source: source node
-        :param target: target element
-        :return:
+        self.source = source
+        self.target = target
+        self.name = name
+        self.lower = lower
+        self.upper = upper
+        self.containment = containment
+        self.opposite = None
+
+    @property
+    def key(self):
         """
-        id = next(self.edge_id)
-        e = EReferenceEdge(id, source, target, self.edge_graph_key.attrib['id'], self.edge_desc_key.attrib['id'],
-                           containment=containment, inheritance=inheritance)
-        self.root.append(e.edge)
-        return e
+        The stable key of the reference, e.g. '//sub/Name/reference'. Both ends of a bidirectional reference have the
+        same key.
+        """
+        key = '{}/{}'.format(self.source.key, self.name)
+        if self.opposite is not None:
+            key = min(key, '{}/{}'.format(self.opposite.source.key, self.opposite.name))
+        return key
 
-    def add_node_attributes(self, tree, create_external, hide_mult, schema_location):
-        for p in tree.iter():       #FIXME Multipackage?
-            for c in p.iterdescendants(tag='eClassifiers'):
-                for sf in c.iterdescendants(tag='eStructuralFeatures'):
-                    self.add_eFeatures(c, sf, tree, create_external, hide_mult, schema_location)
-                self.add_inheritance(c, tree, create_external, schema_location)
 
-    def add_inheritance(self, c, tree, create_external, schema_location):
-        try:
-            super_types = c.attrib['eSuperTypes']
-            for st in super_types.split(" "):
-                resolved_type, _ = self.resolve_type(tree, st, create_external, schema_location)
-                source = get_node_for_element(c)
-                target = get_node_for_element(resolved_type)
-                self.add_edge(target.id, source.id, inheritance=True)
-        except KeyError:
-            pass
+class ESuperTypeInfo:
+    """
+    An inheritance relation between two classes of the intermediate model
+    """
 
-    def add_eFeatures(self, clazz, sf, tree, create_external, hide_mult, schema_location):
-        self.logger.info(f"Adding feature {sf.attrib['name']} to {clazz.attrib['name']}")
+    __slots__ = ('eclass', 'super_type')
+
+    def __init__(self, eclass, super_type):
+        self.eclass = eclass
+        self.super_type = super_type
+
+    @property
+    def key(self):
+        return '{}->{}'.format(self.eclass.key, self.super_type.key)
+
+
+class EPackageInfo:
+    """
+    An EPackage (or eSubpackage) of the intermediate model
+    """
+
+    __slots__ = ('name', 'key', 'classes', 'subpackages')
+
+    def __init__(self, name, key=None):
+        """
+        :param name: The name of the package
+        :param key: The stable key of the package, the URI fragment prefix of its classifiers (e.g. '//sub/')
+        """
+        self.name = name
+        self.key = key
+        self.classes = []
+        self.subpackages = []
+
+
+class EcoreModel:
+    """
+    The intermediate model of a metamodel: its packages, its classes and the edges (EReferenceInfo and ESuperTypeInfo)
+    between them. It holds no references to the source tree, so the tree can be freed once the model is built.
+    """
+
+    __slots__ = ('packages', 'classes', 'edges', 'dependencies')
+
+    def __init__(self):
+        self.packages = []  # The root packages
+        self.classes = []   # The classes of all packages, followed by the external classes
+        self.edges = []
+        self.dependencies = set()   # The absolute locations of the external metamodels the model was built from
+
+
+class ModelBuilder:
+    """
+    Builds the intermediate model of a metamodel in a single pass over its EClasses, resolving the type references
+    (and loading the external metamodels) on the way.
+    """
+
+    def __init__(self, create_external=False, schema_location=None, resource_set=None, base_path='', profile=None):
+        """
+        Create a new builder
+        :param create_external: Create classes for external references
+        :param schema_location: The catalog, mapping metamodel URIs to file locations
+        :param resource_set: The resource set used to load external metamodels. Provide one to share the parsed
+            metamodels between builders.
+        :param base_path: The folder of the input metamodel, relative external locations are resolved against it
+        :param profile: An optional Profile to record the conversion phases and events in
+        """
+        self.logger = logging.getLogger(__name__)
+        self.create_external = create_external
+        if schema_location is None:
+            schema_location = {}
+        self.schema_location = schema_location
+        if resource_set is None:
+            resource_set = ResourceSet()
+        self.resource_set = resource_set
+        self.base_path = base_path
+        self.profile = profile
+        self.model = EcoreModel()
+        # EClass elements to their EClassInfo
+        self.element_to_class = dict()
+        # EReferences whose opposite has not been processed yet
+        self.sf_to_reference = dict()
+        # Resolved type references
+        self.resolved_types = dict()
+        # The metamodel references that could not be loaded and were already reported (see prefetch)
+        self.reported = set()
+
+    def release(self):
+        """
+        Drop all references to the source metamodel once the model is complete, so the source tree can be freed.
+        :return: The model
+        """
+        self.element_to_class.clear()
+        self.sf_to_reference.clear()
+        self.resolved_types.clear()
+        return self.model
+
+    def add_eclass(self, element, key, external=False):
+        """
+        Add the class of an EClass to the model
+        :param element: The EClass
+        :param key: The stable key of the class (see EClassInfo)
+        :param external: If the EClass is from a referenced metamodel
+        :return: The EClassInfo
+        """
+        c = EClassInfo(element.attrib['name'], element.attrib.get('abstract') == 'true', external, key)
+        self.element_to_class[element] = c
+        self.model.classes.append(c)
+        return c
+
+    def add_eclasses(self, package, prefix='//'):
+        """
+        Add the root package, its eSubpackages and the classes of all their EClasses. Their features are added by
+        add_features, once the classes of all packages they can refer to are known.
+        :param package: The root package
+        :param prefix: The fragment prefix of the root package, '/<index>/' if the resource has several
+        :return: The EPackageInfo of the package
+        """
+        packages = dict()
+        for p, path in iter_epackage_paths(package):
+            info = EPackageInfo(p.attrib.get('name', ''), prefix + ''.join(name + '/' for name in path))
+            packages[p] = info
+            if p is package:
+                self.model.packages.append(info)
+            else:
+                packages[p.getparent()].subpackages.append(info)
+            for element in p.iterchildren(tag='eClassifiers'):
+                if element.attrib.get(xsi_ns + 'type') == 'ecore:EClass':
+                    key = prefix + '/'.join(path + [element.attrib['name']])
+                    info.classes.append(self.add_eclass(element, key))
+        return packages[package]
+
+    def add_features(self, package, resource):
+        """
+        Add the attributes, references and super types of all EClasses in the package (and its eSubpackages)
+        :param package: The package
+        :param resource: The resource the package belongs to, used to resolve references
+        """
+        for c in iter_eclassifiers(package):
+            if c not in self.element_to_class:
+                continue
+            for sf in c.iterchildren(tag='eStructuralFeatures'):
+                self.add_eFeatures(c, sf, resource)
+            self.add_inheritance(c, resource)
+
+    @staticmethod
+    def get_type_ref(sf):
+        """
+        Get the reference to the type of the structural feature
+        :param sf: The structural feature
+        :return:
+        """
         try:
             eType = sf.attrib['eType']
         except KeyError:
@@ -392,164 +1288,2203 @@ class Graph:
             eType = gt.attrib['eClassifier']
         if ' ' in eType:  # The type is in another metamodel
             info = eType.split(' ')
-            type_ref = info[1]
+            return info[1]
         else:  # The type is from the metamodel
-            type_ref = eType
-        resolved_type, external = self.resolve_type(tree, type_ref, create_external, schema_location)
+            return eType
+
+    def add_inheritance(self, c, resource):
+        eclass = self.element_to_class[c]
+        for st in c.attrib.get('eSuperTypes', '').split():
+            resolved_type, external = self.resolve_type(resource, st)
+            if external:    # Only shown if the super type has a class
+                continue
+            self.model.edges.append(ESuperTypeInfo(eclass, self.element_to_class[resolved_type]))
+
+    def add_eFeatures(self, clazz, sf, resource):
+        self.logger.info(f"Adding feature {sf.attrib['name']} to {clazz.attrib['name']}")
+        eclass = self.element_to_class[clazz]
+        type_ref = self.get_type_ref(sf)
+        resolved_type, external = self.resolve_type(resource, type_ref)
         lower = int(sf.attrib.get('lowerBound', "0"))
         upper = int(sf.attrib.get('upperBound', "1"))
         if sf.attrib[xsi_ns + 'type'] == 'ecore:EAttribute':
-            cn = get_node_for_element(clazz)
             if isinstance(resolved_type, type(sf)):
                 resolved_type = resolved_type.attrib['name']
-            cn.add_eattribute(sf.attrib['name'], resolved_type, lower, upper, hide_mult)
+            eclass.attributes.append(EAttributeInfo(sf.attrib['name'], resolved_type, lower, upper))
         elif external:
-            cn = get_node_for_element(clazz)
-            cn.add_eattribute(sf.attrib['name'], resolved_type, lower, upper, hide_mult, True)
-        else:  # Create Edge
-            source = get_node_for_element(clazz)
-            target = get_node_for_element(resolved_type)
-            containment = sf.attrib.get('containment', 'false')
-            if containment == 'true':
-                containment = True
-            else:
-                containment = False
-            e = self.add_edge(source.id, target.id, containment=containment)
-            self.sf_to_edge[sf] = e
-            target_name = sf.attrib['name']
-            target_mult = bounds_to_string(lower, upper)
-            opp_name = None
-            opp_mult = None
-            # Edge Labels, opposite?
-            opp_edge = None
+            eclass.attributes.append(EAttributeInfo(sf.attrib['name'], resolved_type, lower, upper, True))
+        else:
+            reference = EReferenceInfo(eclass, self.element_to_class[resolved_type], sf.attrib['name'], lower, upper,
+                                       sf.attrib.get('containment', 'false') == 'true')
             if 'eOpposite' in sf.attrib:
-                eOpposite = sf.attrib['eOpposite']
-                opp_prop_index = eOpposite.rfind('/')
-                opp_type = sf.attrib['eOpposite'][:opp_prop_index]
-                opp_element, _ = self.resolve_type(tree, opp_type, create_external, schema_location)
-                opp_prop_name = sf.attrib['eOpposite'][opp_prop_index + 1:]
-                xpath_exp = 'eStructuralFeatures[@name="{}"]'.format(opp_prop_name)
-                opp_sf = opp_element.xpath(xpath_exp)
-                assert len(opp_sf) == 1
-                opp_sf = opp_sf[0]
-                try:
-                    opp_edge = self.sf_to_edge[opp_sf]
-                except KeyError:
-                    pass
-                    # else:
-                    # lower = int(opp_sf.attrib.get('lowerBound', "0"))
-                    # upper = int(opp_sf.attrib.get('upperBound', "1"))
-                    # opp_mult = bounds_to_string(lower, upper)
-                    # opp_name = opp_sf.attrib['name']
-                    # opp_edge.modify_labels(, opp_mult, )
-            if opp_edge is None:
-                e.create_labels(target_name, target_mult)
-            else:
-                opp_edge.add_labels(containment, target_name, target_mult)
-                self.remove_edge(e)
-
-    def create_eclass_nodes(self, package):
+                opp_sf = self.get_opposite(sf, resource)
+                opposite = self.sf_to_reference.pop(opp_sf, None)
+                if opposite is not None:    # Both ends are known, the edge of the opposite shows both
+                    opposite.opposite = reference
+                    reference.opposite = opposite
+                    if self.profile is not None:
+                        self.profile.count('opposite_pairs')
+                    return
+                if opp_sf is not None:
+                    self.sf_to_reference[sf] = reference
+            self.model.edges.append(reference)
+
+    def get_opposite(self, sf, resource):
         """
-        Create nodes in the graph to represent all EClasses in the package
-        :param package: The package
+        Find the opposite of a reference
+        :param sf: The reference
+        :return: The opposite reference, or None if it can not be found (e.g. the opposite class is external)
         """
-        for element in package.iterdescendants():
-            try:
-                if element.attrib[xsi_ns + 'type'] == 'ecore:EClass':
-                    self.add_eclass_node(element)
-            except KeyError:
-                pass  # eAnnotations don't have a type
-
-    def remove_edge(self, edge):
-        self.root.remove(edge.edge)
-
-    def resolve_type(self, tree, type_ref, create_external, schema_location):
-        if '#' in type_ref:  # It is an xpath like reference
-            info = type_ref.split('#')
-            mm_ref = info[0]
-            mm_type_path = info[1]
-            if mm_ref == 'http://www.eclipse.org/emf/2002/Ecore':
-                return mm_type_path.strip('/'), True
+        eOpposite = sf.attrib['eOpposite']
+        opp_prop_index = eOpposite.rfind('/')
+        opp_type = eOpposite[:opp_prop_index]
+        opp_prop_name = eOpposite[opp_prop_index + 1:]
+        opp_element, external = self.resolve_type(resource, opp_type)
+        if external:
+            return None
+        opp_sf = resource.get_feature(opp_element, opp_prop_name)
+        if opp_sf is None:  # The opposite class is in another resource
+            for f in opp_element.iterchildren(tag='eStructuralFeatures'):
+                if f.attrib.get('name') == opp_prop_name:
+                    return f
+        return opp_sf
+
+    def resolve_type(self, resource, type_ref):
+        """
+        Resolve a type reference. References are memoized, so each distinct reference is resolved only once.
+        :param resource: The resource that holds the reference
+        :param type_ref: The reference, either a URI ('mm#//Name') or an xmi:id
+        :return: A tuple with the resolved element (or type name) and True if the type is external
+        """
+        try:
+            result = self.resolved_types[type_ref]
+        except KeyError:
+            pass
+        else:
+            if self.profile is not None:
+                self.profile.count('resolved_memoized')
+            return result
+        if '#' in type_ref:  # It is an URI fragment reference
+            mm_ref, mm_type_path = type_ref.split('#', 1)
+            if mm_ref == ECORE_NAMESPACE:
+                kind = 'ecore'
+                result = mm_type_path.strip('/'), True
+            elif len(mm_ref) > 0:
+                kind = 'external'
+                if self.profile is None:
+                    result = self.get_external_type(mm_ref, mm_type_path)
+                else:
+                    with self.profile.phase('external'):
+                        result = self.get_external_type(mm_ref, mm_type_path)
             else:
-                if len(mm_ref) > 0:
-                    return self.get_external_type(mm_ref, mm_type_path, create_external, schema_location)
                 # '/1/Port'
                 # '//EStringToStringMapEntry'
-                # '//*[1]//*[2]//eClassifiers[@name=\'BDD\']'
-                path_ref = mm_type_path.split('/')
-                xpath_exp = []
-                xpath_exp.append('//*[1]')
-                for idx, path_idx in enumerate(path_ref[1:-1], start=1):
-                    if path_ref[idx] == '':
-                        # xpath_exp.append('*[1]')
-                        pass
-                    else:
-                        path_index = int(path_ref[idx])
-                        xpath_exp.append('*[{}]'.format(path_index + 1))
-                xpath_exp.append('eClassifiers[@name="{}"]'.format(path_ref[-1]))
-                xpath_exp = "//".join(xpath_exp)
-                resolved_type = tree.xpath(xpath_exp)
-                assert len(resolved_type) == 1
-                resolved_type = resolved_type[0]
+                # '//sub/EStringToStringMapEntry'
+                kind = 'fragment'
+                result = resource.get_classifier(mm_type_path), False
         else:  # It is an id
-            resolved_type = xmi_id_to_element[type_ref]
-        return resolved_type, False
-
-    def get_external_type(self, mm_ref, mm_type_path, create_external, schema_location):
-        if re.match(url_regex, mm_ref) is not None:
+            kind = 'xmi_id'
+            result = resource.get_element_by_id(type_ref), False
+        if self.profile is not None:
+            self.profile.count('resolved_' + kind)
+        self.resolved_types[type_ref] = result
+        return result
+
+    def get_external_file(self, mm_ref):
+        """
+        Get the location of an external metamodel
+        :param mm_ref: The metamodel reference, a URI or a location relative to the input metamodel
+        :return: The location, or None if the URI is not in the catalog
+        """
+        if is_url(mm_ref):
             # Check catalog
             try:
-                ecore_file = os.path.join(head, schema_location[mm_ref])
+                return os.path.join(self.base_path, self.schema_location[mm_ref])
             except KeyError:
-                ecore_file = ""
-        else:
-            ecore_file = os.path.join(head, mm_ref)
-        try:
-            with open(ecore_file, 'r', ) as fin:
-                tree = etree.parse(fin)
-        except FileNotFoundError as e:
-            warnings.warn("The metamodel ({}) for the external reference {} could not be loaded. Adding referenced "
-                          "type as string. See --catalog option.".format(mm_ref, mm_type_path))
+                return None
+        return os.path.join(self.base_path, mm_ref)
+
+    def prefetch(self, packages, workers=4):
+        """
+        Load the external metamodels referenced by the packages concurrently, so adding the features does not wait
+        for them one by one. lxml releases the GIL while parsing, so the metamodels are parsed in parallel.
+        :param packages: The root packages of the input metamodel
+        :param workers: The number of loading threads
+        :return: A list of (metamodel reference, location, reason) tuples for the metamodels that could not be
+            loaded. The location is None if the metamodel is not in the catalog. The caller reports them, they are not
+            reported again when the features are added.
+        """
+        refs = dict.fromkeys(ref for package in packages for ref in iter_metamodel_refs(package))
+        failures = []
+        files = dict()      # The metamodels that are not loaded yet
+        for mm_ref in refs:
+            ecore_file = self.get_external_file(mm_ref)
+            if ecore_file is None:
+                failures.append((mm_ref, None, 'not in the catalog'))
+                continue
+            # Resource sets that outlive the conversion (server, watch mode) usually have them all
+            loaded, resource = self.resource_set.get_loaded(ecore_file)
+            if not loaded:
+                files[mm_ref] = ecore_file
+            elif resource is None:
+                failures.append((mm_ref, os.path.abspath(ecore_file), 'could not be read'))
+
+        def load(ecore_file):
+            try:
+                if self.resource_set.get_resource(ecore_file) is None:
+                    return 'could not be read'
+            except Exception as e:  # Reported again when the metamodel is used
+                return '{}: {}'.format(type(e).__name__, e)
+            return None
+
+        if files:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(workers, len(files))) as executor:
+                for (mm_ref, ecore_file), reason in zip(files.items(), executor.map(load, files.values())):
+                    if reason is not None:
+                        failures.append((mm_ref, os.path.abspath(ecore_file), reason))
+            if self.profile is not None:
+                self.profile.count('prefetched', len(files))
+        self.reported.update(mm_ref for mm_ref, _, _ in failures)
+        return failures
+
+    def get_external_type(self, mm_ref, mm_type_path):
+        create_external = self.create_external
+        ecore_file = self.get_external_file(mm_ref)
+        resource = None
+        if ecore_file is not None:
+            self.model.dependencies.add(os.path.abspath(ecore_file))
+            resource = self.resource_set.get_resource(ecore_file, self.profile)
+        if resource is None:
+            if mm_ref not in self.reported:
+                warnings.warn("The metamodel ({}) for the external reference {} could not be loaded. Adding "
+                              "referenced type as string. See --catalog option.".format(mm_ref, mm_type_path))
             epackage_name = "Unknown"
             create_external = False
         else:
-            # Find the EPackage name
-            epackage = tree.getroot()  # FIXME We assume 1 package
-            epackage_name = epackage.attrib['name']
+            epackage_name = get_package_name(resource, mm_type_path)
 
         type_name = mm_type_path.split('/')[-1]
         if create_external:
-            for element in epackage.iterdescendants():
-                try:
-                    if element.attrib[xsi_ns + 'type'] == 'ecore:EClass':
-                        if element.attrib['name'] == type_name:
-                            self.add_eclass_node(element, external=True)
-                            return element, False
-                except KeyError:
-                    pass  # eAnnotations don't have a type
-            raise EcoreReferenceError("Type not found {} in metamodel {}. Make sure the source metamodel is valid."
-                                      .format(mm_type_path, mm_ref))
+            element = resource.get_eclass(mm_type_path)
+            if element is None:
+                raise EcoreReferenceError("Type not found {} in metamodel {}. Make sure the source metamodel is valid."
+                                          .format(mm_type_path, mm_ref))
+            if element not in self.element_to_class:
+                self.add_eclass(element, '{}#{}'.format(mm_ref, mm_type_path), external=True)
+            return element, False
         else:
             return "{}::{}".format(epackage_name, type_name), True
 
 
-def create_graph_from_file(fin, create_external, hide_mult, schema_location):
-    # Create a graph for the package.. one graph per package?
-    tree = etree.parse(fin)
-    fin.close()
-    g = Graph()
-    for element in tree.iter():
-        if element.tag == ecore_ns + 'EPackage':
-            g.create_eclass_nodes(element)
-            g.add_node_attributes(tree, create_external, hide_mult, schema_location)  # This creates attributes and edges
-            break  # FIXME What if more than one package? add_node_attributes should be called after all packages
-    return g
+def get_edge_ends(edge):
+    """
+    :param edge: An EReferenceInfo or ESuperTypeInfo
+    :return: The (source, target) classes of the edge; for super types, the subclass first
+    """
+    if isinstance(edge, ESuperTypeInfo):
+        return edge.eclass, edge.super_type
+    return edge.source, edge.target
+
+
+class View:
+    """
+    The part of a model to show. Classes are selected by patterns, which match the class name or its path in the
+    metamodel (e.g. 'Task*' or 'sub/*' for the classes of the package sub and its subpackages).
+    """
+
+    edge_kinds = ('all', 'inheritance', 'containment')
+
+    def __init__(self, roots=(), radius=1, include=(), exclude=(), edges='all'):
+        """
+        Create a new view
+        :param roots: Patterns of the classes the view is centered on. If empty, all included classes are shown.
+        :param radius: The number of hops from the roots
+        :param include: Patterns of the classes that can be shown. If empty, all classes can be shown.
+        :param exclude: Patterns of the classes that are never shown
+        :param edges: The edges to show and to follow from the roots: 'all', 'inheritance' or 'containment'
+        """
+        if edges not in self.edge_kinds:
+            raise ValueError('Unknown edge kind {}, expected one of {}'.format(edges, ', '.join(self.edge_kinds)))
+        self.roots = list(roots)
+        self.radius = radius
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.edges = edges
+
+    @classmethod
+    def from_section(cls, section):
+        """
+        Create a view from a configuration section with the (optional) keys roots, radius, include, exclude and
+        edges. Patterns are separated by whitespace.
+        :param section: The configparser section
+        """
+        return cls(section.get('roots', '').split(), section.getint('radius', 1), section.get('include', '').split(),
+                   section.get('exclude', '').split(), section.get('edges', 'all'))
+
+    @staticmethod
+    def matches(patterns, eclass):
+        path = eclass.key.lstrip('/')
+        return any(fnmatch.fnmatchcase(eclass.name, p) or fnmatch.fnmatchcase(path, p) for p in patterns)
+
+    def allows(self, eclass):
+        return (not self.include or self.matches(self.include, eclass)) and not self.matches(self.exclude, eclass)
+
+    def follows(self, kind):
+        return self.edges == 'all' or self.edges == kind
+
+
+class ModelIndex:
+    """
+    Adjacency index of a model over its super types and references, built once so that many views can be sliced
+    from a single model
+    """
+
+    def __init__(self, model):
+        """
+        :param model: The EcoreModel
+        """
+        self.model = model
+        self.adjacency = defaultdict(list)  # EClassInfo to a list of (edge kind, neighbour) tuples
+        for e in model.edges:
+            a, b = get_edge_ends(e)
+            kind = self.get_kind(e)
+            self.adjacency[a].append((kind, b))
+            if b is not a:
+                self.adjacency[b].append((kind, a))
+
+    @staticmethod
+    def get_kind(edge):
+        """
+        :return: 'inheritance', 'containment' (if either end of the reference is containment) or 'reference'
+        """
+        if isinstance(edge, ESuperTypeInfo):
+            return 'inheritance'
+        if edge.containment or (edge.opposite is not None and edge.opposite.containment):
+            return 'containment'
+        return 'reference'
+
+    def select(self, view):
+        """
+        Select the classes of the view: the allowed classes within view.radius hops of the roots
+        :param view: The View
+        :return: The set of EClassInfo
+        """
+        allowed = {c for c in self.model.classes if view.allows(c)}
+        if not view.roots:
+            return allowed
+        frontier = [c for c in self.model.classes if c in allowed and view.matches(view.roots, c)]
+        selected = set(frontier)
+        for _ in range(view.radius):
+            reached = []
+            for c in frontier:
+                for kind, other in self.adjacency[c]:
+                    if other not in selected and other in allowed and view.follows(kind):
+                        selected.add(other)
+                        reached.append(other)
+            frontier = reached
+        return selected
+
+    def slice(self, view):
+        """
+        Extract the model of the view. The records of the classes and edges are shared with the indexed model.
+        :param view: The View
+        :return: The EcoreModel
+        """
+        selected = self.select(view)
+        model = EcoreModel()
+        model.classes = [c for c in self.model.classes if c in selected]
+        for e in self.model.edges:
+            a, b = get_edge_ends(e)
+            if a in selected and b in selected and view.follows(self.get_kind(e)):
+                model.edges.append(e)
+        for p in self.model.packages:
+            p = self.slice_package(p, selected)
+            if p is not None:
+                model.packages.append(p)
+        model.dependencies = self.model.dependencies
+        return model
+
+    def slice_package(self, package, selected):
+        """
+        :return: A copy of the package with the selected classes only, or None if it holds no selected class
+        """
+        p = EPackageInfo(package.name, package.key)
+        p.classes = [c for c in package.classes if c in selected]
+        for sp in package.subpackages:
+            sp = self.slice_package(sp, selected)
+            if sp is not None:
+                p.subpackages.append(sp)
+        if p.classes or p.subpackages:
+            return p
+        return None
+
+
+class Partitioning:
+    """
+    Splits the classes of a model into chunks of bounded size, so that each chunk can be written to its own graph
+    """
+
+    strategies = ('package', 'graph')
+    refine_passes = 2
+
+    def __init__(self, index, max_size, strategy='package'):
+        """
+        :param index: The ModelIndex of the model
+        :param max_size: The maximum number of classes of a chunk
+        :param strategy: 'package' to keep the classes of a package together (large packages are split), or 'graph'
+            to grow the chunks along the edges of the model, which minimizes the edges between chunks
+        """
+        if strategy not in self.strategies:
+            raise ValueError('Unknown strategy {}, expected one of {}'.format(strategy, ', '.join(self.strategies)))
+        if max_size < 1:
+            raise ValueError('The maximum chunk size must be positive')
+        self.index = index
+        self.max_size = max_size
+        self.classes = [c for c in index.model.classes if not c.external]
+        if strategy == 'package':
+            self.chunks = self.split_by_package()
+        else:
+            self.chunks = self.split_by_graph()
+        self.chunk_of = {c: i for i, chunk in enumerate(self.chunks) for c in chunk}
+        # The edges of each chunk, including those to other chunks
+        self.chunk_edges = [[] for _ in self.chunks]
+        for e in index.model.edges:
+            a, b = (self.chunk_of.get(c) for c in get_edge_ends(e))
+            if a is not None:
+                self.chunk_edges[a].append(e)
+            if b is not None and b != a:
+                self.chunk_edges[b].append(e)
+
+    def split_by_package(self):
+        """
+        Fill the chunks with the packages in depth-first order. A package that does not fit in the current chunk
+        starts a new one, and packages larger than max_size are split.
+        :return: The chunks, lists of EClassInfo
+        """
+        chunks = [[]]
+        packages = list(reversed(self.index.model.packages))
+        while packages:
+            package = packages.pop()
+            packages.extend(reversed(package.subpackages))
+            classes = package.classes
+            if chunks[-1] and len(chunks[-1]) + len(classes) > self.max_size:
+                chunks.append([])
+            for c in classes:
+                if len(chunks[-1]) == self.max_size:
+                    chunks.append([])
+                chunks[-1].append(c)
+        return [chunk for chunk in chunks if chunk]
+
+    def split_by_graph(self):
+        """
+        Grow each chunk from a seed class, always adding the class with the most edges into the chunk, then move the
+        classes that have more edges into another chunk (that has room) to it
+        :return: The chunks, lists of EClassInfo
+        """
+        order = {c: i for i, c in enumerate(self.classes)}
+        chunk_of = {}
+        chunks = []
+        seeds = iter(self.classes)
+        for seed in seeds:
+            if seed in chunk_of:
+                continue
+            chunk = set()
+            n = len(chunks)
+            chunks.append(chunk)
+            gains = Counter()
+            heap = [(0, order[seed])]
+            while len(chunk) < self.max_size:
+                if not heap:
+                    # The connected classes are exhausted, fill the chunk with the next ones
+                    seed = next((c for c in seeds if c not in chunk_of), None)
+                    if seed is None:
+                        break
+                    heap.append((0, order[seed]))
+                gain, i = heapq.heappop(heap)
+                c = self.classes[i]
+                if c in chunk_of or -gain != gains[c]:
+                    continue    # Already added, or a stale entry
+                chunk_of[c] = n
+                chunk.add(c)
+                for o in self.get_neighbours(c):
+                    if o not in chunk_of:
+                        gains[o] += 1
+                        heapq.heappush(heap, (-gains[o], order[o]))
+        for _ in range(self.refine_passes):
+            moved = False
+            for c in self.classes:
+                links = Counter(chunk_of[o] for o in self.get_neighbours(c))
+                current = chunk_of[c]
+                for target, count in links.most_common():
+                    if count <= links[current]:
+                        break
+                    if len(chunks[target]) < self.max_size:
+                        chunks[current].remove(c)
+                        chunks[target].add(c)
+                        chunk_of[c] = target
+                        moved = True
+                        break
+            if not moved:
+                break
+        return [sorted(chunk, key=order.get) for chunk in chunks if chunk]
+
+    def get_neighbours(self, eclass):
+        return [o for _, o in self.index.adjacency[eclass] if o is not eclass and not o.external]
+
+    def iter_cross_edges(self):
+        """
+        :return: An iterator over the (source, target) chunk indexes of the edges between different chunks
+        """
+        for e in self.index.model.edges:
+            a, b = (self.chunk_of.get(c) for c in get_edge_ends(e))
+            if a is not None and b is not None and a != b:
+                yield a, b
+
+    def slice(self, i):
+        """
+        Extract the model of a chunk. The classes of other chunks (and external classes) that are connected to the
+        chunk are added as external classes, without attributes.
+        :param i: The chunk index
+        :return: An (EcoreModel, dict) tuple. The dict maps the classes of other chunks to their external copies.
+        """
+        selected = set(self.chunks[i])
+        ghosts = {}
+
+        def get_end(c):
+            if c in selected:
+                return c
+            ghost = ghosts.get(c)
+            if ghost is None:
+                ghost = c if c.external else EClassInfo(c.name, c.abstract, True, c.key)
+                ghosts[c] = ghost
+            return ghost
+
+        model = EcoreModel()
+        for e in self.chunk_edges[i]:
+            a, b = get_edge_ends(e)
+            if a in selected and b in selected:
+                model.edges.append(e)
+            elif isinstance(e, ESuperTypeInfo):
+                model.edges.append(ESuperTypeInfo(get_end(a), get_end(b)))
+            else:
+                r = EReferenceInfo(get_end(a), get_end(b), e.name, e.lower, e.upper, e.containment)
+                r.opposite = e.opposite
+                model.edges.append(r)
+        model.classes = self.chunks[i] + list(ghosts.values())
+        for p in self.index.model.packages:
+            p = self.index.slice_package(p, selected)
+            if p is not None:
+                model.packages.append(p)
+        model.dependencies = self.index.model.dependencies
+        return model, ghosts
+
+    def get_overview(self, names):
+        """
+        Build the overview model: one class per chunk, listing the number of classes of each package in the chunk,
+        and one reference per pair of connected chunks (in either direction), labelled with the number of edges
+        between them
+        :param names: The names of the chunks
+        :return: An (EcoreModel, list) tuple. The list holds the class of each chunk.
+        """
+        package_paths = {}
+        packages = [(p, p.name) for p in self.index.model.packages]
+        while packages:
+            package, path = packages.pop()
+            for c in package.classes:
+                package_paths[c] = path
+            packages.extend((sp, path + '/' + sp.name) for sp in package.subpackages)
+        model = EcoreModel()
+        for name, chunk in zip(names, self.chunks):
+            node = EClassInfo(name, key=name)
+            for path, count in Counter(package_paths[c] for c in chunk).items():
+                node.attributes.append(EAttributeInfo(path, '{} classes'.format(count), count, count))
+            model.classes.append(node)
+        pairs = Counter((min(a, b), max(a, b)) for a, b in self.iter_cross_edges())
+        for (a, b), count in sorted(pairs.items()):
+            model.edges.append(EReferenceInfo(model.classes[a], model.classes[b], '{} edges'.format(count), 0, 0))
+        return model, model.classes
+
+
+class GraphMLWriter:
+    """
+    Writes the graph elements to a file as they are produced, so the output is never held in memory as a whole.
+    """
+
+    def __init__(self, fout, pretty_print=True):
+        """
+        Create a new writer. The writer must be used as a context manager.
+        :param fout: The output file, opened in binary mode
+        :param pretty_print: Indent the output. If False, the output is compact.
+        """
+        self.fout = fout
+        self.pretty_print = pretty_print
+        self.xmlfile = None
+        self.xf = None
+        self.contexts = []      # The open elements, root first
+        self.declarations = []  # The namespace declarations of the root, which the elements do not need to repeat
+
+    def __enter__(self):
+        self.xmlfile = etree.xmlfile(self.fout, encoding='utf-8')
+        self.xf = self.xmlfile.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        while self.contexts:
+            self.contexts.pop().__exit__(exc_type, exc_val, exc_tb)
+        return self.xmlfile.__exit__(exc_type, exc_val, exc_tb)
+
+    def start(self, root):
+        """
+        Open the root element. Its children are written with write().
+        :param root: The (childless) root element
+        """
+        self.xf.write_declaration()
+        self.start_element(root, root.nsmap)
+        self.declarations = [' xmlns:{}="{}"'.format(prefix, uri).encode()
+                             for prefix, uri in root.nsmap.items() if prefix is not None]
+
+    def start_element(self, element, nsmap=None):
+        """
+        Open an element (without its children). The elements written until end_element() are its children.
+        :param element: The element
+        :param nsmap: The namespaces declared by the element
+        """
+        context = self.xf.element(element.tag, element.attrib, nsmap=nsmap)
+        context.__enter__()
+        self.contexts.append(context)
+        if self.pretty_print:
+            self.xf.write('\n')
+
+    def end_element(self):
+        """
+        Close the last element opened with start_element()
+        """
+        self.contexts.pop().__exit__(None, None, None)
+        if self.pretty_print:
+            self.xf.write('\n')
+
+    def write(self, element):
+        """
+        Write an element with its children. The element templates declare the namespaces they use (e.g. y:), which
+        lxml would repeat on every element; the declarations the root already makes are left out.
+        """
+        data = etree.tostring(element, pretty_print=self.pretty_print)
+        end = data.find(b'>')
+        for declaration in self.declarations:
+            i = data.find(declaration, 0, end)
+            if i >= 0:
+                data = data[:i] + data[i + len(declaration):]
+                end -= len(declaration)
+        self.xf.flush()
+        self.fout.write(data)
+
+
+class Layout:
+    """
+    The geometry of the nodes (y:Geometry) and the bends of the edges (y:Path) of an existing graph, by the stable
+    key of the EClass, EPackage or reference they represent. The keys are read from the stable_key_name attribute, so
+    a graph saved by yEd (which renumbers the ids) can still be matched.
+    """
+
+    def __init__(self):
+        self.nodes = dict()
+        self.edges = dict()
+        self.kept = 0       # Nodes that got their geometry back
+        self.added = 0      # Nodes without geometry
+
+    @property
+    def removed(self):
+        """
+        The number of nodes of the existing graph that were not restored
+        """
+        return len(self.nodes) - self.kept
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read the layout of a graph generated with stable ids
+        :param path: The graphml (or graphmlz) file
+        :return: The Layout
+        """
+        import gzip
+        layout = cls()
+        key_ids = set()
+        opener = gzip.open if path.endswith('.graphmlz') else open
+        with opener(path, 'rb') as fin:
+            for _, element in etree.iterparse(fin, tag=(gml_ns + 'key', gml_ns + 'node', gml_ns + 'edge')):
+                if element.tag == gml_ns + 'key':
+                    if element.attrib.get('attr.name') == stable_key_name:
+                        key_ids.add(element.attrib['id'])
+                    continue
+                if element.tag == gml_ns + 'node':
+                    store, geometry_tag = layout.nodes, y_ns + 'Geometry'
+                else:
+                    store, geometry_tag = layout.edges, y_ns + 'Path'
+                key = geometry = None
+                for data in element.iterchildren(gml_ns + 'data'):
+                    if data.attrib.get('key') in key_ids:
+                        key = data.text
+                    elif geometry is None:
+                        geometry = next(data.iter(geometry_tag), None)
+                if key is not None and geometry is not None:
+                    store[key] = copy.deepcopy(geometry)
+                element.clear()
+        return layout
+
+    def restore_node(self, key, shape):
+        """
+        Add the geometry of the node to its shape, if the node existed
+        :param key: The stable key of the node
+        :param shape: The y:GenericNode or y:GroupNode
+        """
+        geometry = self.nodes.get(key)
+        if geometry is None:
+            self.added += 1
+        else:
+            shape.insert(0, copy.deepcopy(geometry))
+            self.kept += 1
+
+    def restore_edge(self, key, shape):
+        """
+        Add the bends of the edge to its shape, if the edge existed
+        :param key: The stable key of the edge
+        :param shape: The y:PolyLineEdge
+        """
+        path = self.edges.get(key)
+        if path is not None:
+            shape.insert(0, copy.deepcopy(path))
+
+
+class LayeredLayout:
+    """
+    Computes the geometry of the nodes of a model. Classes are placed in layers by the depth of their inheritance
+    hierarchy, so super types are above their subclasses. The classes of each layer are ordered by the mean position of
+    the classes they are connected to (by any edge) in the layers above, which keeps related classes together and
+    reduces edge crossings. Layers wider than row_size classes are wrapped. The cost is linear in the size of the model
+    (plus sorting the layers), so it scales to very large models.
+
+    When the classes are grouped by package, each package is laid out on its own: the block of its classes is placed
+    above the blocks of its eSubpackages, side by side, so the group nodes do not overlap.
+    """
+
+    horizontal_gap = 40
+    vertical_gap = 80
+    # The space around the classes of a group node, also used by Graph.get_package_bounds
+    group_inset = 15
+    group_label_height = 22
+
+    def __init__(self, model, hide_mult=False, row_size=None, groups=False):
+        """
+        :param model: The EcoreModel
+        :param hide_mult: Hide the multiplicities (affects the node sizes)
+        :param row_size: The maximum number of classes per row. Defaults to twice the square root of the number of
+            classes (of the model, or of the package if grouped), which gives a roughly square diagram.
+        :param groups: Lay out each package separately, for graphs that show the packages as group nodes
+        """
+        self.model = model
+        self.hide_mult = hide_mult
+        self.row_size = row_size
+        self.groups = groups
+        self.geometry = dict()  # EClassInfo to (x, y, width, height)
+        self.neighbours = None  # The classes connected to each class, while computing
+
+    def get_layers(self, classes=None):
+        """
+        Assign each class to the layer below its deepest super type (longest path layering, in topological order).
+        Classes in inheritance cycles are put in the first layer.
+        :param classes: The classes to assign, all the classes of the model if None. Only the super types among them
+            are taken into account.
+        :return: The list of layers, each a list of classes in model order
+        """
+        if classes is None:
+            classes = self.model.classes
+        layer = {c: 0 for c in classes}
+        subtypes = defaultdict(list)
+        pending = Counter()     # The number of super types of each class whose layer is not known
+        for e in self.model.edges:
+            if isinstance(e, ESuperTypeInfo) and e.eclass is not e.super_type and e.eclass in layer \
+                    and e.super_type in layer:
+                subtypes[e.super_type].append(e.eclass)
+                pending[e.eclass] += 1
+        queue = [c for c in classes if not pending[c]]
+        for c in queue:     # The queue grows while iterating
+            for sub in subtypes[c]:
+                layer[sub] = max(layer[sub], layer[c] + 1)
+                pending[sub] -= 1
+                if not pending[sub]:
+                    queue.append(sub)
+        layers = [[] for _ in range(max(layer.values(), default=-1) + 1)]
+        for c in classes:
+            layers[layer[c]].append(c)
+        return layers
+
+    def compute(self):
+        """
+        :return: The geometry of each class, a dict of EClassInfo to (x, y, width, height) tuples
+        """
+        self.neighbours = defaultdict(list)
+        for e in self.model.edges:
+            if isinstance(e, ESuperTypeInfo):
+                a, b = e.eclass, e.super_type
+            else:
+                a, b = e.source, e.target
+            self.neighbours[a].append(b)
+            self.neighbours[b].append(a)
+        if not self.groups:
+            self.place_classes(self.model.classes)
+        else:
+            # External classes are not grouped, they get a block of their own next to the packages
+            blocks = [self.place_package(p) for p in self.model.packages]
+            blocks.append(self.place_classes([c for c in self.model.classes if c.external]))
+            self.place_blocks(blocks, 0)
+        self.neighbours = None
+        return self.geometry
+
+    def place_classes(self, classes):
+        """
+        Lay out the classes in layers, in a block whose top left corner is the origin
+        :param classes: The classes
+        :return: The block, a (classes, width, height) tuple
+        """
+        row_size = self.row_size
+        if row_size is None:
+            row_size = max(10, int(2 * math.sqrt(len(classes))))
+        center = dict()     # The horizontal center of the placed classes
+        rows = []
+        y = 0
+        for layer in self.get_layers(classes):
+            order = {c: i for i, c in enumerate(layer)}
+
+            def barycenter(c):
+                placed = [center[n] for n in self.neighbours[c] if n in center]
+                if placed:
+                    return sum(placed) / len(placed), order[c]
+                return math.inf, order[c]
+
+            layer.sort(key=barycenter)
+            for start in range(0, len(layer), row_size):
+                row = layer[start:start + row_size]
+                sizes = [EClassNode.get_size(c, self.hide_mult) for c in row]
+                x = 0
+                for c, (width, height) in zip(row, sizes):
+                    self.geometry[c] = (x, y, width, height)
+                    center[c] = x + width / 2
+                    x += width + self.horizontal_gap
+                rows.append((row, x - self.horizontal_gap))
+                y += max(height for _, height in sizes) + self.vertical_gap
+        # Center the rows
+        width = max((row_width for _, row_width in rows), default=0)
+        for row, row_width in rows:
+            self.move(row, (width - row_width) / 2, 0)
+        return list(classes), width, max(y - self.vertical_gap, 0)
+
+    def place_package(self, package):
+        """
+        Lay out the classes of the package above the blocks of its eSubpackages, which are placed side by side
+        :param package: The EPackageInfo
+        :return: The block, a (classes, width, height) tuple, with its top left corner at the origin
+        """
+        classes, width, height = self.place_classes(package.classes)
+        blocks = [b for b in (self.place_package(sp) for sp in package.subpackages) if b[0]]
+        if not blocks:
+            return classes, width, height
+        # Leave room for the label and the border of the subpackage groups
+        top = self.group_inset + self.group_label_height
+        if classes:
+            top += height + self.vertical_gap
+        nested, nested_width, nested_height = self.place_blocks(blocks, top)
+        if width < nested_width:
+            self.move(classes, (nested_width - width) / 2, 0)
+        else:
+            self.move(nested, (width - nested_width) / 2, 0)
+        return classes + nested, max(width, nested_width), top + nested_height
+
+    def place_blocks(self, blocks, top):
+        """
+        Place blocks side by side, far enough apart that their group nodes do not overlap
+        :param blocks: The (classes, width, height) tuples of the blocks, each at the origin
+        :param top: The vertical position of the blocks
+        :return: The block that contains them, a (classes, width, height) tuple
+        """
+        classes = []
+        x = 0
+        height = 0
+        for block_classes, block_width, block_height in blocks:
+            if not block_classes:
+                continue
+            self.move(block_classes, x, top)
+            classes.extend(block_classes)
+            x += block_width + self.horizontal_gap + 2 * self.group_inset
+            height = max(height, block_height)
+        return classes, max(x - self.horizontal_gap - 2 * self.group_inset, 0), height
+
+    def move(self, classes, dx, dy):
+        for c in classes:
+            x, y, width, height = self.geometry[c]
+            self.geometry[c] = (x + dx, y + dy, width, height)
+
+
+class Graph:
+    """
+    The yEd graph of an intermediate model
+    """
+
+    def __init__(self, edgedefault='directed', writer=None, profile=None, stable_ids=False, layout=None,
+                 geometry=None, links=None):
+        """
+        Create a new graph
+        :param edgedefault: The default edge type
+        :param writer: A GraphMLWriter. If provided, nodes and edges are written as soon as they are complete instead
+            of being added to the root.
+        :param profile: An optional Profile to record the conversion phases and events in
+        :param stable_ids: Derive the ids of the nodes and edges from the stable keys of the model, and record the
+            keys in the graph, instead of numbering them
+        :param layout: The Layout of a previous graph to restore. Implies stable_ids.
+        :param geometry: The geometry of the classes (see LayeredLayout). Nodes restored from the layout keep their
+            geometry.
+        :param links: A dict of EClassInfo to the location of the graph that shows the class, recorded as the URL of
+            their nodes
+        """
+        self.logger = logging.getLogger(__name__)
+        nsmap = {None: GRAPHML_NAMESPACE, 'xsi': XSI_NAMESPACE, 'y': YWORKS_NAMESPACE}  # the default namespace (no prefix)
+        self.root = etree.Element('graphml', id='G', edgedefault=edgedefault, nsmap=nsmap)
+        self.root.attrib[xsi_ns+'schemaLocation'] = 'http://graphml.graphdrawing.org/xmlns ' \
+                                                         'http://www.yworks.com/xml/schema/graphml/1.0/ygraphml.xsd'
+        self.writer = writer
+        self.profile = profile
+        self.parents = [self.root]  # The graph elements that emitted elements are added to
+        if writer is not None:
+            writer.start(self.root)
+        # Yed uses at least node/edge graphics and description
+        key_id = get_key_id()
+        self.node_graph_key = self.new_key(next(key_id), 'node', {'yfiles.type': 'nodegraphics'})
+        self.edge_graph_key = self.new_key(next(key_id), 'edge', {'yfiles.type': 'edgegraphics'})
+        self.node_desc_key = self.new_key(next(key_id), 'node', {'attr.name': 'description', 'attr.type': 'string'})
+        self.edge_desc_key = self.new_key(next(key_id), 'edge', {'attr.name': 'description', 'attr.type': 'string'})
+        self.layout = layout
+        self.geometry = geometry
+        self.stable_ids = stable_ids or layout is not None
+        if self.stable_ids:
+            self.node_key_key = self.new_key(next(key_id), 'node', {'attr.name': stable_key_name,
+                                                                    'attr.type': 'string'})
+            self.edge_key_key = self.new_key(next(key_id), 'edge', {'attr.name': stable_key_name,
+                                                                    'attr.type': 'string'})
+        self.links = links
+        if links is not None:
+            self.node_url_key = self.new_key(next(key_id), 'node', {'attr.name': 'url', 'attr.type': 'string'})
+        self.node_id = get_node_id()
+        self.edge_id = get_edge_id()
+        # EClassInfo to node ids
+        self.class_to_id = dict()
+        # The external metamodels of the model
+        self.dependencies = set()
+
+    def get_node_id(self, eclass):
+        return self.class_to_id[eclass]
+
+    def emit(self, element):
+        """
+        Add a complete element to the graph
+        :param element: The node, edge or key element
+        """
+        if self.writer is None:
+            self.parents[-1].append(element)
+        elif self.profile is None:
+            self.writer.write(element)
+        else:
+            with self.profile.phase('serialize'):
+                self.writer.write(element)
+
+    def start_group(self, group):
+        """
+        Emit a group node. The nodes emitted until end_group() are added to the group's graph.
+        :param group: The EPackageNode
+        """
+        if self.writer is None:
+            self.emit(group.node)
+            self.parents.append(group.graph)
+        else:
+            self.writer.start_element(group.node)
+            for data in group.node.iterchildren('data'):
+                self.emit(data)
+            self.writer.start_element(group.graph)
+
+    def end_group(self):
+        if self.writer is None:
+            self.parents.pop()
+        else:
+            self.writer.end_element()
+            self.writer.end_element()
+
+    def release(self):
+        """
+        Drop all references to the model once the graph is complete. Only the output (i.e. root) remains usable.
+        """
+        self.class_to_id.clear()
+
+    def new_key(self, id, target, attrib=None):
+        key = etree.Element('key', id=id)
+        key.attrib['for'] = target
+        if attrib is not None:
+            key.attrib.update(attrib)
+        self.emit(key)
+        return key
+
+    def add_model(self, model, hide_mult=False, groups=False):
+        """
+        Add the nodes of all classes of the model, then the edges between them
+        :param model: The EcoreModel
+        :param hide_mult: Hide multiplicities on attributes
+        :param groups: Nest the nodes of the classes in group nodes that represent their packages. External classes
+            are not grouped.
+        """
+        self.dependencies.update(model.dependencies)
+        classes = model.classes
+        if groups:
+            for p in model.packages:
+                self.add_package(p, hide_mult)
+            classes = [c for c in classes if c.external]
+        for c in classes:
+            self.emit(self.add_eclass_node(c, hide_mult).node)
+        for e in model.edges:
+            if isinstance(e, ESuperTypeInfo):
+                edge = self.add_inheritance(e)
+            else:
+                edge = self.add_reference(e)
+            self.emit(edge.edge)
+
+    def new_node_id(self, key):
+        if self.stable_ids:
+            return get_stable_id('n-', key)
+        return next(self.node_id)
+
+    def new_edge_id(self, key):
+        if self.stable_ids:
+            return get_stable_id('e-', key)
+        return next(self.edge_id)
+
+    def set_node_key(self, node, key, shape):
+        """
+        Record the stable key of the node and restore its geometry, if the graph has stable ids
+        :param node: The node element
+        :param key: The stable key
+        :param shape: The y:GenericNode or y:GroupNode of the node
+        """
+        if self.stable_ids:
+            data = etree.Element('data', key=self.node_key_key.attrib['id'])
+            data.text = key
+            node.insert(2, data)    # After the graphics and description, before the graph of groups
+            if self.layout is not None:
+                self.layout.restore_node(key, shape)
+
+    def set_edge_key(self, edge, key, shape):
+        """
+        Record the stable key of the edge and restore its bends, if the graph has stable ids
+        :param edge: The edge element
+        :param key: The stable key
+        :param shape: The y:PolyLineEdge of the edge
+        """
+        if self.stable_ids:
+            etree.SubElement(edge, 'data', key=self.edge_key_key.attrib['id']).text = key
+            if self.layout is not None:
+                self.layout.restore_edge(key, shape)
+
+    @staticmethod
+    def set_geometry(shape, box):
+        """
+        Set the geometry of a node, unless it was restored from the layout
+        :param shape: The y:GenericNode or y:GroupNode of the node
+        :param box: An (x, y, width, height) tuple, or None
+        """
+        if box is None or shape[0].tag == y_ns + 'Geometry':
+            return
+        x, y, width, height = ('{:.1f}'.format(v) for v in box)
+        shape.insert(0, etree.Element(y_ns + 'Geometry', x=x, y=y, width=width, height=height))
+
+    def get_class_box(self, eclass):
+        """
+        The geometry the node of the class is emitted with: its geometry in the restored layout, if any, or the
+        computed one
+        :return: An (x, y, width, height) tuple, or None if the class has no geometry
+        """
+        if self.layout is not None:
+            geometry = self.layout.nodes.get(eclass.key)
+            if geometry is not None:
+                return tuple(float(geometry.attrib[k]) for k in ('x', 'y', 'width', 'height'))
+        return self.geometry.get(eclass)
+
+    def get_package_bounds(self, package):
+        """
+        The box that contains the nodes of the package and of its eSubpackages
+        :param package: The EPackageInfo
+        :return: An (x, y, width, height) tuple, or None if the classes have no geometry
+        """
+        boxes = [b for b in (self.get_class_box(c) for c in package.classes) if b is not None]
+        boxes.extend(b for b in (self.get_package_bounds(sp) for sp in package.subpackages) if b is not None)
+        if not boxes:
+            return None
+        inset, label_height = LayeredLayout.group_inset, LayeredLayout.group_label_height
+        left = min(b[0] for b in boxes)
+        top = min(b[1] for b in boxes)
+        right = max(b[0] + b[2] for b in boxes)
+        bottom = max(b[1] + b[3] for b in boxes)
+        return (left - inset, top - inset - label_height, right - left + 2 * inset,
+                bottom - top + 2 * inset + label_height)
+
+    def add_package(self, package, hide_mult=False):
+        """
+        Emit the group node of the package, with the nodes of its classes and the groups of its eSubpackages
+        :param package: The EPackageInfo
+        :param hide_mult: Hide multiplicities on attributes
+        """
+        group = EPackageNode(self.new_node_id(package.key), package.name, self.node_graph_key.attrib['id'],
+                             self.node_desc_key.attrib['id'])
+        self.set_node_key(group.node, package.key, group.group_node)
+        if self.geometry is not None:
+            bounds = self.get_package_bounds(package)
+            if bounds is not None and group.group_node[0].tag == y_ns + 'Geometry':
+                del group.group_node[0]     # The group follows the geometry of its classes, restored or computed
+            self.set_geometry(group.group_node, bounds)
+        self.start_group(group)
+        for c in package.classes:
+            self.emit(self.add_eclass_node(c, hide_mult).node)
+        for sp in package.subpackages:
+            self.add_package(sp, hide_mult)
+        self.end_group()
+
+    def add_eclass_node(self, eclass, hide_mult=False):
+        """
+        Create the node that represents the class
+        :param eclass: The EClassInfo
+        :param hide_mult: Hide multiplicities on attributes
+        :return: The node
+        """
+        y_id = self.new_node_id(eclass.key)
+        self.class_to_id[eclass] = y_id
+        n = EClassNode(y_id, eclass.abstract, self.node_graph_key.attrib['id'], self.node_desc_key.attrib['id'],
+                       external=eclass.external)
+        n.set_label_text(eclass.name)
+        n.add_eattributes(eclass.attributes, hide_mult)
+        self.set_node_key(n.node, eclass.key, n.generic_node)
+        if self.geometry is not None:
+            self.set_geometry(n.generic_node, self.geometry.get(eclass))
+        if self.links is not None and eclass in self.links:
+            etree.SubElement(n.node, 'data', key=self.node_url_key.attrib['id']).text = self.links[eclass]
+        return n
+
+    def add_edge(self, source, target, containment=False, inheritance=False, key=None):
+        """
+        Create a new edge. The edge is added to the graph with emit() once complete.
+        :param source: source node id
+        :param target: target node id
+        :param key: The stable key of the edge
+        :return:
+        """
+        id = self.new_edge_id(key)
+        e = EReferenceEdge(id, source, target, self.edge_graph_key.attrib['id'], self.edge_desc_key.attrib['id'],
+                           containment=containment, inheritance=inheritance)
+        self.set_edge_key(e.edge, key, e.polyline_edge)
+        return e
+
+    def add_inheritance(self, super_type):
+        """
+        Create the edge of a super type, from the super type to the subclass
+        :param super_type: The ESuperTypeInfo
+        :return: The edge
+        """
+        e = self.add_edge(self.get_node_id(super_type.super_type), self.get_node_id(super_type.eclass),
+                          inheritance=True, key=super_type.key)
+        if self.geometry is not None and self.layout is None:
+            # Leave the super type from the bottom and enter the subclass from the top
+            source = self.geometry.get(super_type.super_type)
+            target = self.geometry.get(super_type.eclass)
+            if source is not None and target is not None and source[1] < target[1]:
+                e.polyline_edge.insert(0, etree.Element(y_ns + 'Path', sx='0.0', sy='{:.1f}'.format(source[3] / 2),
+                                                        tx='0.0', ty='{:.1f}'.format(-target[3] / 2)))
+        return e
+
+    def add_reference(self, reference):
+        """
+        Create the edge of a reference, labelled with both ends if the reference has an opposite
+        :param reference: The EReferenceInfo
+        :return: The edge
+        """
+        e = self.add_edge(self.get_node_id(reference.source), self.get_node_id(reference.target),
+                          containment=reference.containment, key=reference.key)
+        e.create_labels(reference.name, bounds_to_string(reference.lower, reference.upper))
+        opposite = reference.opposite
+        if opposite is not None:
+            e.add_labels(opposite.containment, opposite.name, bounds_to_string(opposite.lower, opposite.upper))
+        return e
+
+
+class Converter:
+    """
+    Converts Ecore metamodels to graphs. The converter only holds the conversion options and the external metamodels,
+    all the state of a conversion lives in its graph. Hence, a converter can be reused and shared between threads.
+    """
+
+    def __init__(self, create_external=False, hide_mult=False, schema_location=None, resource_set=None,
+                 on_profile=None, low_memory=False, groups=False, stable_ids=False, update=False,
+                 auto_layout=False, prefetch=0):
+        """
+        Create a new converter
+        :param create_external: Create nodes for external references
+        :param hide_mult: Hide multiplicities on attributes
+        :param schema_location: The catalog, mapping metamodel URIs to file locations
+        :param resource_set: The resource set used to load external metamodels. Provide one to share the parsed
+            metamodels between converters.
+        :param on_profile: If provided, each conversion is profiled and this callable is called with its Profile
+        :param low_memory: Parse the input with parse_skeleton instead of keeping its whole tree
+        :param groups: Represent the packages with group nodes that contain the nodes of their classes
+        :param stable_ids: Derive the ids of nodes and edges from the Ecore fragments (see Graph)
+        :param update: Restore the layout of the existing output file when converting to a file. Implies stable_ids.
+        :param auto_layout: Compute the geometry of the nodes with a LayeredLayout. With update, only the nodes that
+            were not restored use it.
+        :param prefetch: Load the external metamodels referenced by the input with this many threads before adding
+            the features (see ModelBuilder.prefetch). If 0, they are loaded when first used.
+        """
+        self.create_external = create_external
+        self.hide_mult = hide_mult
+        self.low_memory = low_memory
+        self.groups = groups
+        self.stable_ids = stable_ids or update
+        self.update = update
+        self.auto_layout = auto_layout
+        self.prefetch = prefetch
+        if schema_location is None:
+            schema_location = {}
+        self.schema_location = schema_location
+        if resource_set is None:
+            resource_set = ResourceSet()
+        self.resource_set = resource_set
+        self.on_profile = on_profile
+
+    def build_model(self, fin, base_path='', profile=None):
+        """
+        Build the intermediate model of the metamodel. The source tree is released on return.
+        :param fin: The input ecore file (file object or path)
+        :param base_path: The folder that relative external locations are resolved against
+        :param profile: An optional Profile to record the phases in
+        :return: The EcoreModel
+        """
+        with self.phase(profile, 'parse'):
+            if self.low_memory:
+                tree = parse_skeleton(fin)
+            else:
+                tree = etree.parse(fin)
+            if hasattr(fin, 'close'):
+                fin.close()
+        with self.phase(profile, 'index'):
+            resource = EcoreResource(tree)
+        builder = ModelBuilder(self.create_external, self.schema_location, self.resource_set, base_path, profile)
+        # All classes are collected before linking, as features can refer to classes in any package
+        with self.phase(profile, 'add_eclasses'):
+            for i, package in enumerate(resource.packages):
+                builder.add_eclasses(package, '/{}/'.format(i) if i else '//')
+        if self.prefetch > 0:
+            with self.phase(profile, 'prefetch'):
+                failures = builder.prefetch(resource.packages, self.prefetch)
+            for mm_ref, ecore_file, reason in failures:
+                warnings.warn("The external metamodel {} ({}) could not be prefetched: {}. Adding the types it "
+                              "defines as strings. See --catalog option.".format(mm_ref, ecore_file or 'no location',
+                                                                                reason))
+        # This creates attributes and edges
+        with self.phase(profile, 'add_features'):
+            for package in resource.packages:
+                builder.add_features(package, resource)
+        return builder.release()
+
+    def convert(self, fin, base_path='', writer=None, layout=None):
+        """
+        Convert the metamodel
+        :param fin: The input ecore file (file object or path)
+        :param base_path: The folder that relative external locations are resolved against
+        :param writer: An optional GraphMLWriter to stream the graph to
+        :param layout: An optional Layout to restore
+        :return: The graph
+        """
+        profile = None
+        if self.on_profile is not None:
+            profile = Profile()
+        with self.phase(profile, 'total'):
+            # Create a graph for the package.. one graph per package?
+            model = self.build_model(fin, base_path, profile)
+            g = self.emit_model(model, writer, layout, profile)
+        if profile is not None:
+            self.on_profile(profile)
+        return g
+
+    def emit_model(self, model, writer=None, layout=None, profile=None, links=None, overview=False):
+        """
+        Create the graph of a model
+        :param model: The EcoreModel
+        :param writer: An optional GraphMLWriter to stream the graph to
+        :param layout: An optional Layout to restore
+        :param profile: An optional Profile to record the phases in
+        :param links: An optional dict of EClassInfo to the location of the graph that shows the class
+        :param overview: The model is an overview of other graphs (see Partitioning.get_overview), its classes are
+            neither grouped nor shown with multiplicities
+        :return: The graph
+        """
+        hide_mult = self.hide_mult or overview
+        groups = self.groups and not overview
+        geometry = None
+        if self.auto_layout:
+            with self.phase(profile, 'auto_layout'):
+                geometry = LayeredLayout(model, hide_mult, groups=groups).compute()
+        g = Graph(writer=writer, profile=profile, stable_ids=self.stable_ids, layout=layout, geometry=geometry,
+                  links=links)
+        with self.phase(profile, 'emit'):
+            g.add_model(model, hide_mult, groups)
+        g.release()
+        if profile is not None and layout is not None:
+            profile.count('layout_kept', layout.kept)
+            profile.count('layout_added', layout.added)
+            profile.count('layout_removed', layout.removed)
+        return g
+
+    @staticmethod
+    def phase(profile, name):
+        return nullcontext() if profile is None else profile.phase(name)
+
+    def convert_to_file(self, input, output, pretty_print=True, compresslevel=None):
+        """
+        Convert the metamodel and stream the graph to the output file. The output is replaced only if the conversion
+        succeeds.
+        :param input: The input ecore file
+        :param output: The output graphml file. Outputs with the graphmlz extension are gzip-compressed.
+        :param pretty_print: Indent the output
+        :param compresslevel: Compress the output with the given gzip level (1-9). Defaults to default_compresslevel
+            for graphmlz outputs and no compression otherwise.
+        :return: The absolute locations of the external metamodels the conversion loaded
+        """
+        with self.open_output(output, pretty_print, compresslevel) as (writer, layout):
+            g = self.convert(input, os.path.dirname(input), writer, layout)
+        return g.dependencies
+
+    def convert_views(self, input, views, pretty_print=True, compresslevel=None):
+        """
+        Convert the metamodel once and write the graph of each view to its own file
+        :param input: The input ecore file
+        :param views: A list of (output, View) tuples
+        :param pretty_print: Indent the outputs
+        :param compresslevel: Compress the outputs (see convert_to_file)
+        :return: The absolute locations of the external metamodels the conversion loaded
+        """
+        profile = None
+        if self.on_profile is not None:
+            profile = Profile()
+        with self.phase(profile, 'total'):
+            model = self.build_model(input, os.path.dirname(input), profile)
+            with self.phase(profile, 'index_views'):
+                index = ModelIndex(model)
+            for output, view in views:
+                with self.phase(profile, 'slice'):
+                    view_model = index.slice(view)
+                with self.open_output(output, pretty_print, compresslevel) as (writer, layout):
+                    self.emit_model(view_model, writer, layout, profile)
+        if profile is not None:
+            self.on_profile(profile)
+        return model.dependencies
+
+    def convert_partitions(self, input, output, max_size, strategy='package', pretty_print=True, compresslevel=None):
+        """
+        Convert the metamodel and split its graph into chunks of at most max_size classes (see Partitioning). Each
+        chunk is written to OUTPUT.partN, where the classes of other chunks it is connected to are shown as external
+        nodes that link to their chunk. The output holds an overview graph of the chunks.
+        :param input: The input ecore file
+        :param output: The output graphml file of the overview
+        :param max_size: The maximum number of classes of a chunk
+        :param strategy: The partitioning strategy, 'package' or 'graph'
+        :param pretty_print: Indent the outputs
+        :param compresslevel: Compress the outputs (see convert_to_file)
+        :return: The locations of the chunk graphs
+        """
+        profile = None
+        if self.on_profile is not None:
+            profile = Profile()
+        with self.phase(profile, 'total'):
+            model = self.build_model(input, os.path.dirname(input), profile)
+            with self.phase(profile, 'partition'):
+                partitioning = Partitioning(ModelIndex(model), max_size, strategy)
+            stem, ext = os.path.splitext(output)
+            outputs = ['{}.part{}{}'.format(stem, i + 1, ext) for i in range(len(partitioning.chunks))]
+            names = [os.path.basename(o) for o in outputs]
+            for i, chunk_output in enumerate(outputs):
+                with self.phase(profile, 'slice'):
+                    chunk_model, ghosts = partitioning.slice(i)
+                links = {g: names[partitioning.chunk_of[c]] for c, g in ghosts.items() if c in partitioning.chunk_of}
+                with self.open_output(chunk_output, pretty_print, compresslevel) as (writer, layout):
+                    self.emit_model(chunk_model, writer, layout, profile, links)
+            overview, nodes = partitioning.get_overview([os.path.splitext(n)[0] for n in names])
+            with self.open_output(output, pretty_print, compresslevel) as (writer, layout):
+                self.emit_model(overview, writer, layout, profile, dict(zip(nodes, names)), overview=True)
+            if profile is not None:
+                profile.count('chunks', len(outputs))
+                profile.count('cross_edges', sum(1 for _ in partitioning.iter_cross_edges()))
+        if profile is not None:
+            self.on_profile(profile)
+        return outputs
+
+    @contextmanager
+    def open_output(self, output, pretty_print=True, compresslevel=None):
+        """
+        Open a writer to the output file. The output is replaced only if the block succeeds.
+        :param output: The output graphml file. Outputs with the graphmlz extension are gzip-compressed.
+        :param pretty_print: Indent the output
+        :param compresslevel: Compress the output with the given gzip level (1-9). Defaults to default_compresslevel
+            for graphmlz outputs and no compression otherwise.
+        :return: A (GraphMLWriter, Layout) tuple. The layout of the existing output is only loaded when updating.
+        :raise ValueError: If a compression level is given for an output without the graphmlz extension
+        """
+        import gzip
+        if not output.endswith('.graphmlz'):
+            if compresslevel is not None:
+                # Readers of the output (e.g. Layout.load) tell compressed graphs by their extension
+                raise ValueError('Compressed outputs must have the graphmlz extension: {}'.format(output))
+        elif compresslevel is None:
+            compresslevel = default_compresslevel
+        layout = None
+        if self.update and os.path.exists(output):
+            layout = Layout.load(output)
+        # Concurrent conversions to the same output (e.g. in the server) each write their own temporary file
+        fd, tmp = create_temp_file(output)
+        try:
+            with open(fd, 'wb') as fout:
+                if compresslevel is not None:
+                    # The gzip header records the name of the uncompressed graph, not the one of the temporary file
+                    name = os.path.basename(output)
+                    if name.endswith('.graphmlz'):
+                        name = name[:-1]
+                    fout = gzip.GzipFile(name, 'wb', compresslevel, fout, mtime=0)
+                with fout, GraphMLWriter(fout, pretty_print) as writer:
+                    yield writer, layout
+            os.replace(tmp, output)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def get_options(self, **output_options):
+        """
+        Get the options that affect the output, as recorded in a Manifest
+        :param output_options: The options of the output file (e.g. pretty_print)
+        :return: A JSON serializable dict
+        """
+        options = {'create_external': self.create_external, 'hide_mult': self.hide_mult, 'groups': self.groups,
+                   'stable_ids': self.stable_ids, 'auto_layout': self.auto_layout,
+                   'schema_location': dict(self.schema_location)}
+        options.update(output_options)
+        return options
+
+    def convert_incremental(self, input, output, manifest, pretty_print=True, compresslevel=None):
+        """
+        Convert the metamodel to the output file, unless the manifest shows the output is up to date
+        :param manifest: The Manifest. It is updated if the metamodel is converted.
+        :return: True if the output was generated, False if it was up to date
+        """
+        options = self.get_options(pretty_print=pretty_print, compresslevel=compresslevel)
+        if manifest.is_up_to_date(input, output, options):
+            return False
+        dependencies = self.convert_to_file(input, output, pretty_print, compresslevel)
+        manifest.record(input, output, options, dependencies)
+        return True
+
+
+def create_graph_from_file(fin, create_external, hide_mult, schema_location, resource_set=None, base_path='',
+                           writer=None):
+    converter = Converter(create_external, hide_mult, schema_location, resource_set)
+    return converter.convert(fin, base_path, writer)
+
+
+def warm_catalog_index(index, schema_location, base):
+    """
+    Make sure all the metamodels in the catalog are indexed and save the index
+    :param index: The CatalogIndex
+    :param schema_location: The catalog, mapping URIs to file locations
+    :param base: The folder that relative locations are resolved against
+    :return: A list of (uri, path, loaded) tuples
+    """
+    report = []
+    for uri, location in schema_location.items():
+        path = os.path.abspath(os.path.join(base, location))
+        report.append((uri, path, index.get_resource(path) is not None))
+    index.save()
+    return report
+
+
+def load_schema_location(catalog):
+    """
+    Load the "Schema Location" section of a catalog file
+    :param catalog: The catalog file, can be None
+    :return: The section (mapping URIs to file locations), or an empty dict
+    """
+    if catalog is None:
+        return {}
+    import configparser
+    config = configparser.ConfigParser(delimiters='=')
+    config.read(catalog)
+    if 'Schema Location' in config:
+        return config['Schema Location']
+    return {}
+
+
+def load_views(args):
+    """
+    Get the views requested in the command line
+    :param args: The parsed arguments
+    :return: A list of (output, View) tuples, empty if the whole metamodel is shown
+    """
+    import configparser
+    if args.views is not None:
+        config = configparser.ConfigParser()
+        if not config.read(args.views):
+            raise OSError('Could not read the views file {}'.format(args.views))
+        stem, ext = os.path.splitext(args.output)
+        return [('{}.{}{}'.format(stem, name, ext), View.from_section(config[name])) for name in config.sections()]
+    if args.roots or args.include or args.exclude or args.edges != 'all':
+        return [(args.output, View(args.roots, args.radius, args.include, args.exclude, args.edges))]
+    return []
+
+
+def default_output(input, compress=False):
+    """
+    The default output location: same location and name as the input, with the graphml (or graphmlz if compressed)
+    extension
+    """
+    name = os.path.splitext(input)[0]
+    return name + ('.graphmlz' if compress else '.graphml')
+
+
+def collect_inputs(patterns):
+    """
+    Expand the batch inputs. Directories are searched recursively for *.ecore files, other arguments are expanded as
+    (recursive) glob patterns.
+    :param patterns: The directories, files or glob patterns
+    :return: A dict of the distinct input files, in sorted order, to the folder they were found in: the searched
+        directory, the fixed part of the glob pattern or the folder of the file. Outputs written to another folder
+        keep the location of their input relative to it.
+    """
+    import glob
+    inputs = dict()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for input in glob.glob(os.path.join(pattern, '**', '*.ecore'), recursive=True):
+                inputs.setdefault(input, pattern)
+        elif glob.has_magic(pattern):
+            root = pattern
+            while glob.has_magic(root):
+                root = os.path.dirname(root)
+            for input in glob.glob(pattern, recursive=True):
+                inputs.setdefault(input, root)
+        else:
+            inputs.setdefault(pattern, os.path.dirname(pattern))
+    return {input: inputs[input] for input in sorted(inputs)}
+
+
+def get_batch_outputs(inputs, folder=None, compress=False):
+    """
+    The output locations of the batch inputs
+    :param inputs: The inputs, as returned by collect_inputs
+    :param folder: The output folder. If None, each output is written in the same location as its input.
+    :param compress: If the outputs are compressed (graphmlz)
+    :return: A dict of the inputs to their outputs
+    :raise ValueError: If two inputs would be converted to the same output
+    """
+    outputs = dict()
+    targets = dict()
+    for input, root in inputs.items():
+        output = default_output(input, compress)
+        if folder is not None:
+            output = os.path.join(folder, os.path.relpath(output, root or os.curdir))
+        other = targets.setdefault(os.path.abspath(output), input)
+        if other != input:
+            raise ValueError('{} and {} would both be converted to {}'.format(other, input, output))
+        outputs[input] = output
+    return outputs
+
+
+# The converter of a batch worker process, shared by all the files the worker converts
+_worker_converter = None
+_worker_output_options = {}
+
+
+def _init_batch_worker(create_external, hide_mult, catalog, index, output_options, low_memory=False, groups=False,
+                       stable_ids=False, update=False, auto_layout=False, prefetch=0):
+    global _worker_converter, _worker_output_options
+    if index is not None:
+        index = CatalogIndex(index)
+    _worker_converter = Converter(create_external, hide_mult, load_schema_location(catalog), ResourceSet(index),
+                                  low_memory=low_memory, groups=groups, stable_ids=stable_ids, update=update,
+                                  auto_layout=auto_layout, prefetch=prefetch)
+    _worker_output_options = output_options
+
+
+def _convert_batch_file(input, output):
+    """
+    Convert one file of a batch in a worker process
+    :return: A tuple with the input, the output, the error message (None on success), the elapsed time and the
+        external metamodels the conversion loaded
+    """
+    start = time.perf_counter()
+    error = None
+    dependencies = None
+    try:
+        dependencies = _worker_converter.convert_to_file(input, output, **_worker_output_options)
+        index = _worker_converter.resource_set.index
+        if index is not None:
+            index.save()
+    except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+    return input, output, error, time.perf_counter() - start, dependencies
+
+
+def batch_main(argv=None):
+    """
+    Convert many metamodels, distributing the files among a pool of worker processes
+    :param argv: The command line arguments, sys.argv is used if None
+    :return: The exit code, 1 if any file failed
+    """
+    import argparse
+    from concurrent.futures import ProcessPoolExecutor
+    parser = argparse.ArgumentParser(description='Transform many Ecore metamodels to yed (graphml) in parallel.')
+    parser.add_argument('inputs', type=str, nargs='+',
+                        help='the input ecore files, directories (searched recursively) or glob patterns')
+    parser.add_argument('-e',
+                        action='store_true',
+                        dest='create_external',
+                        help='create nodes for external references.')
+    parser.add_argument('-a',
+                        action='store_true',
+                        dest='hide_mult',
+                        help='Hide multiplicities on attributes.')
+    parser.add_argument('-o', type=str, dest='output',
+                        help='the output folder. If missing, each output is written in the same location as its '
+                             'input')
+    parser.add_argument('--catalog', type=str, dest='catalog',
+                        help='Specifies catalog files to resolve external metamodel references (see ecore2yed.py -h)')
+    parser.add_argument('--index', type=str, dest='index',
+                        help='Keeps a persistent index of the external metamodels in the given file.')
+    parser.add_argument('--compact',
+                        action='store_true', dest='compact',
+                        help='Write compact (not indented) output.')
+    parser.add_argument('--compress', type=int, nargs='?', dest='compress', const=default_compresslevel,
+                        choices=range(1, 10), metavar='LEVEL',
+                        help='Compress the output with gzip (graphmlz), optionally with the given level (1-9). '
+                             'Outputs with the graphmlz extension are always compressed.')
+    parser.add_argument('--incremental', type=str, dest='manifest',
+                        help='Keeps a manifest of the generated outputs in the given file and skips the conversion '
+                             'if the output is up to date, i.e. neither the input, the external metamodels it '
+                             'references nor the options changed.')
+    parser.add_argument('--stable-ids',
+                        action='store_true', dest='stable_ids',
+                        help='Derive the node and edge ids from the Ecore fragments instead of numbering them, so '
+                             'the ids do not change between conversions.')
+    parser.add_argument('--update',
+                        action='store_true', dest='update',
+                        help='Keep the layout (node geometry and edge bends) of the existing output file. Implies '
+                             '--stable-ids; the existing file must have been generated with stable ids.')
+    parser.add_argument('--auto-layout',
+                        action='store_true', dest='auto_layout',
+                        help='Size and place the nodes in layers by inheritance depth, so the diagram does not need '
+                             'to be laid out in yEd. With --update, only new nodes are placed.')
+    parser.add_argument('--groups',
+                        action='store_true', dest='groups',
+                        help='Show each package (and subpackage) as a group node that contains its classes.')
+    parser.add_argument('--low-memory',
+                        action='store_true', dest='low_memory',
+                        help='Parse the input incrementally, dropping annotations and operations as they are read. '
+                             'Reduces the memory needed for very large metamodels.')
+    parser.add_argument('--prefetch', type=int, dest='prefetch', default=default_prefetch, metavar='THREADS',
+                        help='Load the external metamodels referenced by the inputs with this many threads before '
+                             'linking (default %(default)s). 0 loads them when first used.')
+    parser.add_argument('--watch',
+                        action='store_true', dest='watch',
+                        help='Keep running and convert the inputs again whenever they, or the external metamodels they '
+                             'reference, change.')
+    parser.add_argument('--poll', type=float, nargs='?', dest='poll', const=0.5, metavar='INTERVAL',
+                        help='With --watch, poll the files every INTERVAL seconds (default 0.5) instead of using '
+                             'inotify.')
+    parser.add_argument('-j', '--workers', type=int, dest='workers', default=None,
+                        help='the number of worker processes. Defaults to the number of CPUs.')
+    args = parser.parse_args(argv)
+
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        print("No input metamodels found.")
+        return 1
+    try:
+        outputs = get_batch_outputs(inputs, args.output, args.compress is not None)
+    except ValueError as e:
+        parser.error(str(e))
+    for output in outputs.values():
+        os.makedirs(os.path.dirname(output) or os.curdir, exist_ok=True)
+    output_options = {'pretty_print': not args.compact, 'compresslevel': args.compress}
+    manifest = None
+    if args.manifest is not None:
+        # The manifest is only used by this process, workers report the dependencies of their outputs
+        manifest = Manifest(args.manifest)
+        options = Converter(args.create_external, args.hide_mult, load_schema_location(args.catalog),
+                            groups=args.groups, stable_ids=args.stable_ids or args.update,
+                            auto_layout=args.auto_layout).get_options(**output_options)
+    start = time.perf_counter()
+    failed = 0
+    skipped = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_batch_worker,
+                             initargs=(args.create_external, args.hide_mult, args.catalog, args.index,
+                                       output_options, args.low_memory, args.groups, args.stable_ids,
+                                       args.update, args.auto_layout, args.prefetch)
+                             ) as executor:
+        futures = []
+        dependencies = dict()   # The external metamodels of the up to date outputs
+        for input, output in outputs.items():
+            if manifest is not None and manifest.is_up_to_date(input, output, options):
+                skipped += 1
+                dependencies[input] = manifest.get_dependencies(output)
+                print("SKIP {:9} {} is up to date".format('', output))
+                continue
+            futures.append(executor.submit(_convert_batch_file, input, output))
+        for future in futures:
+            input, output, error, elapsed, input_dependencies = future.result()
+            report_conversion(input, output, error, elapsed)
+            if error is None:
+                dependencies[input] = input_dependencies
+                if manifest is not None:
+                    manifest.record(input, output, options, input_dependencies)
+            else:
+                failed += 1
+    if manifest is not None:
+        manifest.save()
+    print("Converted {} of {} metamodels ({} up to date) in {:.3f}s.".format(
+        len(inputs) - failed - skipped, len(inputs), skipped, time.perf_counter() - start))
+    if args.watch:
+        index = None
+        if args.index is not None:
+            index = CatalogIndex(args.index)
+        converter = Converter(args.create_external, args.hide_mult, load_schema_location(args.catalog),
+                              ResourceSet(index, validate=True), low_memory=args.low_memory, groups=args.groups,
+                              stable_ids=args.stable_ids, update=args.update, auto_layout=args.auto_layout,
+                              prefetch=args.prefetch)
+
+        def convert(input, output):
+            input_dependencies = converter.convert_to_file(input, output, **output_options)
+            if manifest is not None:
+                manifest.record(input, output, options, input_dependencies)
+                manifest.save()
+            if index is not None:
+                index.save()
+            return input_dependencies
+
+        watch(Watcher(convert, outputs, create_monitor(args.poll), report=report_conversion), dependencies)
+        return 0
+    return 1 if failed else 0
+
+
+def report_conversion(input, output, error, elapsed):
+    if error is None:
+        print("OK   {:8.3f}s {} -> {}".format(elapsed, input, output))
+    else:
+        print("FAIL {:8.3f}s {}: {}".format(elapsed, input, error))
+    sys.stdout.flush()
+
+
+def watch(watcher, dependencies=None):
+    """
+    Run the watcher until interrupted
+    :param watcher: The Watcher
+    :param dependencies: The known dependencies of the inputs (see Watcher.run)
+    """
+    print("Watching {} metamodels, press Ctrl+C to stop.".format(len(watcher.outputs)))
+    sys.stdout.flush()
+    try:
+        watcher.run(dependencies)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.monitor.close()
+
+
+class PollingMonitor:
+    """
+    Detects changes of files by polling their modification time and size. Works everywhere.
+    """
+
+    def __init__(self, interval=0.5):
+        """
+        :param interval: The time between polls, in seconds
+        """
+        self.interval = interval
+        self.stamps = dict()
+
+    def watch(self, paths):
+        """
+        Set the files to monitor. Files that do not exist are reported when they are created.
+        :param paths: The absolute locations of the files
+        """
+        self.stamps = {p: self.stamps[p] if p in self.stamps else ResourceSet.get_stamp(p) for p in paths}
+
+    def wait(self, timeout=None):
+        """
+        Wait for changes of the monitored files
+        :param timeout: The maximum time to wait, in seconds. Waits until a change if None.
+        :return: The set of changed files, empty on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = set()
+            for path, old in self.stamps.items():
+                new = ResourceSet.get_stamp(path)
+                if new != old:
+                    self.stamps[path] = new
+                    changed.add(path)
+            if changed:
+                return changed
+            if deadline is None:
+                time.sleep(self.interval)
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return changed
+                time.sleep(min(self.interval, remaining))
+
+    def close(self):
+        pass
+
+
+class InotifyMonitor:
+    """
+    Detects changes of files with Linux inotify. The folders of the files are watched, so files that are replaced
+    (as many editors save) or created are detected too.
+    """
+
+    events = 0x8 | 0x80 | 0x100 | 0x200     # IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    queue_overflow = 0x4000                 # IN_Q_OVERFLOW
+    event_header = struct.Struct('iIII')    # wd, mask, cookie, len
+
+    def __init__(self):
+        """
+        :raise OSError: If inotify is not available
+        """
+        import ctypes
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on Linux')
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.paths = set()
+        self.folders = dict()   # Watch descriptors to folders
+
+    def watch(self, paths):
+        import ctypes
+        self.paths = set(paths)
+        watched = set(self.folders.values())
+        for folder in {os.path.dirname(p) for p in self.paths} - watched:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), self.events)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), 'Could not watch {}'.format(folder))
+            self.folders[wd] = folder
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not select.select([self.fd], [], [], remaining)[0]:
+                return set()
+            changed = set()
+            for folder, name, mask in self.read_events():
+                if mask & self.queue_overflow:
+                    changed.update(self.paths)   # Events were lost
+                path = os.path.join(folder, name)
+                if path in self.paths:
+                    changed.add(path)
+            if changed:
+                return changed
+
+    def read_events(self):
+        """
+        :return: A list of (folder, name, mask) tuples for the pending events
+        """
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.event_header.unpack_from(data, offset)
+            offset += self.event_header.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((self.folders.get(wd, ''), name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def create_monitor(poll=None):
+    """
+    Create the best file monitor of the platform
+    :param poll: Poll with this interval (in seconds) instead of using inotify
+    :return: An InotifyMonitor or a PollingMonitor
+    """
+    if poll is None:
+        try:
+            return InotifyMonitor()
+        except (OSError, AttributeError):   # Not Linux, or a libc without inotify
+            pass
+    return PollingMonitor(poll or 0.5)
+
+
+class Watcher:
+    """
+    Converts metamodels again whenever they, or the external metamodels they reference, change
+    """
+
+    def __init__(self, convert, outputs, monitor=None, debounce=0.3, report=None):
+        """
+        Create a new watcher
+        :param convert: Called with an input and its output to convert it. Returns the external metamodels the
+            conversion loaded. Use a converter with a validating ResourceSet, so the unchanged external metamodels
+            are not loaded again.
+        :param outputs: A dict of inputs to their outputs
+        :param monitor: The file monitor, see create_monitor()
+        :param debounce: Changes are only acted upon once no other change happened for this time (in seconds), so
+            bursts of writes trigger a single conversion
+        :param report: Called with the input, the output, the error message (None on success) and the elapsed time
+            of each conversion
+        """
+        self.convert = convert
+        self.outputs = outputs
+        self.monitor = monitor if monitor is not None else create_monitor()
+        self.debounce = debounce
+        self.report = report
+        self.dependencies = {os.path.abspath(input): set() for input in outputs}   # Inputs to their dependencies
+        self.inputs = {os.path.abspath(input): input for input in outputs}
+
+    def convert_input(self, path):
+        input = self.inputs[path]
+        output = self.outputs[input]
+        start = time.perf_counter()
+        error = None
+        try:
+            self.dependencies[path] = set(self.convert(input, output))
+        except Exception as e:  # e.g. an input saved halfway, keep watching
+            error = '{}: {}'.format(type(e).__name__, e)
+        if self.report is not None:
+            self.report(input, output, error, time.perf_counter() - start)
+
+    def get_affected(self, changed):
+        """
+        :param changed: The absolute locations of the changed files
+        :return: The inputs (absolute locations) that depend on the changed files
+        """
+        return [path for path, dependencies in self.dependencies.items()
+                if path in changed or not dependencies.isdisjoint(changed)]
+
+    def run(self, dependencies=None, rounds=None):
+        """
+        Watch the inputs until interrupted
+        :param dependencies: A dict of inputs to the external metamodels of their existing outputs. The inputs that
+            are not in the dict are converted before watching. If None, all inputs are converted.
+        :param rounds: Stop after this many rounds of conversions (for tests)
+        """
+        known = {os.path.abspath(input): set(d) for input, d in (dependencies or {}).items()}
+        for path in list(self.inputs):
+            if path in known:
+                self.dependencies[path] = known[path]
+            else:
+                self.convert_input(path)
+        while rounds is None or rounds > 0:
+            self.monitor.watch(set(self.inputs).union(*self.dependencies.values()))
+            changed = self.monitor.wait()
+            while True:
+                more = self.monitor.wait(self.debounce)
+                if not more:
+                    break
+                changed |= more
+            for path in self.get_affected(changed):
+                self.convert_input(path)
+            if rounds is not None:
+                rounds -= 1
+
+
+class ConversionService:
+    """
+    Converts metamodels on request. The catalog and the external metamodels are loaded once and shared by all the
+    requests, so a request only pays for its own metamodel.
+    """
+
+    def __init__(self, resource_set, pretty_print=True, history=1000, **options):
+        """
+        Create a new service
+        :param resource_set: The ResourceSet shared by the requests. It should validate its resources.
+        :param pretty_print: Indent the graphs
+        :param history: The number of latest requests the latency metrics are computed from
+        :param options: The Converter options
+        """
+        self.resource_set = resource_set
+        self.pretty_print = pretty_print
+        self.options = options
+        self.latencies = deque(maxlen=history)
+        self.phases = defaultdict(float)
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def convert(self, data=None, path=None):
+        """
+        Convert a metamodel
+        :param data: The content of the metamodel. If None, the metamodel is read from path.
+        :param path: The location of the metamodel. Relative external references are resolved against its folder,
+            also when its content is given.
+        :return: A (graphml bytes, Profile) tuple
+        """
+        profiles = []
+        converter = Converter(resource_set=self.resource_set, on_profile=profiles.append, **self.options)
+        base_path = '' if path is None else os.path.dirname(path)
+        fin = path if data is None else io.BytesIO(data)
+        fout = io.BytesIO()
+        start = time.perf_counter()
+        try:
+            with GraphMLWriter(fout, self.pretty_print) as writer:
+                converter.convert(fin, base_path, writer)
+        except Exception:
+            with self.lock:
+                self.requests += 1
+                self.errors += 1
+            raise
+        elapsed = time.perf_counter() - start
+        profile = profiles[0]
+        with self.lock:
+            self.requests += 1
+            self.latencies.append(elapsed)
+            for name, t in profile.times.items():
+                self.phases[name] += t
+        return fout.getvalue(), profile
+
+    def get_metrics(self):
+        """
+        :return: The request counts, the latency statistics (in seconds) of the latest requests, the total time of
+            each conversion phase and the state of the resource cache
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            metrics = {'requests': self.requests, 'errors': self.errors, 'phases': dict(self.phases)}
+        if latencies:
+            metrics['latency'] = {
+                'count': len(latencies),
+                'mean': sum(latencies) / len(latencies),
+                'p50': latencies[len(latencies) // 2],
+                'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                'max': latencies[-1],
+            }
+        rs = self.resource_set
+        with rs.lock:
+            metrics['cache'] = {'size': len(rs.resources), 'max_size': rs.max_size, 'hits': rs.hits,
+                                'misses': rs.misses, 'evictions': rs.evictions}
+        return metrics
+
+
+server_class_names = ('ConversionRequestHandler', 'ConversionHTTPServer', 'ConversionUnixServer')
+
+
+def load_server_classes():
+    """
+    Define the classes of the conversion server. http.server is slow to import, so they are only defined when a server
+    is started or when one of them is first accessed as an attribute of the module.
+    """
+    global ConversionRequestHandler, ConversionHTTPServer, ConversionUnixServer
+    if 'ConversionHTTPServer' in globals():
+        return
+    import json
+    import socketserver
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlsplit
+
+    class ConversionRequestHandler(BaseHTTPRequestHandler):
+        """
+        The HTTP interface of a ConversionService:
+
+        POST /convert?path=PATH converts the metamodel sent in the body, or the file at PATH if the body is empty, and
+            responds with the GraphML. The Server-Timing header holds the time of each conversion phase.
+        GET /metrics responds with the metrics of the service, as JSON.
+        """
+
+        server_version = 'ecore2yed'
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            url = urlsplit(self.path)
+            if url.path != '/convert':
+                self.send_text(404, 'Unknown endpoint {}'.format(url.path))
+                return
+            path = parse_qs(url.query).get('path', [None])[0]
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                if length < 0:
+                    raise ValueError
+            except ValueError:
+                self.close_connection = True    # The body cannot be skipped
+                self.send_text(400, 'Invalid Content-Length {}'.format(self.headers['Content-Length']))
+                return
+            data = self.rfile.read(length) if length else None
+            if data is None and path is None:
+                self.send_text(400, 'Send the metamodel in the body or its location in the path parameter')
+                return
+            try:
+                graph, profile = self.server.service.convert(data, path)
+            except (OSError, etree.XMLSyntaxError, EcoreReferenceError) as e:
+                self.send_text(400, '{}: {}'.format(type(e).__name__, e))
+                return
+            except Exception as e:
+                self.send_text(500, '{}: {}'.format(type(e).__name__, e))
+                return
+            timing = ', '.join('{};dur={:.3f}'.format(name, t * 1000) for name, t in profile.times.items())
+            self.send_body(200, graph, 'application/xml', {'Server-Timing': timing})
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path != '/metrics':
+                self.send_text(404, 'Unknown endpoint {}'.format(url.path))
+                return
+            self.send_body(200, json.dumps(self.server.service.get_metrics()).encode(), 'application/json')
+
+        def send_text(self, code, message):
+            self.send_body(code, message.encode(), 'text/plain; charset=utf-8')
+
+        def send_body(self, code, body, content_type, headers=None):
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.getLogger(__name__).info(format, *args)
+
+    class ConversionHTTPServer(ThreadingHTTPServer):
+        """
+        Serves a ConversionService over HTTP
+        """
+
+        daemon_threads = True
+
+        def __init__(self, address, service):
+            super().__init__(address, ConversionRequestHandler)
+            self.service = service
+
+    if hasattr(socketserver, 'UnixStreamServer'):
+        class ConversionUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            """
+            Serves a ConversionService over HTTP on a Unix socket
+            """
+
+            daemon_threads = True
+
+            def __init__(self, path, service):
+                super().__init__(path, ConversionRequestHandler)
+                self.service = service
+
+
+def __getattr__(name):
+    if name in server_class_names:
+        load_server_classes()
+        if name in globals():
+            return globals()[name]
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def serve_main(argv=None):
+    """
+    Run the conversion server until interrupted
+    :param argv: The command line arguments, sys.argv is used if None
+    :return: The exit code
+    """
+    import argparse
+    import signal
+    import stat
+    parser = argparse.ArgumentParser(description='Serve conversions of Ecore metamodels to yed (graphml), keeping '
+                                                 'the external metamodels loaded between requests.')
+    parser.add_argument('--host', type=str, dest='host', default='127.0.0.1',
+                        help='the address to listen on (default 127.0.0.1)')
+    parser.add_argument('--port', type=int, dest='port', default=8765, help='the port to listen on (default 8765)')
+    parser.add_argument('--socket', type=str, dest='socket',
+                        help='listen on this Unix socket instead of a TCP port')
+    parser.add_argument('--cache-size', type=int, dest='cache_size', default=64,
+                        help='the maximum number of external metamodels to keep loaded (default 64)')
+    parser.add_argument('-e',
+                        action='store_true',
+                        dest='create_external',
+                        help='create nodes for external references.')
+    parser.add_argument('-a',
+                        action='store_true',
+                        dest='hide_mult',
+                        help='Hide multiplicities on attributes.')
+    parser.add_argument('--catalog', type=str, dest='catalog',
+                        help='Specifies catalog files to resolve external metamodel references (see ecore2yed.py -h)')
+    parser.add_argument('--index', type=str, dest='index',
+                        help='Keeps a persistent index of the external metamodels in the given file.')
+    parser.add_argument('--compact',
+                        action='store_true', dest='compact',
+                        help='Write compact (not indented) output.')
+    parser.add_argument('--stable-ids',
+                        action='store_true', dest='stable_ids',
+                        help='Derive the node and edge ids from the Ecore fragments instead of numbering them.')
+    parser.add_argument('--auto-layout',
+                        action='store_true', dest='auto_layout',
+                        help='Size and place the nodes in layers by inheritance depth.')
+    parser.add_argument('--groups',
+                        action='store_true', dest='groups',
+                        help='Show each package (and subpackage) as a group node that contains its classes.')
+    parser.add_argument('--low-memory',
+                        action='store_true', dest='low_memory',
+                        help='Parse the inputs incrementally, dropping annotations and operations as they are read.')
+    parser.add_argument('--prefetch', type=int, dest='prefetch', default=default_prefetch, metavar='THREADS',
+                        help='Load the external metamodels referenced by the inputs with this many threads before '
+                             'linking (default %(default)s). 0 loads them when first used.')
+    args = parser.parse_args(argv)
+
+    index = None
+    if args.index is not None:
+        index = CatalogIndex(args.index)
+    resource_set = ResourceSet(index, max_size=args.cache_size, validate=True)
+    service = ConversionService(resource_set, not args.compact, create_external=args.create_external,
+                                hide_mult=args.hide_mult, schema_location=load_schema_location(args.catalog),
+                                low_memory=args.low_memory, groups=args.groups, stable_ids=args.stable_ids,
+                                auto_layout=args.auto_layout, prefetch=args.prefetch)
+    load_server_classes()
+    if args.socket is not None:
+        if os.path.exists(args.socket) and stat.S_ISSOCK(os.stat(args.socket).st_mode):
+            os.remove(args.socket)     # Left by a previous server
+        server = ConversionUnixServer(args.socket, service)
+        print("Serving on {}".format(args.socket))
+    else:
+        server = ConversionHTTPServer((args.host, args.port), service)
+        print("Serving on http://{}:{}".format(*server.server_address[:2]))
+    sys.stdout.flush()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))   # Clean up when stopped by a service manager
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
+        if index is not None:
+            index.save()
+    return 0
 
 
 def main():
-    global head, tail
+    import argparse
     parser = argparse.ArgumentParser(description=descmsg)
-    parser.add_argument('input', type=str, help='the input ecore file (*.ecore)')
+    parser.add_argument('input', type=str, nargs='?', help='the input ecore file (*.ecore)')
     parser.add_argument('-e',
                         action='store_true',
                         dest='create_external',
@@ -559,39 +3494,191 @@ def main():
                         dest='hide_mult',
                         help='Hide multiplicities on attributes.')
     parser.add_argument('-o', type=str, dest='output',
-                        help='the output yed file (*.graphml). If missing, same location as input')
+                        help='the output yed file (*.graphml or *.graphmlz). If missing, same location as input')
     parser.add_argument('--catalog', type=str, dest='catalog',
                         help='Specifies catalog files to resolve external metamodel references. Supports the '
                              'configuration file format and expects a "Schema Location" section where keys are URIs and'
                              'values are file locations (locations can be absolute or relative to the input metamodel'
                              'path).')
+    parser.add_argument('--index', type=str, dest='index',
+                        help='Keeps a persistent index of the external metamodels in the given file, so they are '
+                             'not parsed again while they do not change.')
+    parser.add_argument('--compact',
+                        action='store_true', dest='compact',
+                        help='Write compact (not indented) output.')
+    parser.add_argument('--compress', type=int, nargs='?', dest='compress', const=default_compresslevel,
+                        choices=range(1, 10), metavar='LEVEL',
+                        help='Compress the output with gzip (graphmlz), optionally with the given level (1-9). '
+                             'Outputs with the graphmlz extension are always compressed; -o must have this '
+                             'extension.')
+    parser.add_argument('--incremental', type=str, dest='manifest',
+                        help='Keeps a manifest of the generated outputs in the given file and skips the conversion '
+                             'if the output is up to date, i.e. neither the input, the external metamodels it '
+                             'references nor the options changed.')
+    parser.add_argument('--stable-ids',
+                        action='store_true', dest='stable_ids',
+                        help='Derive the node and edge ids from the Ecore fragments instead of numbering them, so '
+                             'the ids do not change between conversions.')
+    parser.add_argument('--update',
+                        action='store_true', dest='update',
+                        help='Keep the layout (node geometry and edge bends) of the existing output file. Implies '
+                             '--stable-ids; the existing file must have been generated with stable ids.')
+    parser.add_argument('--auto-layout',
+                        action='store_true', dest='auto_layout',
+                        help='Size and place the nodes in layers by inheritance depth, so the diagram does not need '
+                             'to be laid out in yEd. With --update, only new nodes are placed.')
+    parser.add_argument('--groups',
+                        action='store_true', dest='groups',
+                        help='Show each package (and subpackage) as a group node that contains its classes.')
+    parser.add_argument('--low-memory',
+                        action='store_true', dest='low_memory',
+                        help='Parse the input incrementally, dropping annotations and operations as they are read. '
+                             'Reduces the memory needed for very large metamodels.')
+    parser.add_argument('--prefetch', type=int, dest='prefetch', default=default_prefetch, metavar='THREADS',
+                        help='Load the external metamodels referenced by the input with this many threads before '
+                             'linking (default %(default)s). 0 loads them when first used.')
+    parser.add_argument('--root', type=str, action='append', dest='roots', default=[],
+                        help='Show only the classes within --radius hops of the classes that match this pattern '
+                             '(class name or path, e.g. "Task*" or "sub/*"). Can be repeated.')
+    parser.add_argument('--radius', type=int, dest='radius', default=1,
+                        help='The number of hops from the --root classes (default 1).')
+    parser.add_argument('--include', type=str, action='append', dest='include', default=[],
+                        help='Show only the classes that match this pattern. Can be repeated.')
+    parser.add_argument('--exclude', type=str, action='append', dest='exclude', default=[],
+                        help='Hide the classes that match this pattern. Can be repeated.')
+    parser.add_argument('--edges', type=str, dest='edges', default='all', choices=View.edge_kinds,
+                        help='Show (and follow from the roots) only these edges.')
+    parser.add_argument('--views', type=str, dest='views',
+                        help='Write one graph per section of this configuration file, each a view with the '
+                             '(optional) keys roots, radius, include, exclude and edges. The graph of section NAME '
+                             'is written to OUTPUT.NAME.graphml.')
+    parser.add_argument('--split', type=int, dest='split', metavar='MAX_CLASSES',
+                        help='Split the graph into chunks of at most MAX_CLASSES classes, written to '
+                             'OUTPUT.partN.graphml. The classes of other chunks are shown as external nodes and the '
+                             'output holds an overview of the chunks.')
+    parser.add_argument('--split-by', type=str, dest='split_by', default='package', choices=Partitioning.strategies,
+                        help='Keep the packages together (package, default) or minimize the edges between chunks '
+                             '(graph).')
+    parser.add_argument('--watch',
+                        action='store_true', dest='watch',
+                        help='Keep running and convert the input again whenever it, or an external metamodel it '
+                             'references, changes.')
+    parser.add_argument('--poll', type=float, nargs='?', dest='poll', const=0.5, metavar='INTERVAL',
+                        help='With --watch, poll the files every INTERVAL seconds (default 0.5) instead of using '
+                             'inotify.')
+    parser.add_argument('--warm-index',
+                        action='store_true', dest='warm_index',
+                        help='Index all the metamodels in the catalog and exit. Requires --catalog and --index. '
+                             'Relative locations are resolved against the input metamodel path if given, or the '
+                             'catalog path otherwise.')
+    parser.add_argument('--profile', type=str, nargs='?', dest='profile', const='text', choices=['text', 'json'],
+                        help='Print the time of each conversion phase and the conversion counters, as a text summary '
+                             '(default) or as JSON.')
     parser.add_argument('-v', '--verbose',
                         action='store_true', dest='verbose',
                         help='enables output messages (infos, warnings)')
 
     args = parser.parse_args()
-    head, tail = os.path.split(args.input)
-    config = configparser.ConfigParser(delimiters='=')
-
-    if args.catalog is not None:
-        config.read(args.catalog)
-        print(config)
-        print(config.sections())
-    with open(args.input, 'r',) as fin:
-        schema_location_ = {}
-        if 'Schema Location' in config:
-            schema_location_ = config['Schema Location']
-        g = create_graph_from_file(fin, args.create_external, args.hide_mult, schema_location_)
-
-    pretty = etree.tostring(g.root, pretty_print=True)
-    encoded = pretty.decode('utf-8')
+    if args.input is None and not args.warm_index:
+        parser.error('the following arguments are required: input')
+    if args.warm_index and (args.catalog is None or args.index is None):
+        parser.error('--warm-index requires --catalog and --index')
+    schema_location_ = load_schema_location(args.catalog)
+    index = None
+    if args.index is not None:
+        index = CatalogIndex(args.index)
+    if args.warm_index:
+        if args.input is not None:
+            base = os.path.dirname(args.input)
+        else:
+            base = os.path.dirname(args.catalog)
+        for uri, path, loaded in warm_catalog_index(index, schema_location_, base):
+            print("{} {} ({})".format('Indexed' if loaded else 'Could not load', uri, path))
+        return
     if args.output is None:
-        name = tail.split('.')[0]
-        args.output = os.path.join(head, name + '.graphml')
-    with open(args.output, 'w', encoding='utf-8') as fout:
-        fout.write(encoded)
+        args.output = default_output(args.input, args.compress is not None)
+    elif args.compress is not None and not args.output.endswith('.graphmlz'):
+        parser.error('--compress requires an output with the graphmlz extension')
+    profiles = []
+    converter = Converter(args.create_external, args.hide_mult, schema_location_,
+                          ResourceSet(index, validate=args.watch),
+                          on_profile=profiles.append if args.profile is not None else None,
+                          low_memory=args.low_memory, groups=args.groups, stable_ids=args.stable_ids,
+                          update=args.update, auto_layout=args.auto_layout, prefetch=args.prefetch)
+    views = load_views(args)
+    if args.manifest is not None and (views or args.split is not None):
+        # The manifest records a single output per input
+        parser.error('--incremental cannot be combined with views or --split')
+    if args.watch:
+        if args.split is not None:
+            parser.error('--watch cannot be combined with --split')
+        manifest = None
+        if args.manifest is not None:
+            manifest = Manifest(args.manifest)
+            options = converter.get_options(pretty_print=not args.compact, compresslevel=args.compress)
+
+        def convert(input, output):
+            if views:
+                dependencies = converter.convert_views(input, views, not args.compact, args.compress)
+            else:
+                dependencies = converter.convert_to_file(input, output, not args.compact, args.compress)
+            if manifest is not None:
+                manifest.record(input, output, options, dependencies)
+                manifest.save()
+            if index is not None:
+                index.save()
+            print_profiles(profiles, args.profile)
+            return dependencies
+
+        watch(Watcher(convert, {args.input: args.output}, create_monitor(args.poll), report=report_conversion))
+        return
+    if args.split is not None:
+        if views:
+            parser.error('--split cannot be combined with views')
+        converter.convert_partitions(args.input, args.output, args.split, args.split_by, not args.compact,
+                                     args.compress)
+    elif views:
+        converter.convert_views(args.input, views, not args.compact, args.compress)
+    elif args.manifest is None:
+        converter.convert_to_file(args.input, args.output, not args.compact, args.compress)
+    else:
+        manifest = Manifest(args.manifest)
+        if not converter.convert_incremental(args.input, args.output, manifest, not args.compact, args.compress):
+            print("{} is up to date.".format(args.output))
+        manifest.save()
+    print_profiles(profiles, args.profile)
+    if index is not None:
+        index.save()
     print("Transcription finished.")
 
 
-if __name__ == '__main__':
+def print_profiles(profiles, format):
+    """
+    Print and clear the collected profiles
+    :param profiles: The list of Profile
+    :param format: 'json' or 'text'
+    """
+    import json
+    for profile in profiles:
+        if format == 'json':
+            print(json.dumps(profile.to_dict(), indent=2))
+        else:
+            print(profile.report())
+    profiles.clear()
+
+
+def cli():
+    """
+    The entry point of the ecore2yed command: dispatches the batch and serve subcommands, or converts one metamodel
+    :return: The exit code
+    """
+    if sys.argv[1:2] == ['batch']:
+        return batch_main(sys.argv[2:])
+    if sys.argv[1:2] == ['serve']:
+        return serve_main(sys.argv[2:])
     main()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(cli())
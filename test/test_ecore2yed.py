@@ -1,6 +1,14 @@
+import io
 import logging
+import os
+import sys
+from collections import Counter
 
-from ecore2yed import create_graph_from_file
+import pytest
+
+from lxml import etree
+
+from ecore2yed import create_graph_from_file, EcoreResource, EcoreReferenceError, Graph, ModelBuilder
 
 # create logger
 logger = logging.getLogger()
@@ -15,8 +23,682 @@ ch.setFormatter(formatter)
 # add ch to logger
 logger.addHandler(ch)
 
+here = os.path.dirname(os.path.abspath(__file__))
+
+NESTED_ECORE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<ecore:EPackage xmi:version="2.0" xmlns:xmi="http://www.omg.org/XMI"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xmlns:ecore="http://www.eclipse.org/emf/2002/Ecore" name="root" nsURI="http://example.org/root" nsPrefix="root">
+  <eClassifiers xsi:type="ecore:EClass" name="A">
+    <eStructuralFeatures xsi:type="ecore:EReference" name="parent" eType="#//A"/>
+    <eStructuralFeatures xsi:type="ecore:EReference" name="c" eType="#//sub/subsub/C" containment="true"/>
+  </eClassifiers>
+  <eSubpackages name="sub" nsURI="http://example.org/root/sub" nsPrefix="sub">
+    <eClassifiers xsi:type="ecore:EClass" name="B" eSuperTypes="#//A">
+      <eStructuralFeatures xsi:type="ecore:EAttribute" name="name"
+          eType="ecore:EDataType http://www.eclipse.org/emf/2002/Ecore#//EString"/>
+    </eClassifiers>
+    <eSubpackages name="subsub" nsURI="http://example.org/root/sub/subsub" nsPrefix="subsub">
+      <eClassifiers xsi:type="ecore:EClass" name="C" xmi:id="_c" eSuperTypes="#//sub/B"/>
+    </eSubpackages>
+  </eSubpackages>
+</ecore:EPackage>
+"""
+
+SIBLINGS_ECORE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<ecore:EPackage xmi:version="2.0" xmlns:xmi="http://www.omg.org/XMI"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xmlns:ecore="http://www.eclipse.org/emf/2002/Ecore" name="root" nsURI="http://example.org/root" nsPrefix="root">
+  <eSubpackages name="p" nsURI="http://example.org/root/p" nsPrefix="p">
+    <eClassifiers xsi:type="ecore:EClass" name="P1"/>
+    <eClassifiers xsi:type="ecore:EClass" name="P2" eSuperTypes="#//q/Q1"/>
+  </eSubpackages>
+  <eSubpackages name="q" nsURI="http://example.org/root/q" nsPrefix="q">
+    <eClassifiers xsi:type="ecore:EClass" name="Q1"/>
+    <eClassifiers xsi:type="ecore:EClass" name="Q2" eSuperTypes="#//p/P1"/>
+  </eSubpackages>
+</ecore:EPackage>
+"""
+
+
+class CountingBuilder(ModelBuilder):
+    """
+    Builder that counts how many times each classifier and feature is visited
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.feature_visits = Counter()
+        self.classifier_visits = Counter()
+
+    def add_eFeatures(self, clazz, sf, *args):
+        self.feature_visits[sf] += 1
+        super().add_eFeatures(clazz, sf, *args)
+
+    def add_inheritance(self, c, *args):
+        self.classifier_visits[c] += 1
+        super().add_inheritance(c, *args)
+
+
+def serialize(g):
+    return etree.tostring(g.root, pretty_print=True)
+
+
+def canonical(data):
+    """
+    The canonical form of the children of a serialized graph, ignoring indentation and namespace declarations
+    """
+    root = etree.fromstring(data, etree.XMLParser(remove_blank_text=True))
+    return [etree.tostring(e, method='c14n') for e in root]
+
 
 def test_loads_bpmn():
-    with open('bpmn20.ecore', 'r',) as fin:
-        g = create_graph_from_file(fin, False)
-    print(g)
+    with open(os.path.join(here, 'bpmn20.ecore'), 'r',) as fin:
+        g = create_graph_from_file(fin, False, False, {})
+    with open(os.path.join(here, 'bpmn20.graphml'), 'rb') as fin:
+        expected = fin.read()
+    assert serialize(g) == expected
+
+
+def build(builder, tree):
+    package = tree.getroot()
+    builder.add_eclasses(package)
+    builder.add_features(package, EcoreResource(tree))
+    return builder
+
+
+def test_visits_each_feature_once():
+    tree = etree.parse(os.path.join(here, 'bpmn20.ecore'))
+    package = tree.getroot()
+    b = build(CountingBuilder(base_path=here), tree)
+    assert set(b.classifier_visits.values()) == {1}
+    assert len(b.classifier_visits) == len(package.xpath('eClassifiers[@xsi:type="ecore:EClass"]',
+                                                         namespaces={'xsi': 'http://www.w3.org/2001/XMLSchema-instance'}))
+    assert set(b.feature_visits.values()) == {1}
+    assert len(b.feature_visits) == len(package.findall('eClassifiers/eStructuralFeatures'))
+
+
+def test_nested_subpackages():
+    b = build(CountingBuilder(), etree.parse(io.BytesIO(NESTED_ECORE)))
+    assert sorted(c.attrib['name'] for c in b.classifier_visits) == ['A', 'B', 'C']
+    assert set(b.classifier_visits.values()) == {1}
+    assert sorted(sf.attrib['name'] for sf in b.feature_visits) == ['c', 'name', 'parent']
+    g = Graph()
+    g.add_model(b.release())
+    assert len(g.root.findall('node')) == 3
+    assert len(g.root.findall('edge')) == 4
+
+
+MULTI_ROOT_ECORE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<xmi:XMI xmi:version="2.0" xmlns:xmi="http://www.omg.org/XMI" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xmlns:ecore="http://www.eclipse.org/emf/2002/Ecore">
+  <ecore:EPackage name="first" nsURI="http://example.org/first" nsPrefix="first">
+    <eClassifiers xsi:type="ecore:EClass" name="Port"/>
+  </ecore:EPackage>
+  <ecore:EPackage name="second" nsURI="http://example.org/second" nsPrefix="second">
+    <eClassifiers xsi:type="ecore:EClass" name="Port" xmi:id="_port"/>
+  </ecore:EPackage>
+</xmi:XMI>
+"""
+
+
+def test_fragment_index():
+    resource = EcoreResource(etree.parse(io.BytesIO(MULTI_ROOT_ECORE)))
+    first, second = resource.packages
+    assert resource.get_classifier('//Port').getparent() is first
+    assert resource.get_classifier('/0/Port').getparent() is first
+    assert resource.get_classifier('/1/Port').getparent() is second
+    assert resource.get_element_by_id('_port') is resource.get_classifier('/1/Port')
+    with pytest.raises(EcoreReferenceError):
+        resource.get_classifier('//Missing')
+    nested = EcoreResource(etree.parse(io.BytesIO(NESTED_ECORE)))
+    assert nested.get_classifier('//sub/subsub/C') is nested.get_element_by_id('_c')
+
+
+def test_resolve_type_is_memoized():
+    resource = EcoreResource(etree.parse(io.BytesIO(NESTED_ECORE)))
+    b = ModelBuilder()
+    first = b.resolve_type(resource, '#//sub/B')
+    assert first[0].attrib['name'] == 'B'
+    resource.fragments.clear()
+    assert b.resolve_type(resource, '#//sub/B') == first
+
+
+EXTERNAL_ECORE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<ecore:EPackage xmi:version="2.0" xmlns:xmi="http://www.omg.org/XMI" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xmlns:ecore="http://www.eclipse.org/emf/2002/Ecore" name="ext" nsURI="http://example.org/ext" nsPrefix="ext">
+  <eClassifiers xsi:type="ecore:EClass" name="Ext"/>
+</ecore:EPackage>
+"""
+
+REFERENCING_ECORE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<ecore:EPackage xmi:version="2.0" xmlns:xmi="http://www.omg.org/XMI" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xmlns:ecore="http://www.eclipse.org/emf/2002/Ecore" name="main" nsURI="http://example.org/main" nsPrefix="main">
+  <eClassifiers xsi:type="ecore:EClass" name="A" eSuperTypes="ext.ecore#//Ext">
+    <eStructuralFeatures xsi:type="ecore:EReference" name="one" eType="ecore:EClass ext.ecore#//Ext"/>
+    <eStructuralFeatures xsi:type="ecore:EReference" name="two" eType="ecore:EClass http://example.org/ext#//Ext"/>
+  </eClassifiers>
+</ecore:EPackage>
+"""
+
+
+def test_external_metamodels_are_parsed_once(tmp_path):
+    import ecore2yed
+    (tmp_path / 'ext.ecore').write_bytes(EXTERNAL_ECORE)
+    resource_set = ecore2yed.ResourceSet()
+    schema_location = {'http://example.org/ext': 'ext.ecore'}
+    g = create_graph_from_file(io.BytesIO(REFERENCING_ECORE), True, False, schema_location, resource_set=resource_set,
+                               base_path=str(tmp_path))
+    assert resource_set.misses == 1
+    assert resource_set.hits == 1
+    assert len(g.root.findall('node')) == 2
+    assert len(g.root.findall('edge')) == 3
+
+
+def test_catalog_index(tmp_path):
+    import ecore2yed
+    ext = tmp_path / 'ext.ecore'
+    ext.write_bytes(EXTERNAL_ECORE)
+    index_path = str(tmp_path / 'index.json')
+    schema_location = {'http://example.org/ext': 'ext.ecore'}
+    report = ecore2yed.warm_catalog_index(ecore2yed.CatalogIndex(index_path), schema_location, str(tmp_path))
+    assert report == [('http://example.org/ext', str(ext), True)]
+
+    index = ecore2yed.CatalogIndex(index_path)
+    assert isinstance(index.get_resource(str(ext)), ecore2yed.IndexedResource)
+    expected = serialize(create_graph_from_file(io.BytesIO(REFERENCING_ECORE), True, False, schema_location,
+                                                base_path=str(tmp_path)))
+    g = create_graph_from_file(io.BytesIO(REFERENCING_ECORE), True, False, schema_location,
+                               resource_set=ecore2yed.ResourceSet(index), base_path=str(tmp_path))
+    assert serialize(g) == expected
+
+    ext.write_bytes(EXTERNAL_ECORE.replace(b'name="Ext"', b'name="Ext" abstract="true"'))
+    resource = index.get_resource(str(ext))
+    assert isinstance(resource, ecore2yed.EcoreResource)
+    assert resource.get_eclass('//Ext').attrib['abstract'] == 'true'
+    index.save()
+    assert ecore2yed.CatalogIndex(index_path).get_resource(str(ext)).get_eclass('//Ext').attrib['abstract'] == 'true'
+
+    # Indexes sharing the file (e.g. batch workers) merge their entries on save
+    other = tmp_path / 'other.ecore'
+    other.write_bytes(EXTERNAL_ECORE)
+    first, second = ecore2yed.CatalogIndex(index_path), ecore2yed.CatalogIndex(index_path)
+    first.get_resource(str(other))
+    second.get_resource(str(tmp_path / 'missing.ecore'))
+    ext.write_bytes(EXTERNAL_ECORE)
+    second.get_resource(str(ext))
+    first.save()
+    second.save()
+    assert set(ecore2yed.CatalogIndex(index_path).entries) == {str(ext), str(other)}
+    assert [p.name for p in tmp_path.iterdir() if p.name.endswith('.tmp')] == []
+
+
+def test_converter_is_reentrant():
+    from concurrent.futures import ThreadPoolExecutor
+    from ecore2yed import Converter
+    converter = Converter()
+    path = os.path.join(here, 'bpmn20.ecore')
+    with open(os.path.join(here, 'bpmn20.graphml'), 'rb') as fin:
+        expected = fin.read()
+    with ThreadPoolExecutor(4) as executor:
+        graphs = list(executor.map(converter.convert, [path] * 8))
+    for g in graphs:
+        assert serialize(g) == expected
+        assert not g.class_to_id
+
+
+def test_batch(tmp_path, capsys):
+    from ecore2yed import batch_main
+    models = tmp_path / 'models'
+    (models / 'sub').mkdir(parents=True)
+    (models / 'bpmn20.ecore').write_bytes(open(os.path.join(here, 'bpmn20.ecore'), 'rb').read())
+    (models / 'sub' / 'nested.ecore').write_bytes(NESTED_ECORE)
+    assert batch_main([str(models), '-j', '2']) == 0
+    with open(os.path.join(here, 'bpmn20.graphml'), 'rb') as fin:
+        assert canonical((models / 'bpmn20.graphml').read_bytes()) == canonical(fin.read())
+    assert (models / 'sub' / 'nested.graphml').exists()
+
+    (models / 'broken.ecore').write_bytes(b'<ecore:EPackage')
+    out = tmp_path / 'out'
+    assert batch_main([str(models / '*.ecore'), '-o', str(out), '-j', '2']) == 1
+    assert (out / 'bpmn20.graphml').exists()
+    report = capsys.readouterr().out
+    assert 'FAIL' in report and 'broken.ecore' in report
+
+    # Outputs keep the location of their input relative to the searched directory
+    (models / 'broken.ecore').unlink()
+    (models / 'nested.ecore').write_bytes(NESTED_ECORE)
+    assert batch_main([str(models), '-o', str(out), '-j', '2']) == 0
+    assert (out / 'nested.graphml').exists() and (out / 'sub' / 'nested.graphml').exists()
+    with pytest.raises(SystemExit):
+        batch_main([str(models / 'nested.ecore'), str(models / 'sub' / 'nested.ecore'), '-o', str(out)])
+
+
+@pytest.mark.parametrize('pretty_print', [True, False])
+def test_streaming_writer(tmp_path, pretty_print):
+    import ecore2yed
+    from ecore2yed import Converter
+    output = tmp_path / 'bpmn20.graphml'
+    Converter().convert_to_file(os.path.join(here, 'bpmn20.ecore'), str(output), pretty_print)
+    data = output.read_bytes()
+    with open(os.path.join(here, 'bpmn20.graphml'), 'rb') as fin:
+        assert canonical(data) == canonical(fin.read())
+    assert (b'</node>\n<node' in data) == pretty_print
+    assert data.count(b'xmlns:y=') == 1
+    assert os.listdir(str(tmp_path)) == ['bpmn20.graphml']     # No temporary file left
+    assert os.stat(str(output)).st_mode & 0o777 == 0o666 & ~ecore2yed.file_umask
+
+
+def test_compressed_output(tmp_path):
+    import gzip
+    from ecore2yed import Converter
+    converter = Converter()
+    plain = tmp_path / 'bpmn20.graphml'
+    compressed = tmp_path / 'bpmn20.graphmlz'
+    converter.convert_to_file(os.path.join(here, 'bpmn20.ecore'), str(plain))
+    converter.convert_to_file(os.path.join(here, 'bpmn20.ecore'), str(compressed))
+    assert gzip.decompress(compressed.read_bytes()) == plain.read_bytes()
+    assert compressed.stat().st_size * 10 < plain.stat().st_size
+    assert compressed.read_bytes()[10:].split(b'\0')[0] == b'bpmn20.graphml'     # The name in the gzip header
+    fastest = tmp_path / 'fastest.graphmlz'
+    converter.convert_to_file(os.path.join(here, 'bpmn20.ecore'), str(fastest), compresslevel=1)
+    assert gzip.decompress(fastest.read_bytes()) == plain.read_bytes()
+    with pytest.raises(ValueError):
+        converter.convert_to_file(os.path.join(here, 'bpmn20.ecore'), str(plain), compresslevel=1)
+
+
+def test_synthetic_metamodel(tmp_path):
+    from benchmarks import ecoregen
+    from ecore2yed import Converter
+    classes = 50
+    path = ecoregen.write_metamodel(str(tmp_path), 'synthetic', classes, attributes=2, references=2, opposites=1,
+                                    supertypes=2, depth=2, external=1)
+    package = etree.parse(path).getroot()
+    eclasses = list(package.iter('eClassifiers'))
+    assert len(eclasses) == classes
+    external_types = {sf.attrib['eType'] for sf in package.iter('eStructuralFeatures')
+                      if 'external' in sf.attrib['eType']}
+    super_types = sum(len(c.attrib.get('eSuperTypes', '').split()) for c in eclasses)
+    g = Converter(create_external=True).convert(path, str(tmp_path))
+    assert len(g.root.findall('node')) == classes + len(external_types)
+    # References, one edge per eOpposite pair, super types and external references
+    assert len(g.root.findall('edge')) == classes * (2 + 1 + 1) + super_types
+
+
+def test_profile(tmp_path):
+    from ecore2yed import Converter
+    profiles = []
+    converter = Converter(on_profile=profiles.append)
+    converter.convert_to_file(os.path.join(here, 'bpmn20.ecore'), str(tmp_path / 'bpmn20.graphml'))
+    profile, = profiles
+    assert list(profile.times)[:3] == ['total', 'parse', 'index']
+    assert profile.calls['add_features'] == 1
+    assert profile.calls['serialize'] == len(canonical((tmp_path / 'bpmn20.graphml').read_bytes()))
+    assert profile.counters['opposite_pairs'] == 17
+    assert profile.counters['resolved_external'] == 1
+    assert profile.counters['resolved_ecore'] > 0
+    assert profile.counters['resolved_fragment'] > 0
+    assert 'external_parses' not in profile.counters
+    assert set(profile.to_dict()) == {'phases', 'counters'}
+    assert 'emit' in profile.report()
+
+
+OPPOSITES_ECORE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<ecore:EPackage xmi:version="2.0" xmlns:xmi="http://www.omg.org/XMI" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xmlns:ecore="http://www.eclipse.org/emf/2002/Ecore" name="opp" nsURI="http://example.org/opp" nsPrefix="opp">
+  <eClassifiers xsi:type="ecore:EClass" name="Parent">
+    <eStructuralFeatures xsi:type="ecore:EReference" name="children" upperBound="-1" eType="#//sub/Child"
+        containment="true" eOpposite="#//sub/Child/parent"/>
+  </eClassifiers>
+  <eSubpackages name="sub" nsURI="http://example.org/opp/sub" nsPrefix="sub">
+    <eClassifiers xsi:type="ecore:EClass" name="Child">
+      <eStructuralFeatures xsi:type="ecore:EReference" name="parent" eType="#//Parent" eOpposite="#//Parent/children"/>
+      <eStructuralFeatures xsi:type="ecore:EReference" name="next" eType="#//sub/Child"/>
+    </eClassifiers>
+  </eSubpackages>
+</ecore:EPackage>
+"""
+
+
+def test_opposites_emit_one_edge():
+    g = create_graph_from_file(io.BytesIO(OPPOSITES_ECORE), False, False, {})
+    edges = g.root.findall('edge')
+    assert sorted(e.attrib['id'] for e in edges) == ['e0', 'e1']
+    pair = edges[0]
+    assert (pair.attrib['source'], pair.attrib['target']) == ('n0', 'n1')
+    labels = [label.text for label in pair.iter('{http://www.yworks.com/xml/graphml}EdgeLabel')]
+    assert labels == ['children', '0..*', 'parent', '0..1']
+
+
+def test_intermediate_model():
+    from ecore2yed import Converter, EReferenceInfo, ESuperTypeInfo
+    model = Converter().build_model(io.BytesIO(NESTED_ECORE))
+    a, b, c = model.classes
+    assert [cls.name for cls in model.classes] == ['A', 'B', 'C']
+    assert [(attr.name, attr.type_name) for attr in b.attributes] == [('name', 'EString')]
+    assert not hasattr(a, '__dict__')
+    references = [e for e in model.edges if isinstance(e, EReferenceInfo)]
+    assert [(r.name, r.source, r.target) for r in references] == [('parent', a, a), ('c', a, c)]
+    super_types = [e for e in model.edges if isinstance(e, ESuperTypeInfo)]
+    assert [(s.eclass, s.super_type) for s in super_types] == [(b, a), (c, b)]
+    pair, = Converter().build_model(io.BytesIO(OPPOSITES_ECORE)).edges[:1]
+    assert (pair.name, pair.opposite.name, pair.opposite.opposite) == ('children', 'parent', pair)
+
+
+def test_low_memory_input():
+    from ecore2yed import Converter, parse_skeleton
+    tree = parse_skeleton(os.path.join(here, 'bpmn20.ecore'))
+    assert tree.find('.//eAnnotations') is None
+    assert tree.find('.//eOperations') is None
+    g = Converter(low_memory=True).convert(os.path.join(here, 'bpmn20.ecore'), here)
+    with open(os.path.join(here, 'bpmn20.graphml'), 'rb') as fin:
+        assert serialize(g) == fin.read()
+
+
+def test_multiple_packages(tmp_path):
+    from ecore2yed import Converter, get_package_name
+    g = create_graph_from_file(io.BytesIO(MULTI_ROOT_ECORE), False, False, {})
+    assert len(g.root.findall('node')) == 2
+    resource = EcoreResource(etree.parse(io.BytesIO(MULTI_ROOT_ECORE)))
+    assert get_package_name(resource, '/1/Port') == 'second'
+    assert get_package_name(resource, '//Port') == 'first'
+    assert get_package_name(resource, '//sub/subsub/C') == 'subsub'
+    # Packages as group nodes
+    converter = Converter(groups=True)
+    g = converter.convert(io.BytesIO(NESTED_ECORE))
+    root, = g.root.findall('node')
+    assert root.attrib['yfiles.foldertype'] == 'group'
+    assert [n.attrib['id'] for n in root.iter('{*}node')] == ['n0', 'n1', 'n2', 'n3', 'n4', 'n5']
+    assert len(g.root.findall('edge')) == 4
+    output = tmp_path / 'nested.graphml'
+    (tmp_path / 'nested.ecore').write_bytes(NESTED_ECORE)
+    converter.convert_to_file(str(tmp_path / 'nested.ecore'), str(output))
+    assert canonical(output.read_bytes()) == canonical(serialize(g))
+
+
+def test_incremental(tmp_path, capsys):
+    from ecore2yed import batch_main, Converter, Manifest
+    (tmp_path / 'ext.ecore').write_bytes(EXTERNAL_ECORE)
+    (tmp_path / 'main.ecore').write_bytes(REFERENCING_ECORE)
+    input, output = str(tmp_path / 'main.ecore'), str(tmp_path / 'main.graphml')
+    manifest = Manifest(str(tmp_path / 'manifest.json'))
+    converter = Converter(True)
+    assert converter.convert_incremental(input, output, manifest)
+    assert not converter.convert_incremental(input, output, manifest)
+    assert not Converter(True).convert_incremental(input, output, manifest)
+    assert Converter(False).convert_incremental(input, output, manifest)   # Other options
+    assert not Converter(False).convert_incremental(input, output, manifest)
+    os.utime(input, ns=(0, 0))  # Touched, same content
+    assert not Converter(False).convert_incremental(input, output, manifest)
+    (tmp_path / 'ext.ecore').write_bytes(EXTERNAL_ECORE.replace(b'name="Ext"', b'name="Ext" abstract="true"'))
+    assert Converter(False).convert_incremental(input, output, manifest)  # A dependency changed
+    manifest.save()
+    assert not Converter(False).convert_incremental(input, output, Manifest(str(tmp_path / 'manifest.json')))
+
+    manifest_path = str(tmp_path / 'batch.json')
+    assert batch_main([input, '--incremental', manifest_path, '-j', '1']) == 0
+    assert batch_main([input, '--incremental', manifest_path, '-j', '1']) == 0
+    report = capsys.readouterr().out
+    assert report.count('OK ') == 1 and report.count('SKIP') == 1
+
+
+def test_layout_preserving_update(tmp_path):
+    from ecore2yed import Converter
+    y = '{http://www.yworks.com/xml/graphml}'
+    gml = '{http://graphml.graphdrawing.org/xmlns/graphml}'
+    input, output = tmp_path / 'nested.ecore', tmp_path / 'nested.graphml'
+    input.write_bytes(NESTED_ECORE)
+    Converter(stable_ids=True, groups=True).convert_to_file(str(input), str(output))
+    root = etree.parse(str(output)).getroot()
+    ids = [n.attrib['id'] for n in root.iter(gml + 'node')]
+    assert ids == ['n-', 'n-A', 'n-sub.', 'n-sub.B', 'n-sub.subsub.', 'n-sub.subsub.C']
+    assert 'e-A.c' in [e.attrib['id'] for e in root.iter(gml + 'edge')]
+    # Lay the graph out and save it with other ids, as yEd does
+    for i, n in enumerate(root.iter(gml + 'node')):
+        n.attrib['id'] = 'n{}'.format(i)
+        shape = n.find('{0}data/*'.format(gml))
+        if shape.tag == y + 'ProxyAutoBoundsNode':
+            shape = shape.find('{0}Realizers/{0}GroupNode'.format(y))
+        shape.insert(0, etree.Element(y + 'Geometry', x=str(i * 100), y='0', width='90', height='30'))
+    edge = next(e for e in root.iter(gml + 'edge') if e.attrib['id'] == 'e-A.c')
+    edge.find('{0}data/{1}PolyLineEdge'.format(gml, y)).insert(0, etree.Element(y + 'Path', sx='1', sy='2'))
+    output.write_bytes(etree.tostring(root))
+    # Remove C and add D
+    input.write_bytes(NESTED_ECORE.replace(b'name="C"', b'name="D"').replace(b'subsub/C"', b'subsub/D"'))
+    profiles = []
+    Converter(groups=True, update=True, on_profile=profiles.append).convert_to_file(str(input), str(output))
+    root = etree.parse(str(output)).getroot()
+    geometry = {n.attrib['id']: n.find('.//' + y + 'Geometry') for n in root.iter(gml + 'node')}
+    assert geometry['n-A'].attrib['x'] == '100'
+    assert geometry['n-sub.subsub.D'] is None
+    assert root.find('.//{}edge[@id="e-A.c"]//{}Path'.format(gml, y)).attrib['sy'] == '2'
+    assert root.find('.//{}edge[@id="e-A.parent"]//{}Path'.format(gml, y)) is None
+    counters = profiles[0].counters
+    assert (counters['layout_kept'], counters['layout_added'], counters['layout_removed']) == (5, 1, 1)
+    # With the automatic layout, the groups enclose the restored geometry of their classes
+    Converter(groups=True, update=True, auto_layout=True).convert_to_file(str(input), str(output))
+    root = etree.parse(str(output)).getroot()
+    boxes = {n.attrib['id']: [float(n.find('.//' + y + 'Geometry').attrib[k]) for k in ('x', 'y', 'width', 'height')]
+             for n in root.iter(gml + 'node')}
+    assert boxes['n-A'] == [100, 0, 90, 30] and boxes['n-sub.B'] == [300, 0, 90, 30]
+    for group, member in (('n-', 'n-A'), ('n-', 'n-sub.B'), ('n-sub.', 'n-sub.B'), ('n-sub.subsub.', 'n-sub.subsub.D')):
+        (gx, gy, gw, gh), (x, y0, w, h) = boxes[group], boxes[member]
+        assert gx < x and gy < y0 and x + w < gx + gw and y0 + h < gy + gh
+
+
+def test_auto_layout():
+    from ecore2yed import Converter, LayeredLayout
+    y = '{http://www.yworks.com/xml/graphml}'
+    model = Converter().build_model(io.BytesIO(NESTED_ECORE))
+    a, b, c = model.classes
+    geometry = LayeredLayout(model).compute()
+    assert geometry[a][1] < geometry[b][1] < geometry[c][1]     # Super types above their subclasses
+    assert geometry[a][3] == 30 and geometry[b][3] == 30 + 18
+    g = Converter(auto_layout=True, groups=True).convert(io.BytesIO(NESTED_ECORE))
+    boxes = {}
+    for node in g.root.iter('{*}node'):
+        box = node.find('{*}data//' + y + 'Geometry')
+        boxes[node.attrib['id']] = [float(box.attrib[k]) for k in ('x', 'y', 'width', 'height')]
+    assert len(boxes) == 6
+    x, y0, w, h = boxes['n0']   # The root package contains all classes
+    assert all(x < bx and y0 < by and bx + bw < x + w and by + bh < y0 + h
+               for bx, by, bw, bh in (boxes[n] for n in ('n1', 'n3', 'n5')))
+    paths = [e.find('.//' + y + 'Path') for e in g.root.iter('{*}edge')
+             if e.find('.//' + y + 'Arrows').attrib['source'] == 'white_delta']
+    assert len(paths) == 2 and all(float(p.attrib['sy']) > 0 > float(p.attrib['ty']) for p in paths)
+
+    # Each package is laid out on its own, so the groups of sibling packages do not overlap
+    g = Converter(auto_layout=True, groups=True).convert(io.BytesIO(SIBLINGS_ECORE))
+    boxes = []
+    for group in g.root.iter('{*}graph'):
+        box = group.getparent().find('{*}data//' + y + 'Geometry')
+        boxes.append([float(box.attrib[k]) for k in ('x', 'y', 'width', 'height')])
+    (x1, y1, w1, h1), (x2, y2, w2, h2) = boxes[1:]
+    assert x1 + w1 < x2 or x2 + w2 < x1 or y1 + h1 < y2 or y2 + h2 < y1
+
+
+def test_views(tmp_path):
+    from ecore2yed import Converter, ModelIndex, View
+    model = Converter().build_model(io.BytesIO(NESTED_ECORE))
+    a, b, c = model.classes
+    index = ModelIndex(model)
+    assert index.select(View(['C'])) == {a, b, c}        # A contains C
+    assert index.select(View(['C'], edges='inheritance')) == {b, c}
+    assert index.select(View(['C'], radius=2, edges='inheritance')) == {a, b, c}
+    assert index.select(View(['C'], radius=2, exclude=['B'])) == {a, c}
+    view = index.slice(View(exclude=['sub/*']))
+    assert view.classes == [a] and len(view.edges) == 1     # The self reference
+    assert [p.key for p in view.packages] == ['//'] and not view.packages[0].subpackages
+    view = index.slice(View(include=['sub/subsub/*']))
+    assert view.classes == [c] and not view.edges and not view.packages[0].classes
+    source = tmp_path / 'nested.ecore'
+    source.write_bytes(NESTED_ECORE)
+    outputs = [(str(tmp_path / 'a.graphml'), View(['A'], edges='containment')),
+               (str(tmp_path / 'b.graphml'), View(['B'], radius=0))]
+    Converter().convert_views(str(source), outputs)
+    a_graph = etree.parse(outputs[0][0]).getroot()
+    assert len(a_graph.findall('.//{*}node')) == 2 and len(a_graph.findall('.//{*}edge')) == 1
+    b_graph = etree.parse(outputs[1][0]).getroot()
+    assert len(b_graph.findall('.//{*}node')) == 1 and not b_graph.findall('.//{*}edge')
+
+
+def test_partitions(tmp_path):
+    from ecore2yed import Converter, ModelIndex, Partitioning
+    model = Converter().build_model(io.BytesIO(NESTED_ECORE))
+    a, b, c = model.classes
+    partitioning = Partitioning(ModelIndex(model), 1)
+    assert partitioning.chunks == [[a], [b], [c]]
+    chunk, ghosts = partitioning.slice(0)
+    assert chunk.classes[0] is a and set(ghosts) == {b, c}
+    assert all(g.external and g.key == o.key and not g.attributes for o, g in ghosts.items())
+    assert {e.key for e in chunk.edges} == {'//A/parent', '//A/c', '//sub/B->//A'}
+    partitioning = Partitioning(ModelIndex(model), 2, 'graph')
+    assert partitioning.chunks == [[a, b], [c]]
+    assert sorted(partitioning.iter_cross_edges()) == [(0, 1), (1, 0)]
+    source = tmp_path / 'nested.ecore'
+    source.write_bytes(NESTED_ECORE)
+    outputs = Converter().convert_partitions(str(source), str(tmp_path / 'nested.graphml'), 2, 'graph')
+    assert [os.path.basename(o) for o in outputs] == ['nested.part1.graphml', 'nested.part2.graphml']
+    overview = etree.parse(str(tmp_path / 'nested.graphml')).getroot()
+    url = overview.find('{*}key[@attr.name="url"]').attrib['id']
+    assert [d.text for d in overview.iter('{*}data') if d.attrib['key'] == url] == [os.path.basename(o)
+                                                                                     for o in outputs]
+    edges = overview.findall('{*}edge')     # One edge per pair of chunks, whatever the direction
+    assert len(edges) == 1 and '2 edges' in etree.tostring(edges[0], encoding='unicode')
+    part2 = etree.parse(outputs[1]).getroot()
+    assert len(part2.findall('.//{*}node')) == 3    # C, and A and B from the first chunk
+    assert [d.text for d in part2.iter('{*}data') if d.attrib['key'] == url] == ['nested.part1.graphml'] * 2
+
+
+def test_resource_set_lru(tmp_path):
+    import ecore2yed
+    paths = []
+    for name in ('a', 'b', 'c'):
+        paths.append(str(tmp_path / (name + '.ecore')))
+        (tmp_path / (name + '.ecore')).write_bytes(EXTERNAL_ECORE)
+    resource_set = ecore2yed.ResourceSet(max_size=2, validate=True)
+    a = resource_set.get_resource(paths[0])
+    resource_set.get_resource(paths[1])
+    assert resource_set.get_resource(paths[0]) is a     # a is now the most recently used
+    resource_set.get_resource(paths[2])
+    assert list(resource_set.resources) == [paths[0], paths[2]] and resource_set.evictions == 1
+    (tmp_path / 'a.ecore').write_bytes(EXTERNAL_ECORE.replace(b'name="Ext"', b'name="Changed"'))
+    os.utime(paths[0], ns=(0, 0))
+    assert resource_set.get_resource(paths[0]) is not a
+    assert (resource_set.hits, resource_set.misses) == (1, 4)
+    (tmp_path / 'broken.ecore').write_bytes(b'<ecore:EPackage')
+    with pytest.raises(etree.XMLSyntaxError):
+        resource_set.get_resource(str(tmp_path / 'broken.ecore'))
+    assert not resource_set.loading     # Failed loads are not left in progress
+
+
+def test_conversion_server(tmp_path):
+    import json
+    import threading
+    from http.client import HTTPConnection
+    import ecore2yed
+    (tmp_path / 'ext.ecore').write_bytes(EXTERNAL_ECORE)
+    (tmp_path / 'main.ecore').write_bytes(REFERENCING_ECORE)
+    service = ecore2yed.ConversionService(ecore2yed.ResourceSet(max_size=4, validate=True), create_external=True,
+                                          schema_location={'http://example.org/ext': 'ext.ecore'})
+    server = ecore2yed.ConversionHTTPServer(('127.0.0.1', 0), service)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        connection = HTTPConnection(*server.server_address[:2])
+        path = str(tmp_path / 'main.ecore')
+        for body in (None, REFERENCING_ECORE):  # From the file, then inline (relative to the file's folder)
+            connection.request('POST', '/convert?path=' + path, body)
+            response = connection.getresponse()
+            graph = etree.fromstring(response.read())
+            assert response.status == 200 and 'emit;dur=' in response.getheader('Server-Timing')
+            assert len(graph.findall('{*}node')) == 2 and len(graph.findall('{*}edge')) == 3
+        connection.request('POST', '/convert', b'<not ecore')
+        response = connection.getresponse()
+        assert response.status == 400 and b'XMLSyntaxError' in response.read()
+        connection.request('GET', '/metrics')
+        metrics = json.loads(connection.getresponse().read())
+        assert metrics['requests'] == 3 and metrics['errors'] == 1 and metrics['latency']['count'] == 2
+        assert metrics['cache'] == {'size': 1, 'max_size': 4, 'hits': 3, 'misses': 1, 'evictions': 0}
+        connection.putrequest('POST', '/convert')
+        connection.putheader('Content-Length', 'many')
+        connection.endheaders()
+        response = connection.getresponse()
+        assert response.status == 400 and b'Content-Length' in response.read()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_watch(tmp_path):
+    import threading
+    import ecore2yed
+    ext = tmp_path / 'ext.ecore'
+    ext.write_bytes(EXTERNAL_ECORE)
+    main = tmp_path / 'main.ecore'
+    main.write_bytes(REFERENCING_ECORE)
+    output = str(tmp_path / 'main.graphml')
+    resource_set = ecore2yed.ResourceSet(validate=True)
+    converter = ecore2yed.Converter(True, schema_location={'http://example.org/ext': 'ext.ecore'},
+                                    resource_set=resource_set)
+    dependencies = converter.convert_to_file(str(main), output)
+    assert dependencies == {str(ext)}
+    monitor = ecore2yed.PollingMonitor(0.01)
+    monitor.watch({str(main), str(ext)})
+    conversions = []
+    watcher = ecore2yed.Watcher(converter.convert_to_file, {str(main): output}, monitor, debounce=0.05,
+                                report=lambda *result: conversions.append(result))
+    assert watcher.get_affected({str(ext)}) == [] and watcher.get_affected({str(main)}) == [str(main)]
+    thread = threading.Thread(target=watcher.run, kwargs={'dependencies': {str(main): dependencies}, 'rounds': 1})
+    thread.start()
+    main.write_bytes(REFERENCING_ECORE.replace(b'name="A"', b'name="AB"'))
+    thread.join(5)
+    assert not thread.is_alive()
+    assert [(c[0], c[2]) for c in conversions] == [(str(main), None)]
+    assert watcher.get_affected({str(ext)}) == [str(main)]
+    assert resource_set.misses == 1     # The unchanged external metamodel was reused
+    assert b'>AB<' in open(output, 'rb').read()
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is only available on Linux')
+def test_inotify_monitor(tmp_path):
+    import ecore2yed
+    path = str(tmp_path / 'model.ecore')
+    monitor = ecore2yed.InotifyMonitor()
+    try:
+        monitor.watch({path})
+        (tmp_path / 'other.ecore').write_bytes(EXTERNAL_ECORE)
+        assert monitor.wait(0.05) == set()
+        (tmp_path / 'model.tmp').write_bytes(EXTERNAL_ECORE)
+        os.replace(str(tmp_path / 'model.tmp'), path)   # Saved as most editors do
+        assert monitor.wait(2) == {path}
+    finally:
+        monitor.close()
+
+
+def test_prefetch(tmp_path):
+    import ecore2yed
+    (tmp_path / 'ext.ecore').write_bytes(EXTERNAL_ECORE)
+    source = REFERENCING_ECORE.replace(b'</eClassifiers>', b'''
+    <eStructuralFeatures xsi:type="ecore:EReference" name="missing" eType="ecore:EClass missing.ecore#//M"/>
+    <eStructuralFeatures xsi:type="ecore:EReference" name="unknown" eType="ecore:EClass http://example.org/x#//X"/>
+  </eClassifiers>''')
+    schema_location = {'http://example.org/ext': 'ext.ecore'}
+    assert list(ecore2yed.iter_metamodel_refs(etree.fromstring(source))) == [
+        'ext.ecore', 'http://example.org/ext', 'missing.ecore', 'http://example.org/x']
+    resource_set = ecore2yed.ResourceSet()
+    builder = ModelBuilder(True, schema_location, resource_set, str(tmp_path))
+    assert builder.prefetch([etree.fromstring(source)], 2) == [
+        ('http://example.org/x', None, 'not in the catalog'),
+        ('missing.ecore', str(tmp_path / 'missing.ecore'), 'could not be read')]
+    assert set(resource_set.resources) == {str(tmp_path / 'ext.ecore'), str(tmp_path / 'missing.ecore')}
+    profile = ecore2yed.Profile()
+    builder = ModelBuilder(True, schema_location, resource_set, str(tmp_path), profile)
+    assert len(builder.prefetch([etree.fromstring(source)], 2)) == 2
+    assert profile.counters['prefetched'] == 0     # Nothing left to load, the loaded metamodels are not read again
+    expected = serialize(ecore2yed.Converter(True, schema_location=schema_location).convert(
+        io.BytesIO(source), str(tmp_path)))
+    with pytest.warns(UserWarning, match='missing.ecore .* could not be prefetched') as record:
+        g = ecore2yed.Converter(True, schema_location=schema_location, prefetch=2).convert(io.BytesIO(source),
+                                                                                           str(tmp_path))
+    assert serialize(g) == expected
+    assert len(record) == 2     # Each missing metamodel is reported once